@@ -1,10 +1,9 @@
 import threading
 import time
-import cv2
-import numpy as np
 from utils.toast_notify import show_toast
-from utils.adb_tools import ScreenshotSocket, TouchServerSocket
+from utils.adb_tools import get_screenshot_pool
 from position_config import COLLECT_POINTS, ASSIST_POINTS, EXPEDITION_POINTS
+from utils.state_classifier import MatchRule, StateClassifier
 import global_state as gs
 from expedition_core import run_expedition_once, is_expedition_enabled, is_expedition_running
 
@@ -13,6 +12,7 @@ assist_running = threading.Event()
 selected_points = []
 pause_event = threading.Event()
 pause_callback = None
+_collect_input = None  # start_collect 传入的输入句柄，stop_collect 时丢弃其排队中的点击
 
 def register_main_callbacks(pause_evt, pause_func):
     global pause_event, pause_callback
@@ -24,14 +24,44 @@ def set_collect_points(points):
     selected_points = points.copy()
     gs.current_collect_points = points.copy()
 
-def capture_screen_safe():
+# 助力线程只看这几个区域，截图时只请求它们
+ASSIST_CAPTURE_REGIONS = [
+    ASSIST_POINTS["聊天关闭识别区域"],
+    ASSIST_POINTS["助力图标识别区域"],
+    EXPEDITION_POINTS["摸鱼队伍区域"],
+]
+
+# 助力线程的三项检查；配合增量截图，区域没变化时直接沿用上一轮分数
+ASSIST_RULES = [
+    MatchRule("chat_close", "icons/ZY-LT.png", ASSIST_POINTS["聊天关闭识别区域"], 0.8, 0, True),
+    MatchRule("zhuli", "icons/zhuli.png", ASSIST_POINTS["助力图标识别区域"], 0.8, 1, True),
+    MatchRule("moyu", "icons/CJ-YZ.png", EXPEDITION_POINTS["摸鱼队伍区域"], 0.85, 2),
+]
+assist_classifier = StateClassifier(ASSIST_RULES)
+
+def capture_assist_frame():
+    """助力线程截图：服务端支持增量截图时只传变化的瓦片，否则只请求要看的几个区域"""
+    pool = get_screenshot_pool()
     try:
-        screenshot_socket = ScreenshotSocket(host="127.0.0.1", port=6101)
-        data = screenshot_socket.request_screenshot()
-        if data:
+        if pool.supports("delta"):
+            frame = pool.capture_delta()
+            if frame is None:
+                print("❌ 助力无法获取截图")
+            return frame
+    except Exception as e:
+        print(f"❌ 助力截图异常: {e}")
+        return None
+    return capture_screen_safe(ASSIST_CAPTURE_REGIONS)
+
+def capture_screen_safe(regions=None):
+    try:
+        if regions:
+            image = get_screenshot_pool().capture_regions(regions)
+        else:
+            image = get_screenshot_pool().capture()
+        if image is not None:
             print("[助力] 已获取截图数据")
-            image = np.frombuffer(data, dtype=np.uint8)
-            return cv2.imdecode(image, cv2.IMREAD_COLOR)
+            return image
         else:
             print("❌ 助力无法获取截图")
             return None
@@ -39,47 +69,34 @@ def capture_screen_safe():
         print(f"❌ 助力截图异常: {e}")
         return None
 
-def match_template(screen, template, region, threshold=0.8):
-    left, top, right, bottom = region
-    region_img = screen[top:bottom, left:right]
-    result = cv2.matchTemplate(region_img, template, cv2.TM_CCOEFF_NORMED)
-    _, max_val, _, _ = cv2.minMaxLoc(result)
-    return max_val >= threshold
-
-def has_moyu_icon(screen_img):
-    region = EXPEDITION_POINTS["摸鱼队伍区域"]
-    #print(f"[DEBUG] 摸鱼区域: {region}")
-    template = cv2.imread("icons/CJ-YZ.png", 0)
-    gray = cv2.cvtColor(screen_img[region[1]:region[3], region[0]:region[2]], cv2.COLOR_BGR2GRAY)
-    result = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
-    _, max_val, _, _ = cv2.minMaxLoc(result)
-    print(f"[主页摸鱼识别] 匹配度: {max_val:.3f}")
-    return max_val >= 0.85
-
 def assist_loop(server_socket):
     global pause_callback 
-    zhuli_template = cv2.imread("icons/zhuli.png")
-    close_template = cv2.imread("icons/ZY-LT.png")
     print("[助力] 助力线程启动 ✅")
 
     while assist_running.is_set():
         if pause_event.is_set() or gs.expedition_pause_event.is_set():
             time.sleep(0.5)  # ✅ 挂起
             continue
-        screen = capture_screen_safe()
+        screen = capture_assist_frame()
         if screen is None:
             print("[助力] 截图失败，跳过本轮")
             time.sleep(1)
             continue
 
-        if match_template(screen, close_template, ASSIST_POINTS["聊天关闭识别区域"]):
+        check_moyu = is_expedition_enabled() and not is_expedition_running()
+        names = ("chat_close", "zhuli", "moyu") if check_moyu else ("chat_close", "zhuli")
+        result = assist_classifier.classify(screen, names)
+        if result.reused:
+            print(f"[助力] 区域无变化，沿用上轮结果: {result.reused}")
+
+        if result.matched == "chat_close":
             print("[助力] 识别到聊天关闭图标，执行点击")
             server_socket.tap(*ASSIST_POINTS["关闭聊天窗口"])
             show_toast("聊天已关闭", "✅ 自动点击 /")
             time.sleep(1)
             continue
 
-        if match_template(screen, zhuli_template, ASSIST_POINTS["助力图标识别区域"]):
+        if result.matched == "zhuli":
             print("[助力] 识别到助力图标，点击执行")
             server_socket.tap(*ASSIST_POINTS["点击助力按钮"])
             show_toast("助力已识别", "✅ 已点击助力按钮")
@@ -87,7 +104,9 @@ def assist_loop(server_socket):
             continue
         #print(f"[DEBUG] is_expedition_enabled: {is_expedition_enabled()}, is_expedition_running: {is_expedition_running()}")
 
-        if is_expedition_enabled() and has_moyu_icon(screen) and not is_expedition_running():
+        if "moyu" in result.scores:
+            print(f"[主页摸鱼识别] 匹配度: {result.scores['moyu']:.3f}")
+        if result.matched == "moyu":
             print("[助力] 检测到摸鱼队伍图标，准备请求主控切换远征流程")
             show_toast("⚔️ 摸鱼部队检测", "即将进入远征流程")
             gs.current_task_status_callback("远征中 🚀")
@@ -123,15 +142,14 @@ def collect_loop(server_socket):
         time.sleep(0.01)
 
 def start_parallel_collect(server_socket, point_list):
+    # 所有资源点共用同一个输入句柄，由调度线程统一写出，不再各开一条 6100 连接
     collect_running.set()
     for label in point_list:
         if label not in COLLECT_POINTS:
             continue
-        individual_socket = TouchServerSocket(host="127.0.0.1", port=6100)
-        individual_socket.connect()
-        def click_loop(lbl=label, sock=individual_socket):
+        def click_loop(lbl=label):
             while collect_running.is_set():
-                sock.tap(*COLLECT_POINTS[lbl], delay=0.01)
+                server_socket.tap(*COLLECT_POINTS[lbl], delay=0.01)
                 time.sleep(0.15)
         threading.Thread(target=click_loop, daemon=True).start()
 
@@ -145,6 +163,8 @@ def start_global_collect(server_socket):
     threading.Thread(target=loop, daemon=True).start()
 
 def start_collect(server_socket, points):
+    global _collect_input
+    _collect_input = server_socket
     set_collect_points(points)
     collect_running.clear()  # ✅ 确保先 clear 一次（冗余清理，保证状态对）
     assist_running.clear()
@@ -152,9 +172,13 @@ def start_collect(server_socket, points):
     collect_running.set()
     assist_running.set()
     threading.Thread(target=collect_loop, args=(server_socket,), daemon=True).start()
-    threading.Thread(target=assist_loop, args=(server_socket,), daemon=True).start()
+    threading.Thread(target=assist_loop, args=(server_socket.with_source("assist"),), daemon=True).start()
     print("✅ 采集与助力线程已启动")
 
 def stop_collect():
     collect_running.clear()
     assist_running.clear()
+    # 已排队还没写出的采集 / 助力点击一并丢弃，免得停下后落到裂隙、远征界面上
+    if _collect_input is not None:
+        _collect_input.cancel()
+        _collect_input.with_source("assist").cancel()
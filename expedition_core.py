@@ -2,11 +2,17 @@ import time
 import cv2
 import re
 import numpy as np
-import pytesseract
 import threading
 from utils.toast_notify import show_toast
-from utils.adb_tools import TouchServerSocket, ScreenshotSocket
+from utils.adb_tools import TouchServerSocket, get_screenshot_pool
 from position_config import EXPEDITION_POINTS, SCOUT_POINTS
+from utils.template_store import get_template
+from utils.frame_context import FrameContext, as_frame
+from utils.gesture_macro import GestureMacro
+from utils.recorder import dump_black_boxes
+from utils.digit_ocr import digit_ocr
+from utils.tesseract_engine import DIGITS_CONFIG
+from utils.state_classifier import MatchRule, StateClassifier, match_score
 import global_state as gs
 from global_state import expedition_pause_event
 
@@ -18,11 +24,23 @@ def register_main_callbacks(resume_collect_func, pause_all_func):
     _resume_collect_callback = resume_collect_func
     _pause_all_callback = pause_all_func
     
+# === 远征弹窗识别规则（按顺序判断，命中一个即关闭）===
+POPUP_RULES = [
+    MatchRule("YZ-SJWC.png", "icons/YZ-SJWC.png", EXPEDITION_POINTS["事件完成识别区域"], 0.7, 0),
+    MatchRule("YZ-TFCG.png", "icons/YZ-TFCG.png", EXPEDITION_POINTS["讨伐成功识别区域"], 0.7, 1),
+    MatchRule("YZ-GXHD.png", "icons/YZ-GXHD.png", EXPEDITION_POINTS["恭喜获得识别区域"], 0.7, 2),
+    MatchRule("YZ-CJCG.png", "icons/YZ-CJCG.png", EXPEDITION_POINTS["采集成功识别区域"], 0.7, 3),
+    MatchRule("YZ-LMLD.png", "icons/YZ-LMLD.png", EXPEDITION_POINTS["联盟领地"], 0.85, 10),
+]
+CHECK_POPUP_NAMES = ("YZ-SJWC.png", "YZ-TFCG.png", "YZ-CJCG.png")
+popup_classifier = StateClassifier(POPUP_RULES)
+POPUP_REGIONS = [rule.region for rule in POPUP_RULES]  # 弹窗 + 联盟领地识别只需要截这些区域
+# 等待页面出现的轮询：中间不点击时开预取，间隔短于预取有效期（0.3 秒），下一张图在识别期间就已截好
+POLL_INTERVAL = 0.2
+
 def has_idle_troop(screen):
     region = EXPEDITION_POINTS["空闲部队识别区域"]
-    tpl = cv2.imread("icons/YZ-LXZY-KXBD.png", 0)
-    gray = cv2.cvtColor(screen[region[1]:region[3], region[0]:region[2]], cv2.COLOR_BGR2GRAY)
-    return cv2.minMaxLoc(cv2.matchTemplate(gray, tpl, cv2.TM_CCOEFF_NORMED))[1] >= 0.85
+    return (match_score(screen, "icons/YZ-LXZY-KXBD.png", region) or 0.0) >= 0.85
 
 
 def set_expedition_enabled(value: bool):
@@ -47,29 +65,26 @@ def set_expedition_flags(scout_enabled, reward_enabled):
     gs.scout_enabled_global = scout_enabled
     gs.reward_enabled_global = reward_enabled
 
-def capture_screen():
+def capture_screen(prefetch=False, regions=None):
+    # prefetch=True 会在返回前提前发出下一次请求，只适合中间不点击的连续轮询；
+    # 点击后休眠超过预取有效期的，过时的预取图会被丢弃重截
+    # regions 只请求需要识别的区域（整屏坐标不变，区域外为黑色），服务端不支持时自动退回整屏
     try:
-        screenshot_socket = ScreenshotSocket("127.0.0.1", 6101)
-        data = screenshot_socket.request_screenshot()
-        if data:
-            image = np.frombuffer(data, dtype=np.uint8)
-            return cv2.imdecode(image, cv2.IMREAD_COLOR)
-        return None
+        if regions:
+            return get_screenshot_pool().capture_regions(regions, prefetch=prefetch)
+        return get_screenshot_pool().capture(prefetch=prefetch)
     except:
         return None
 
 def match_template(screen, template, region, threshold=0.85, debug_name=None):
     x1, y1, x2, y2 = region
-    img = screen[y1:y2, x1:x2]
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    tpl = cv2.imread(template, 0)
-    res = cv2.matchTemplate(gray, tpl, cv2.TM_CCOEFF_NORMED)
-    score = cv2.minMaxLoc(res)[1]
+    frame = as_frame(screen)
+    score = match_score(frame, template, region) or 0.0
     matched = score >= threshold
 
     # ✅ 不管是否匹配成功，只要传了 debug_name 就画图保存
     if debug_name:
-        debug_img = screen.copy()
+        debug_img = frame.bgr.copy()
         color = (0, 255, 0) if matched else (0, 0, 255)
         label = f"{debug_name} {'✓' if matched else '✗'} ({score:.2f})"
         cv2.rectangle(debug_img, (x1, y1), (x2, y2), color, 2)
@@ -99,95 +114,46 @@ def match_template(screen, template, region, threshold=0.85, debug_name=None):
 
 
 def check_popup_and_close(screen, server_socket):
-    popup_templates = {
-        "YZ-SJWC.png": EXPEDITION_POINTS["事件完成识别区域"],
-        "YZ-TFCG.png": EXPEDITION_POINTS["讨伐成功识别区域"],
-        "YZ-CJCG.png": EXPEDITION_POINTS["采集成功识别区域"],
-    }
-
-    for name, region in popup_templates.items():
-        template_path = f"icons/{name}"
-        x1, y1, x2, y2 = region
-        crop = screen[y1:y2, x1:x2]
-        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
-        tpl = cv2.imread(template_path, 0)
-
-        if tpl is None:
-            print(f"❌ 模板加载失败: {template_path}")
-            continue
-
-        if gray.shape[0] < tpl.shape[0] or gray.shape[1] < tpl.shape[1]:
-            print(f"❗ 匹配区域比模板还小，跳过: {name} ({gray.shape} < {tpl.shape})")
-            continue
-
-        res = cv2.matchTemplate(gray, tpl, cv2.TM_CCOEFF_NORMED)
-        score = cv2.minMaxLoc(res)[1]
-        matched = score >= 0.7
-
-        # save_debug_match_area(screen, region, name, matched, score) 截图识别
-
-        if matched:
-            print(f"📌 检测到弹窗：{name}，点击关闭")
-            server_socket.tap(*EXPEDITION_POINTS["事件完成确认关闭"])
-            time.sleep(0.5)
-            return True
+    # save_debug_match_area(screen, region, name, matched, score) 截图识别
+    name = popup_classifier.classify(screen, CHECK_POPUP_NAMES).matched
+    if name:
+        print(f"📌 检测到弹窗：{name}，点击关闭")
+        server_socket.tap(*EXPEDITION_POINTS["事件完成确认关闭"])
+        time.sleep(0.5)
+        return True
 
     return False
 
 
 def wait_for_expedition_page_ready(server_socket, timeout=8):
-    main_page_region = EXPEDITION_POINTS["联盟领地"]
     close_button = EXPEDITION_POINTS["事件完成确认关闭"]
 
-    popup_templates = {
-        "YZ-SJWC.png": EXPEDITION_POINTS["事件完成识别区域"],
-        "YZ-TFCG.png": EXPEDITION_POINTS["讨伐成功识别区域"],
-        "YZ-GXHD.png": EXPEDITION_POINTS["恭喜获得识别区域"],
-        "YZ-CJCG.png": EXPEDITION_POINTS["采集成功识别区域"],
-    }
-
+    frames = FrameContext()  # ✅ 同一张截图的灰度转换在弹窗识别和 LMLD 识别间共享
     start = time.time()
     while time.time() - start < timeout:
-        img = capture_screen()
+        img = frames.next(capture_screen(prefetch=True, regions=POPUP_REGIONS))
         if img is None:
             continue
 
-        popup_detected = False
+        # 弹窗优先级高于 LMLD：有弹窗时不会再去识别联盟领地图标
+        name = popup_classifier.classify(img).matched
 
         # 1️⃣ 弹窗识别与关闭
-        for name, region in popup_templates.items():
-            tpl = cv2.imread(f"icons/{name}", 0)
-            if tpl is None:
-                continue
-            x1, y1, x2, y2 = region
-            crop = img[y1:y2, x1:x2]
-            if crop.shape[0] < tpl.shape[0] or crop.shape[1] < tpl.shape[1]:
-                continue
-            gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
-            res = cv2.matchTemplate(gray, tpl, cv2.TM_CCOEFF_NORMED)
-            score = cv2.minMaxLoc(res)[1]
-            matched = score >= 0.7
-            # save_debug_match_area(img, region, name, matched, score) 截图识别
-
-            if matched:
-                print(f"📌 检测到弹窗：{name}，点击关闭")
-                server_socket.tap(*close_button)
-                time.sleep(1.2)
-                popup_detected = True
-                break  # ❗ 只关闭一个弹窗后立即重新截图，防止图像变化导致误识别
-
-        # 2️⃣ 如果刚刚关闭了弹窗 → 下一轮识别（不要识别 LMLD）
-        if popup_detected:
-            continue
+        if name and name != "YZ-LMLD.png":
+            print(f"📌 检测到弹窗：{name}，点击关闭")
+            server_socket.tap(*close_button)
+            time.sleep(1.2)
+            continue  # ❗ 只关闭一个弹窗后立即重新截图，防止图像变化导致误识别
 
-        # 3️⃣ 没有弹窗，才开始识别 LMLD
-        if match_template(img, "icons/YZ-LMLD.png", main_page_region, threshold=0.85): #, debug_name="YZ-LMLD"可补充做截图识别
+        # 2️⃣ 没有弹窗，识别 LMLD
+        if name == "YZ-LMLD.png":
             print("✅ 成功识别远征页面（联盟领地图标）")
             return True
 
-        time.sleep(0.5)
+        time.sleep(POLL_INTERVAL)
 
     print("❌ 超时未能识别远征页面")
+    dump_black_boxes("expedition_page")
     return False
 
 
@@ -196,7 +162,7 @@ def wait_for_lingdi_page(server_socket, timeout=5):
     region = EXPEDITION_POINTS["联盟领地"]
     start = time.time()
     while time.time() - start < timeout:
-        screen = capture_screen()
+        screen = capture_screen(regions=POPUP_REGIONS)
         if screen is None:
             continue
         if check_popup_and_close(screen, server_socket):
@@ -205,16 +171,36 @@ def wait_for_lingdi_page(server_socket, timeout=5):
         if match_template(screen, template, region):
             return True
         time.sleep(0.8)
+    dump_black_boxes("expedition_lingdi")
     return False
 
+# 固定点击链：服务端支持宏时整条一次发出，否则由 run_macro 在本地按同样节奏逐步点击；
+# checkpoint 处与原来逐步点击时一样检查暂停（run_macro 传 abort=check_expedition_paused）
+FIXED_CLAIM_MACRO = (GestureMacro("领地资源领取")
+                     .tap(*EXPEDITION_POINTS["领地图标"], wait=1.05)
+                     .tap(*EXPEDITION_POINTS["领地-一键领取按钮"], wait=0.55)
+                     .tap(*EXPEDITION_POINTS["领地-一键领取按钮"], wait=0.55)
+                     .tap(*EXPEDITION_POINTS["关闭领地资源"], wait=0.05))
+DEPLOY_AND_BACK_MACRO = (GestureMacro("出兵并返回事件页")
+                         .tap(*EXPEDITION_POINTS["联盟资源-采集-出兵按钮"], wait=1.55)
+                         .checkpoint()
+                         .tap(*EXPEDITION_POINTS["返回事件页"], wait=1.05))
+GIVE_UP_RESOURCE_MACRO = (GestureMacro("无空闲部队退出")
+                          .tap(*EXPEDITION_POINTS["返回事件页"], wait=0.55)
+                          .tap(*EXPEDITION_POINTS["返回事件页"], wait=0.55)
+                          .tap(*EXPEDITION_POINTS["关闭事件页面"], wait=0.55))
+
+def open_resource_macro(point):
+    """点开资源点 → 事件详情 → 采集按钮"""
+    return (GestureMacro("打开资源点")
+            .tap(*point, wait=1.05)
+            .checkpoint()
+            .tap(*EXPEDITION_POINTS["事件详情_中心点"], wait=0.55)
+            .checkpoint()
+            .tap(*EXPEDITION_POINTS["联盟资源-采集按钮"], wait=0.85))
+
 def handle_fixed_resource_claim(server_socket):
-    server_socket.tap(*EXPEDITION_POINTS["领地图标"])
-    time.sleep(1)
-    server_socket.tap(*EXPEDITION_POINTS["领地-一键领取按钮"])
-    time.sleep(0.5)
-    server_socket.tap(*EXPEDITION_POINTS["领地-一键领取按钮"])
-    time.sleep(0.5)
-    server_socket.tap(*EXPEDITION_POINTS["关闭领地资源"])
+    server_socket.run_macro(FIXED_CLAIM_MACRO, abort=check_expedition_paused)
     if check_expedition_paused():
         print("⏸️ 检测到暂停信号")
         return
@@ -225,11 +211,11 @@ def wait_for_event_page(timeout=5):
     region = EXPEDITION_POINTS["领地事件识别区域"]  
     start = time.time()
     while time.time() - start < timeout:
-        img = capture_screen()
+        img = capture_screen(prefetch=True, regions=[EXPEDITION_POINTS["领地事件识别区域"]])
         if img is not None:
             if match_template(img, template, region, threshold=0.85):
                 return True
-        time.sleep(0.6)
+        time.sleep(POLL_INTERVAL)
     return False
 
 def parse_scout_energy(screen):
@@ -240,11 +226,11 @@ def parse_scout_energy(screen):
     # 二值化处理，增强数字识别
     _, binary = cv2.threshold(gray, 180, 255, cv2.THRESH_BINARY)
 
-    # OCR 设置为数字模式，增强识别
-    config = "--psm 7 -c tessedit_char_whitelist=0123456789/"
+    # OCR 设置为数字模式，增强识别（与预建的 eng 数字引擎句柄同一配置）
+    config = DIGITS_CONFIG
     #cv2.imwrite("scout_energy_debug.png", gray)
 
-    text = pytesseract.image_to_string(binary, lang='eng', config=config)
+    text = digit_ocr.read(cropped, r"\d+\s*/\s*\d+", lang='eng', config=config, fallback_image=binary)
     print(f"[侦察体力识别] OCR原始结果: {text.strip()}")
 
     match = re.search(r"(\d+)\s*/\s*(\d+)", text)
@@ -265,7 +251,7 @@ def perform_scouting(server_socket):
             print("⏸️ 侦察流程中检测到暂停，终止侦察")
             return
 
-        screen = capture_screen()
+        screen = capture_screen(regions=POPUP_REGIONS + [SCOUT_POINTS["体力值区域"]])
         if screen is None:
             print(f"[侦察] 第{i+1}次截图失败，跳过")
             continue
@@ -290,7 +276,7 @@ def find_unoccupied_resource_click_points(screen, dx=365, dy=-33):
     qx1, qy1, qx2, qy2 = EXPEDITION_POINTS["前往按钮识别区"]
     region_crop = screen[y1:y2, x1:x2]
 
-    tpl = cv2.imread("icons/YZ-LXZY-WRQW.png", 0)
+    tpl = get_template("icons/YZ-LXZY-WRQW.png")
     gray = cv2.cvtColor(region_crop, cv2.COLOR_BGR2GRAY)
     res = cv2.matchTemplate(gray, tpl, cv2.TM_CCOEFF_NORMED)
 
@@ -314,26 +300,18 @@ def find_unoccupied_resource_click_points(screen, dx=365, dy=-33):
     return click_points
 
 def wait_for_troop_page(timeout=5):
-    tpl = cv2.imread("icons/YZ-LXZY-KXBD.png", 0)
-    region = EXPEDITION_POINTS["空闲部队识别区域"]
     start = time.time()
     while time.time() - start < timeout:
-        screen = capture_screen()
-        if screen is not None:
-            gray = cv2.cvtColor(screen[region[1]:region[3], region[0]:region[2]], cv2.COLOR_BGR2GRAY)
-            if cv2.minMaxLoc(cv2.matchTemplate(gray, tpl, cv2.TM_CCOEFF_NORMED))[1] >= 0.85:
-                return True
-        time.sleep(0.5)
+        screen = capture_screen(prefetch=True, regions=[EXPEDITION_POINTS["空闲部队识别区域"]])
+        if screen is not None and has_idle_troop(screen):
+            return True
+        time.sleep(POLL_INTERVAL)
     return False
 
 def is_main_page(screen):
     try:
         region = EXPEDITION_POINTS["主页识别区"]  # (503, 29, 577, 88)
-        cropped = screen[region[1]:region[3], region[0]:region[2]]
-        tpl = cv2.imread("icons/ZY-FY.png", 0)
-        gray = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
-        res = cv2.matchTemplate(gray, tpl, cv2.TM_CCOEFF_NORMED)
-        max_val = cv2.minMaxLoc(res)[1]
+        max_val = match_score(screen, "icons/ZY-FY.png", region) or 0.0
         print(f"🎯 主页“繁荣”匹配度: {max_val:.3f}")
         return max_val >= 0.95
     except Exception as e:
@@ -348,7 +326,7 @@ def exit_expedition_page(server_socket):
         server_socket.tap(*EXPEDITION_POINTS["退出远征页面"])
         time.sleep(2.0)
 
-        img = capture_screen()
+        img = capture_screen(regions=[EXPEDITION_POINTS["主页识别区"]])
         if img is not None:
             if is_main_page(img):
                 print("✅ 成功识别主页，远征流程结束")
@@ -433,7 +411,7 @@ def run_expedition_once(server_socket):
         while swipe_count < max_swipe:
             if check_expedition_paused(): return
 
-            screen = capture_screen()
+            screen = capture_screen(regions=[EXPEDITION_POINTS["联盟资源识别区"]])
             if screen is None:
                 break
 
@@ -449,43 +427,21 @@ def run_expedition_once(server_socket):
             for idx, point in enumerate(click_points):
                 if check_expedition_paused(): return
                 print(f"🚀 点击第 {idx+1} 个无人前往资源: {point}")
-                server_socket.tap(*point)
-                time.sleep(1)
+                if not server_socket.run_macro(open_resource_macro(point), abort=check_expedition_paused):
+                    if expedition_pause_event.is_set(): return
 
-                if check_expedition_paused(): return
-                server_socket.tap(*EXPEDITION_POINTS["事件详情_中心点"])
-                time.sleep(0.5)
-
-                if check_expedition_paused(): return
-                server_socket.tap(*EXPEDITION_POINTS["联盟资源-采集按钮"])
-                time.sleep(0.8)
-
-                troop_screen = capture_screen()
+                troop_screen = capture_screen(regions=[EXPEDITION_POINTS["空闲部队识别区域"]])
                 if troop_screen is None:
                     continue
 
-                idle_tpl = cv2.imread("icons/YZ-LXZY-KXBD.png", 0)
-                idle_region = EXPEDITION_POINTS["空闲部队识别区域"]
-                troop_gray = cv2.cvtColor(troop_screen[idle_region[1]:idle_region[3], idle_region[0]:idle_region[2]], cv2.COLOR_BGR2GRAY)
-
-                if cv2.minMaxLoc(cv2.matchTemplate(troop_gray, idle_tpl, cv2.TM_CCOEFF_NORMED))[1] >= 0.85:
+                if has_idle_troop(troop_screen):
                     if check_expedition_paused(): return
-                    server_socket.tap(*EXPEDITION_POINTS["联盟资源-采集-出兵按钮"])
+                    if not server_socket.run_macro(DEPLOY_AND_BACK_MACRO, abort=check_expedition_paused):
+                        if expedition_pause_event.is_set(): return
                     print(f"✅ 成功出兵")
-                    time.sleep(1.5)
-
-                    if check_expedition_paused(): return
-                    server_socket.tap(*EXPEDITION_POINTS["返回事件页"])
-                    time.sleep(0.8)
-                    time.sleep(0.2)
                 else:
                     print(f"❌ 无空闲部队，跳过此资源点")
-                    server_socket.tap(*EXPEDITION_POINTS["返回事件页"])
-                    time.sleep(0.5)
-                    server_socket.tap(*EXPEDITION_POINTS["返回事件页"])
-                    time.sleep(0.5)
-                    server_socket.tap(*EXPEDITION_POINTS["关闭事件页面"])
-                    time.sleep(0.5)
+                    server_socket.run_macro(GIVE_UP_RESOURCE_MACRO)
                     exit_expedition_page(server_socket)
                     return
 
@@ -10,25 +10,36 @@ import collect_core
 import expedition_core
 import tech_research_core
 import queue
+import multiprocessing
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QLabel, QPushButton,QVBoxLayout, QHBoxLayout, QGridLayout, QCheckBox, QTextEdit,QGroupBox, QLineEdit, QFrame)
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject, QThread, QMetaObject, Qt
 from PyQt5.QtGui import QIntValidator
 from expedition_core import set_expedition_flags, set_expedition_enabled
-from utils.adb_tools import TouchServerSocket, ScreenshotSocket, get_rift_stream_listener, ControlSocket,enable_rift_listener
+from utils.adb_tools import TouchServerSocket, ControlSession, get_control_socket, get_screenshot_pool, get_rift_stream_listener, enable_rift_listener
 from position_config import COLLECT_POINTS
 from utils.toast_notify import show_toast, register_log_callback
+from utils.template_store import template_store
+from utils.tesseract_engine import tesseract_engine
+from utils.ocr_pool import shutdown_ocr_executors
+from utils.input_scheduler import InputScheduler
 
 pause_event = threading.Event()
 TOUCH_SERVER_HOST = "127.0.0.1"
 TOUCH_SERVER_PORT = 6100
-server_socket = TouchServerSocket(host=TOUCH_SERVER_HOST, port=TOUCH_SERVER_PORT)
+# 设备连接 / 输入调度 / 控制会话在 setup_runtime() 里创建，只在主进程执行；
+# OCR 进程池用 spawn 启动子进程时会以 __mp_main__ 重新导入本模块，模块级不能有连接和线程
+server_socket = None
+input_scheduler = None
+collect_input = rift_input = expedition_input = research_input = None
+control_session = None
 _last_research_callback_ts = 0
 
 # 全局主控状态
 def pause_all_tasks():
     pause_event.set()
     collect_core.stop_collect()
-    rift_core.stop_rift_module(server_socket)
+    rift_core.stop_rift_module(rift_input)
+    input_scheduler.cancel_all()  # 各模块排队中的点击全部作废
     gs.current_task_flag = None
 
 def resume_all_tasks():
@@ -41,7 +52,7 @@ def resume_all_tasks():
             )
             gs.current_task_flag = "collect"
             safe_after(0, lambda: window.update_task_status("采集中 🏃‍♂️"))
-            collect_core.start_collect(server_socket, gs.current_collect_points.copy())
+            collect_core.start_collect(collect_input, gs.current_collect_points.copy())
             print(f"▶️ 已恢复采集任务（资源: {', '.join(gs.current_collect_points)}）")
         else:
             gs.current_task_flag = None
@@ -65,30 +76,16 @@ def setup_adb_forward():
     except Exception as e:
         print(f"❌ ADB 执行失败: {e}")
 
-# 异步启动 adb forward
-threading.Thread(target=setup_adb_forward, daemon=True).start()
-
-# ✅ 6102 端口指令发送工具（短连 → 收ACK → 断开）
+# ✅ 6102 端口指令发送工具：切换类指令走常驻 ControlSocket，每条都打印应答
 def send_control_command(cmd_str):
-    import socket
-    try:
-        with socket.socket() as s:
-            s.settimeout(2.0)  # ✅ 设定超时 2 秒，避免卡死
-            print(f"[ControlSocket] 准备 connect")
-            s.connect(("127.0.0.1", 6102))
-            print(f"[ControlSocket] 已 connect，准备发送: {cmd_str.strip()}")
-            s.sendall(cmd_str.encode())
-            print(f"[ControlSocket] 已发送，准备 recv")
-            resp = s.recv(128).decode().strip()
-            print(f"[ControlSocket] 收到响应: {resp}")
-            return resp
-    except Exception as e:
-        print(f"[ControlSocket] 发送指令失败: {e}")
-        return None
+    # 不再每条指令新开一个 socket（超时 2 秒，断开时自动重连重试一次）
+    resp = get_control_socket().send_command(cmd_str)
+    if resp is None:
+        print(f"[ControlSocket] 发送指令失败: {cmd_str.strip()}")
+    else:
+        print(f"[ControlSocket] {cmd_str.strip()} → {resp}")
+    return resp
     
-collect_core.register_main_callbacks(pause_event, pause_all_tasks)  # 注册采集模块回调
-gs.rift_send_control_command_callback = send_control_command # 注册发送控制命令回调              
-
 class MainWindow(QMainWindow):
     connection_status_signal = pyqtSignal(str, str)
     listen_mode_signal = pyqtSignal(str, str)
@@ -343,9 +340,6 @@ def update_rift_level(level_text, failure_count):
     print(f"📌 当前识别层数为：{text}")
     show_toast("📌 裂隙层数更新", f"当前识别层数为：{level_text} / 失败次数：{failure_count}")
 
-# 注册为全局回调
-gs.rift_level_callback = update_rift_level
-
 def safe_after(ms, func):
     try:
         if threading.current_thread() == threading.main_thread():
@@ -374,16 +368,20 @@ def monitor_touch_connection():
         time.sleep(3)
 
 def monitor_listen_mode():
+    def show_mode(mode):
+        print(f"[ListenMode] 当前模式反馈: {mode}")
+        if mode == "VIDEO_STREAM_MODE":
+            safe_after(0, lambda: window.listen_mode_signal.emit("🎬 视频流", "blue"))
+        elif mode == "SCREENSHOT_MODE":
+            safe_after(0, lambda: window.listen_mode_signal.emit("📸 截图", "green"))
+        else:
+            safe_after(0, lambda: window.listen_mode_signal.emit(f"❌ 未知 ({mode})", "red"))
+
     def query_and_update():
         try:
-            resp = send_control_command("query_status\n")
-            print(f"[ListenMode] 当前模式反馈: {resp}")
-            if resp == "STATUS:VIDEO_STREAM_MODE":
-                safe_after(0, lambda: window.listen_mode_signal.emit("🎬 视频流", "blue"))
-            elif resp == "STATUS:SCREENSHOT_MODE":
-                safe_after(0, lambda: window.listen_mode_signal.emit("📸 截图", "green"))
-            else:
-                safe_after(0, lambda: window.listen_mode_signal.emit(f"❌ 未知 ({resp})", "red"))
+            mode = control_session.refresh()
+            if mode is None:
+                show_mode(None)
         except Exception as e:
             print(f"[ListenMode] 查询监听模式失败: {e}")
             safe_after(0, lambda: (
@@ -391,12 +389,15 @@ def monitor_listen_mode():
                 window.listen_mode_label.setStyleSheet("color: red;")
             ))
 
-    # 先主动请求一次
+    # 模式变化由会话推送直接刷新界面；先主动请求一次
+    control_session.add_listener(show_mode)
+    control_session.start()
     query_and_update()
 
     while True:
-        time.sleep(30)  # 等 30 秒再更新
-        query_and_update()
+        time.sleep(30)  # 服务端不支持推送时仍按 30 秒兜底刷新
+        if not control_session.subscribed:
+            query_and_update()
 
 
 
@@ -409,8 +410,6 @@ def log(msg):
     except Exception as e:
         print(f"[log异常] {e}")
 
-register_log_callback(log)
-
 # 注册 tech_timer_direct_callback
 # 工具函数，保证在主线程里安全获取 window.checkbox_collect.isChecked()
 def is_collect_enabled():
@@ -445,7 +444,7 @@ def tech_timer_direct_callback(task_type):
 
         # ✅ 正常科技流程
         tech_research_core.research_ready_event.clear()
-        tech_research_core.initialize_research_state(server_socket)
+        tech_research_core.initialize_research_state(research_input)
         tech_research_core.research_ready_event.wait()
 
         # ✅ 科技流程完成 → 判断是否启用采集（使用 current_collect_enabled）
@@ -456,7 +455,7 @@ def tech_timer_direct_callback(task_type):
             gs.research_pause_event.clear()
             gs.current_task_flag = "collect"
             safe_after(0, lambda: window.update_task_status("采集中 🏃‍♂️"))
-            collect_core.start_collect(server_socket, gs.current_collect_points.copy())
+            collect_core.start_collect(collect_input, gs.current_collect_points.copy())
         else:
             print("✅ 科技流程完成（未启用采集模块，不恢复采集）")
             gs.research_pause_event.clear()
@@ -476,7 +475,7 @@ def tech_timer_direct_callback(task_type):
                 safe_after(0, lambda: window.update_task_status("研究中 💡"))
 
                 tech_research_core.research_ready_event.clear()
-                tech_research_core.initialize_research_state(server_socket)
+                tech_research_core.initialize_research_state(research_input)
                 tech_research_core.research_ready_event.wait()
 
                 if gs.current_collect_enabled:
@@ -485,7 +484,7 @@ def tech_timer_direct_callback(task_type):
                     pause_event.clear()
                     gs.current_task_flag = "collect"
                     safe_after(0, lambda: window.update_task_status("采集中 🏃‍♂️"))
-                    collect_core.start_collect(server_socket, gs.current_collect_points.copy())
+                    collect_core.start_collect(collect_input, gs.current_collect_points.copy())
                 else:
                     print("✅ 科技流程完成（未启用采集模块，不恢复采集）")
                     pause_event.clear()
@@ -499,8 +498,6 @@ def tech_timer_direct_callback(task_type):
     else:
         print(f"⚠️ 当前状态 {gs.current_task_flag}，忽略科技流程插入")
 
-gs.tech_timer_direct_callback = tech_timer_direct_callback
-
 # 测试截图
 def test_screenshot():
     # 更新当前状态
@@ -515,21 +512,14 @@ def test_screenshot():
         return
 
     # 确认切换成功
-    for i in range(5):
-        status = send_control_command("query_status\n")
-        print(f"📡 当前模式状态: {status}")
-        if status == "STATUS:SCREENSHOT_MODE":
-            break
-        time.sleep(0.5)
-    else:
+    if not control_session.wait_for_mode("screenshot", timeout=2.5):
         print("❌ 等待切换截图模式超时")
         window.update_task_status("空闲")
         return
 
     # 执行截图
     print("📸 开始请求截图")
-    screenshot_socket = ScreenshotSocket(host="127.0.0.1", port=6101)
-    img = screenshot_socket.request_screenshot()
+    img = get_screenshot_pool().request_raw()
     if img:
         with open("screenshot_from_socket.png", "wb") as f:
             f.write(img)
@@ -553,26 +543,20 @@ def start_rift_manual():
         retry_count = int(window.rift_retry_input.text())
     except:
         retry_count = 30
-    threading.Thread(target=rift_core.start_rift_module, args=(rift_socket, server_socket, retry_count), daemon=True).start()
+    threading.Thread(target=rift_core.start_rift_module, args=(rift_socket, rift_input, retry_count), daemon=True).start()
 
 # 裂隙模块退出后的回调
 def resume_after_rift_callback():
     print("✅ 收到裂隙模块恢复通知，检查当前模式...")
 
     # 等待切回截图模式，最多等 5 秒
-    for i in range(5):
-        resp = send_control_command("query_status\n")
-        print(f"📡 当前模式状态: {resp}")
-        if resp == "STATUS:SCREENSHOT_MODE":
-            print("✅ 当前是截图模式，恢复采集")
-            pause_event.clear()
-            safe_after(0, lambda: window.update_task_status("采集中 🏃‍♂️"))
-            gs.current_task_flag = "collect"
-            collect_core.start_collect(server_socket, gs.current_collect_points.copy())
-            return
-        else:
-            print("⏳ 等待切回截图模式...")
-            time.sleep(1)
+    if control_session.wait_for_mode("screenshot", timeout=5):
+        print("✅ 当前是截图模式，恢复采集")
+        pause_event.clear()
+        safe_after(0, lambda: window.update_task_status("采集中 🏃‍♂️"))
+        gs.current_task_flag = "collect"
+        collect_core.start_collect(collect_input, gs.current_collect_points.copy())
+        return
 
     print("⚠️ 超时未切回截图模式，不恢复采集")
 
@@ -591,7 +575,7 @@ def manual_research():
     safe_after(0, lambda: window.update_task_status("研究中 💡"))
     pause_event.clear()
     tech_research_core.research_ready_event.clear()
-    tech_research_core.initialize_research_state(server_socket)
+    tech_research_core.initialize_research_state(research_input)
     tech_research_core.research_ready_event.wait()
     print("✅ 手动科技流程完成")
 
@@ -605,8 +589,6 @@ def monitor_accelerate_ready_event():
             gs.tech_timer_direct_callback("accelerate")
         except Exception as e:
             print(f"⚠️ tech_timer_direct_callback 调用异常（主控监控线程）: {e}")
-# 启动监控线程
-threading.Thread(target=monitor_accelerate_ready_event, daemon=True).start()            
 
 # 手动远征任务
 def manual_expedition():
@@ -616,14 +598,14 @@ def manual_expedition():
     pause_event.clear()
     set_expedition_flags(window.checkbox_scout.isChecked(), window.checkbox_mine_reward.isChecked())
     gs.expedition_pause_event.clear()
-    expedition_core.manual_trigger_expedition(server_socket, pause_event, pause_all_tasks)
+    expedition_core.manual_trigger_expedition(expedition_input, pause_event, pause_all_tasks)
 
 # 裂隙模块继续挑战
 def continue_rift():
     print("▶️ 继续裂隙挑战执行")
     show_toast("▶️ 继续裂隙挑战", "正在继续裂隙挑战")
     window.update_task_status("裂隙中 ⚔️")
-    rift_core.resume_rift(server_socket)
+    rift_core.resume_rift(rift_input)
 
 # 自动脚本线程
 def run_tasks_thread():
@@ -647,7 +629,7 @@ def run_tasks_thread():
             return
         safe_after(0, lambda: window.update_task_status("研究中 💡"))
         tech_research_core.research_ready_event.clear()
-        tech_research_core.initialize_research_state(server_socket)
+        tech_research_core.initialize_research_state(research_input)
         print("⏳ 等待科技处理...")
         tech_research_core.research_ready_event.wait()
         print("✅ 科技处理完成")
@@ -680,7 +662,7 @@ def run_tasks_thread():
             show_toast("📢 收到远征完成通知", "正在恢复采集任务")
             pause_event.clear()
             gs.current_task_flag = "collect"
-            collect_core.start_collect(server_socket, gs.current_collect_points.copy())
+            collect_core.start_collect(collect_input, gs.current_collect_points.copy())
 
         expedition_core.register_main_callbacks(resume_after_expedition, pause_all_tasks)
         safe_after(0, lambda: window.update_task_status("采集中 🏃‍♂️"))
@@ -689,7 +671,7 @@ def run_tasks_thread():
         show_toast("📦 启用采集", f"已启用采集任务（资源: {', '.join(gs.current_collect_points)}）")
         gs.research_pause_event.clear()
         gs.current_task_flag = "collect"
-        threading.Thread(target=collect_core.start_collect, args=(server_socket, gs.current_collect_points.copy()), daemon=True).start()
+        threading.Thread(target=collect_core.start_collect, args=(collect_input, gs.current_collect_points.copy()), daemon=True).start()
 
     # 远征模块
     if window.checkbox_expedition.isChecked():
@@ -706,27 +688,20 @@ def run_tasks_thread():
         # ✅ 注册裂隙退出后恢复采集的回调
         def resume_after_rift_callback():
             print("✅ 收到裂隙模块恢复通知，检查当前模式...")
-            control_socket = ControlSocket()
 
             # 等待切回截图模式，最多等 5 秒
-            for i in range(5):
-                resp = control_socket.query_status()
-                print(f"📡 当前模式状态: {resp}")
-                if resp == "STATUS:SCREENSHOT_MODE":
-                    print("✅ 当前是截图模式，恢复采集")
-                    pause_event.clear()
-                    collect_core.start_collect(server_socket, gs.current_collect_points)
-                    return
-                else:
-                    print("⏳ 等待切回截图模式...")
-                    time.sleep(1)
+            if control_session.wait_for_mode("screenshot", timeout=5):
+                print("✅ 当前是截图模式，恢复采集")
+                pause_event.clear()
+                collect_core.start_collect(collect_input, gs.current_collect_points)
+                return
 
             print("⚠️ 超时未切回截图模式，不恢复采集")
 
         # ✅ 主动注册回调到 rift_core
         rift_core.register_main_callbacks(resume_after_rift_callback, pause_all_tasks)
 
-        threading.Thread(target=rift_core.start_rift_module, args=(rift_socket, server_socket), daemon=True).start()
+        threading.Thread(target=rift_core.start_rift_module, args=(rift_socket, rift_input), daemon=True).start()
 
 # 停止所有模块
 def stop_tasks():
@@ -742,7 +717,9 @@ def exit_app():
     gs.current_task_flag = None
     print("❎ 脚本退出")
     show_toast("❎ 脚本退出", "感谢使用")
+    input_scheduler.stop()
     server_socket.close()
+    shutdown_ocr_executors()
     QApplication.quit()
 
 def update_status_labels():
@@ -751,9 +728,42 @@ def update_status_labels():
     window.accel_status_label.setText("加速CD：" + status["加速CD"])
     QTimer.singleShot(1000, update_status_labels)
 
+# 主进程初始化：连接、调度线程、回调注册、后台监控线程
+def setup_runtime():
+    global server_socket, input_scheduler, control_session
+    global collect_input, rift_input, expedition_input, research_input
+    server_socket = TouchServerSocket(host=TOUCH_SERVER_HOST, port=TOUCH_SERVER_PORT)
+    # 6100 只由调度线程写出；各模块拿各自来源的句柄提交点击
+    input_scheduler = InputScheduler(server_socket)
+    collect_input = input_scheduler.client("collect")
+    rift_input = input_scheduler.client("rift")
+    expedition_input = input_scheduler.client("expedition")
+    research_input = input_scheduler.client("research")
+
+    # 异步启动 adb forward
+    threading.Thread(target=setup_adb_forward, daemon=True).start()
+
+    # 6102 常驻会话：订阅模式切换推送，等待切换确认不再反复轮询
+    # 不支持推送时的 query_status 轮询（约 0.1 秒一次）共用常驻连接但不打印，模式变化由 show_mode 监听打印
+    control_session = ControlSession(host="127.0.0.1", port=6102, query=get_control_socket().send_command)
+
+    collect_core.register_main_callbacks(pause_event, pause_all_tasks)  # 注册采集模块回调
+    gs.rift_send_control_command_callback = send_control_command  # 注册发送控制命令回调
+    gs.wait_for_mode_callback = control_session.wait_for_mode  # 注册等待模式切换确认回调
+    gs.rift_level_callback = update_rift_level  # 裂隙层数回调
+    gs.tech_timer_direct_callback = tech_timer_direct_callback
+    register_log_callback(log)
+
+    # 启动监控线程
+    threading.Thread(target=monitor_accelerate_ready_event, daemon=True).start()
+
 # 启动主循环
 if __name__ == '__main__':
     import sys
+    multiprocessing.freeze_support()  # 打包成 exe 时 OCR 子进程从这里分流
+    setup_runtime()
+    template_store.preload()  # ✅ 模板统一预解码，识别循环里只剩匹配开销
+    tesseract_engine.preload()  # ✅ 进程内 OCR 引擎句柄提前初始化
     app = QApplication(sys.argv)
     window = MainWindow()
     update_status_labels()
@@ -1,14 +1,18 @@
 # RiftCore V3.1 状态优先级版【完整版】
 import time
 import threading
+import concurrent.futures
 import cv2
 import datetime
 import numpy as np
-import pytesseract
 import global_state as gs
 from utils.toast_notify import show_toast
-from utils.adb_tools import TouchServerSocket, get_rift_stream_listener
-from position_config import RIFT_POINTS
+from utils.adb_tools import TouchServerSocket, get_rift_stream_listener, get_screenshot_pool
+from position_config import RIFT_POINTS, EXPEDITION_POINTS
+from utils.frame_context import FrameContext, as_frame
+from utils.state_classifier import MatchRule, StateClassifier
+from utils.recorder import dump_black_boxes
+from utils.ocr_pool import tesseract_executor
 
 rift_running = False
 failure_count = 0
@@ -19,6 +23,42 @@ _frame_listener = None
 current_phase = "state_wait_sweep"
 failure_retry_limit = 30
 rift_paused = False
+_last_frame_seq = 0
+_level_future = None  # 未取回的层数 OCR，只在状态循环线程里读写
+LEVEL_OCR_TIMEOUT = 3.0
+FRAME_WAIT_TIMEOUT = 0.5
+
+# === 裂隙界面识别规则（priority 越小越先判断）===
+RIFT_RULES = [
+    MatchRule("main_page", "icons/ZY-FY.png", EXPEDITION_POINTS["主页识别区"], 0.95, 0),
+    MatchRule("ad", "icons/GG-LB.png", RIFT_POINTS["广告识别区域"], 0.85, 1),
+    MatchRule("congrats", "icons/SGLX-GXHD.png", RIFT_POINTS["恭喜获得识别区域"], 0.85, 2),
+    MatchRule("continue", "icons/SJLX-ZDSL-JXZD.png", RIFT_POINTS["继续战斗识别区域"], 0.85, 3),
+    MatchRule("failure", "icons/SGLX-ZDSB.png", RIFT_POINTS["失败识别区域"], 0.85, 4),
+    MatchRule("start", "icons/SGLX-KSTZ.png", RIFT_POINTS["开始挑战识别区域"], 0.85, 5),
+    MatchRule("sweep", "icons/LXTZ-SD.png", RIFT_POINTS["扫荡识别区"], 0.85, 6),
+    MatchRule("in_battle", "icons/SJLX-GKZDZ.png", RIFT_POINTS["关卡战斗中识别区"], 0.85, 7),
+    MatchRule("skip", "icons/SGLX-TG.png", RIFT_POINTS["跳过识别区域"], 0.85, 8),
+]
+rift_classifier = StateClassifier(RIFT_RULES)
+
+# === 状态转移表：每个阶段只识别可能紧接着出现的界面 ===
+RIFT_PHASE_CANDIDATES = {
+    "state_wait_sweep": ("main_page", "ad", "congrats", "continue", "failure", "start", "sweep"),
+    "state_in_battle_anim": ("ad", "congrats", "continue", "failure", "start", "in_battle", "skip"),
+    "state_skip_available": ("ad", "congrats", "continue", "failure", "skip"),
+    "state_returning_home": ("main_page", "ad", "congrats", "failure", "start", "sweep"),
+}
+# 识别到某界面后进入的阶段（未列出的界面不改变阶段）
+RIFT_PHASE_AFTER = {
+    "start": "state_in_battle_anim",
+    "in_battle": "state_skip_available",
+    "continue": "state_wait_sweep",
+    "failure": "state_wait_sweep",
+}
+# 兜底完整扫描：与阶段无关的界面全部识别一次，防止阶段判断跑偏
+RIFT_FULL_SCAN = ("main_page", "ad", "congrats", "continue", "failure", "start", "sweep")
+RIFT_FULL_SCAN_INTERVAL = 2.0
 
 # 注册主控回调
 def register_main_callbacks(resume_func, pause_func):
@@ -26,18 +66,21 @@ def register_main_callbacks(resume_func, pause_func):
     _resume_callback = resume_func
     _pause_callback = pause_func
 
-# 获取视频帧
+# 获取视频帧：等到解码出新帧才返回，同一帧不重复处理；画面静止时最多等 FRAME_WAIT_TIMEOUT 再复查当前帧
 def capture_screen():
+    global _last_frame_seq
     if rift_paused:
         rift_log("⏸️ 当前处于暂停状态，跳过帧获取")
         time.sleep(0.1)
         return None
-    frame = _frame_listener.get_latest_frame()
+    _last_frame_seq, frame = _frame_listener.wait_for_new_frame(_last_frame_seq, timeout=FRAME_WAIT_TIMEOUT)
+    if frame is None:
+        frame = _frame_listener.get_latest_frame()
     ts = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
     if frame is None or frame.shape[0] < 100 or frame.shape[1] < 100:
         print(f"[{ts}] ⚠️ 获取帧失败/尺寸异常")
         return None
-    return frame.copy()
+    return frame  # 只读帧，识别只读不写，无需再拷贝
 
 # 裂隙日志
 def rift_log(msg):
@@ -49,18 +92,9 @@ def rift_log(msg):
     print(msg)
 
 # 主界面判断
-def is_main_page(screen):
-    from position_config import EXPEDITION_POINTS
-    region = EXPEDITION_POINTS["主页识别区"]
-    cropped = screen[region[1]:region[3], region[0]:region[2]]
-    tpl = cv2.imread("icons/ZY-FY.png", 0)
-    gray = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
-    res = cv2.matchTemplate(gray, tpl, cv2.TM_CCOEFF_NORMED)
-    return cv2.minMaxLoc(res)[1] >= 0.95
-
 # 启动裂隙模块
 def start_rift_module(dummy_frame_listener, touch_socket, retry_limit=30, force=False):
-    global rift_running, failure_count, current_phase, _frame_listener, failure_retry_limit
+    global rift_running, failure_count, current_phase, _frame_listener, failure_retry_limit, _last_frame_seq
     failure_retry_limit = retry_limit  # ✅ 主控传入的失败上限值（由输入框决定）
 
     if rift_running and not force:
@@ -70,6 +104,7 @@ def start_rift_module(dummy_frame_listener, touch_socket, retry_limit=30, force=
         _frame_listener.stop()
         print("✅ 已关闭之前 FrameListener")
 
+    get_screenshot_pool().close_all()  # 6101 即将切为视频流，截图长连接全部断开
     if gs.rift_send_control_command_callback:
         gs.rift_send_control_command_callback("SWITCH_TO_VIDEO\n")
         rift_log("✅ 已发送切换到视频流指令，等待视频帧准备...")
@@ -77,8 +112,13 @@ def start_rift_module(dummy_frame_listener, touch_socket, retry_limit=30, force=
         rift_log("⚠️ 未设置切换视频流指令回调，无法切换")
         return
 
-    time.sleep(0.5)
+    if gs.wait_for_mode_callback:
+        if not gs.wait_for_mode_callback("video", 2.0):
+            rift_log("⚠️ 未确认切换到视频流，继续尝试连接")
+    else:
+        time.sleep(0.5)
     _frame_listener = get_rift_stream_listener()
+    _frame_listener.set_output(output_format="gray")  # ✅ 裂隙识别全部基于灰度，解码端直接输出灰度
     _frame_listener.start()
     print("✅ FrameListener 重新启动，连接 6101 等待帧")
 
@@ -92,6 +132,7 @@ def start_rift_module(dummy_frame_listener, touch_socket, retry_limit=30, force=
         rift_log("⚠️ FrameListener 首帧未就绪，继续后续流程")
 
     current_phase = "state_wait_sweep"   
+    _last_frame_seq = 0
     gs.rift_state = "opening"
     failure_count = 0
     rift_running = True
@@ -127,18 +168,31 @@ def unified_state_loop(server_socket):
     global rift_running, failure_count, current_phase, rift_paused, last_level_text
     gs.rift_state = "opening"
     failure_count = 0
+    frames = FrameContext()  # ✅ 每轮一帧，灰度等中间结果在本轮所有识别间共享
+    last_full_scan = 0
 
     while rift_running:
         if rift_paused:
             time.sleep(0.5)   # 挂起状态循环，等待手动继续
             continue
-        screen = capture_screen()
+        apply_rift_level()  # 层数 OCR 已出结果就在本线程更新并上报
+        screen = frames.next(capture_screen())
         if screen is None:
             time.sleep(0.1)
             continue
 
+        # ✅ 只识别当前阶段的候选界面，定期完整扫描一次兜底
+        now = time.time()
+        names = RIFT_PHASE_CANDIDATES.get(current_phase, RIFT_FULL_SCAN)
+        if now - last_full_scan >= RIFT_FULL_SCAN_INTERVAL:
+            names = RIFT_FULL_SCAN + names
+            last_full_scan = now
+        state = rift_classifier.classify(screen, names).matched
+        if state in RIFT_PHASE_AFTER:
+            current_phase = RIFT_PHASE_AFTER[state]
+
         # 主页
-        if is_main_page(screen):
+        if state == "main_page":
             if current_phase == "state_returning_home":
                 rift_log("💬 少年郎，战斗力不够哦！还需要继续努力啊。")
                 show_toast("裂隙挑战提示", "少年郎，战斗力不够哦！还需要继续努力啊。")  # 可选，弹出 toast 提示
@@ -154,24 +208,25 @@ def unified_state_loop(server_socket):
             return
 
         # 广告
-        if match_template(screen, "icons/GG-LB.png", RIFT_POINTS["广告识别区域"]):
+        if state == "ad":
             rift_log("📢 检测到广告弹窗，关闭")
             server_socket.tap(*RIFT_POINTS["关闭广告"])
             time.sleep(1.2)
             continue
 
         # 恭喜获得
-        if match_template(screen, "icons/SGLX-GXHD.png", RIFT_POINTS["恭喜获得识别区域"]):
+        if state == "congrats":
             rift_log("🎉 识别到恭喜获得弹窗，点击关闭")
             server_socket.tap(*RIFT_POINTS["恭喜获得关闭坐标"])
             time.sleep(1.5)
             continue
         
         # 继续战斗（判定通关成功）
-        if match_template(screen, "icons/SJLX-ZDSL-JXZD.png", RIFT_POINTS["继续战斗识别区域"]):
+        if state == "continue":
             rift_log("✅ 识别到 '继续战斗' 按钮，判定为通关成功")
 
-            # 层数 +1
+            # 层数 +1（上一次失败时的层数识别要先落定）
+            apply_rift_level(wait=LEVEL_OCR_TIMEOUT)
             if last_level_text:
                 import re
                 match = re.search(r"第\s*(\d+)\s*层", last_level_text)
@@ -188,10 +243,11 @@ def unified_state_loop(server_socket):
             continue
 
         # 失败
-        if match_template(screen, "icons/SGLX-ZDSB.png", RIFT_POINTS["失败识别区域"]):
+        if state == "failure":
             handle_failed_battle(server_socket)
             if failure_count >= failure_retry_limit:
                 rift_log(f"❌ 同一关失败{failure_retry_limit}次，准备退出到主页，连续点击返回按钮确保生效")
+                dump_black_boxes("rift_exit")
                 for i in range(2):
                     server_socket.tap(*RIFT_POINTS["返回主界面"])
                     rift_log(f"🔁 第 {i+1} 次点击返回主界面按钮")
@@ -200,15 +256,14 @@ def unified_state_loop(server_socket):
             continue
         
         # 开始挑战
-        if match_template(screen, "icons/SGLX-KSTZ.png", RIFT_POINTS["开始挑战识别区域"]):
+        if state == "start":
             rift_log("🎯 识别到开始挑战按钮")
             server_socket.tap(*RIFT_POINTS["开始挑战"])
-            current_phase = "state_in_battle_anim"
             time.sleep(1.5)
             continue
 
         # 扫荡
-        if not rift_paused and match_template(screen, "icons/LXTZ-SD.png", RIFT_POINTS["扫荡识别区"]):
+        if state == "sweep" and not rift_paused:
             rift_log("🔄 检测到扫荡，请手动操作后点击继续挑战")
             gs.rift_state = "wait_continue"
             rift_paused = True
@@ -218,14 +273,13 @@ def unified_state_loop(server_socket):
             continue
 
         # 战斗动画
-        if current_phase == "state_in_battle_anim" and match_template(screen, "icons/SJLX-GKZDZ.png", RIFT_POINTS["关卡战斗中识别区"]):
+        if state == "in_battle":
             rift_log("🎬 进入战斗中动画阶段")
-            current_phase = "state_skip_available"
             time.sleep(0.5)
             continue
 
         # 跳过
-        if current_phase == "state_skip_available" and match_template(screen, "icons/SGLX-TG.png", RIFT_POINTS["跳过识别区域"]):
+        if state == "skip":
             rift_log("🎬 跳过按钮已出现，点击跳过")
             server_socket.tap(*RIFT_POINTS["跳过按钮"])
             time.sleep(1.2)
@@ -234,8 +288,9 @@ def unified_state_loop(server_socket):
 
 # 失败处理
 def handle_failed_battle(server_socket):
-    global failure_count, last_level_text
+    global failure_count, _level_future
 
+    apply_rift_level(wait=LEVEL_OCR_TIMEOUT)
     rift_log("❌ 检测到战斗失败弹窗")
     server_socket.tap(*RIFT_POINTS["失败后关闭"])
     time.sleep(1.5)
@@ -243,7 +298,7 @@ def handle_failed_battle(server_socket):
     # 广告判断
     for _ in range(10):
         screen = capture_screen()
-        if screen is not None and match_template(screen, "icons/GG-LB.png", RIFT_POINTS["广告识别区域"]):
+        if screen is not None and rift_classifier.classify(screen, ("ad",)).matched == "ad":
             rift_log("📢 检测到广告弹窗，准备关闭")
             server_socket.tap(*RIFT_POINTS["关闭广告"])
             time.sleep(1.5)
@@ -252,32 +307,50 @@ def handle_failed_battle(server_socket):
             rift_log("✅ 未检测到广告弹窗，继续流程")
             break
 
-    # 层数识别
+    # 层数识别交给 OCR 进程池，不阻塞失败计数；结果由状态循环线程取回后更新层数再上报
     screen = capture_screen()
-    if screen is not None:
-        level_num = extract_rift_level(screen)
-        if level_num:
-            last_level_text = f"第{level_num}层"
-            rift_log(f"📌 当前关卡层数识别结果：{last_level_text}")
-        else:
-            rift_log("⚠️ 未能识别当前关卡层数")
+    _level_future = submit_rift_level(screen) if screen is not None else None
 
     # 更新失败次数
     failure_count += 1
     rift_log(f"⚠️ 当前关卡失败次数累计：{failure_count}/{failure_retry_limit}")
 
+    if _level_future is None and gs.rift_level_callback and last_level_text:
+        gs.rift_level_callback(last_level_text, failure_count)
+
+def apply_rift_level(wait=None):
+    """在状态循环线程里取回层数 OCR 结果并上报；wait=None 时只处理已完成的，不等待"""
+    global _level_future, last_level_text
+    future = _level_future
+    if future is None or (wait is None and not future.done()):
+        return
+    _level_future = None
+    try:
+        level_num = parse_rift_level(future.result(timeout=wait))
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        rift_log("⚠️ 层数 OCR 超时，沿用上次层数")
+        level_num = None
+    except Exception as e:
+        rift_log(f"❌ 层数 OCR 异常: {e}")
+        level_num = None
+    if level_num:
+        last_level_text = f"第{level_num}层"
+        rift_log(f"📌 当前关卡层数识别结果：{last_level_text}")
+    else:
+        rift_log("⚠️ 未能识别当前关卡层数")
+
     # 上报主控层数 + 失败次数
     if gs.rift_level_callback and last_level_text:
         gs.rift_level_callback(last_level_text, failure_count)
 
 # 层数OCR
-def extract_rift_level(screen):
+def rift_level_image(screen):
     region = RIFT_POINTS["关卡识别区域"]
-    x1, y1, x2, y2 = region
-    area = screen[y1:y2, x1:x2]
-    gray = cv2.cvtColor(area, cv2.COLOR_BGR2GRAY)
-    gray = cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY)[1]
-    text = pytesseract.image_to_string(gray, lang='chi_sim')
+    gray = as_frame(screen).gray_roi(region)
+    return cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY)[1]
+
+def parse_rift_level(text):
     rift_log(f"[OCR] 识别结果: {text}")
 
     import re
@@ -286,18 +359,6 @@ def extract_rift_level(screen):
         return int(match.group(1))
     return None
 
-# 通用模板匹配
-def match_template(screen, icon_path, region, threshold=0.85):
-    x1, y1, x2, y2 = region
-    area = screen[y1:y2, x1:x2]
-    gray = cv2.cvtColor(area, cv2.COLOR_BGR2GRAY)
-    tpl = cv2.imread(icon_path, 0)
-
-    # 加保护 ✅
-    if gray.shape[0] < tpl.shape[0] or gray.shape[1] < tpl.shape[1]:
-        rift_log(f"⚠️ 区域尺寸 {gray.shape} 小于模板 {tpl.shape}，跳过匹配：{icon_path}")
-        return False
-
-    res = cv2.matchTemplate(gray, tpl, cv2.TM_CCOEFF_NORMED)
-    return cv2.minMaxLoc(res)[1] >= threshold
-
+def submit_rift_level(screen):
+    """返回 Future，结果为 OCR 文本（交给 parse_rift_level 解析）"""
+    return tesseract_executor.image_to_string(rift_level_image(screen), lang='chi_sim')
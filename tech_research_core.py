@@ -2,14 +2,14 @@ import re
 import cv2
 import time
 import numpy as np
-import pytesseract
 import threading
-import easyocr
-import torch 
 import global_state as gs
 from utils.toast_notify import show_toast
-from utils.adb_tools import ScreenshotSocket
+from utils.adb_tools import get_screenshot_pool
 from position_config import RESEARCH_POINTS
+from utils.state_classifier import match_score
+from utils.ocr_pool import easyocr_executor
+from utils.digit_ocr import digit_ocr
 from tech_timer_manager import (
     set_research_timer, set_accelerate_timer,
     start_timer_thread, research_time_remaining, accelerate_cd_remaining
@@ -33,26 +33,9 @@ IMG_DONE_PATH = "icons/KJ-YJWC.png"
 IMG_ACCEL_TRUE_PATH = "icons/KJ-JSSJ-T.png"
 IMG_ACCEL_FALSE_PATH = "icons/YJ-JSSJ-F.png"
 
-try:
-    gpu_available = torch.cuda.is_available()
-except Exception:
-    gpu_available = False
-
-# 如果 CPU 版，强制设置 False，防止版本号里出现 +cpu 误判
-if "+cpu" in torch.__version__:
-    gpu_available = False
-
-print(f"🚀 EasyOCR 初始化，GPU 可用: {gpu_available}")
-reader = easyocr.Reader(['ch_sim'], gpu=gpu_available)
-
 # === 工具函数 ===
 def get_screenshot():
-    sock = ScreenshotSocket("127.0.0.1", 6101)
-    data = sock.request_screenshot()
-    if not data:
-        return None
-    arr = np.frombuffer(data, dtype=np.uint8)
-    return cv2.imdecode(arr, cv2.IMREAD_COLOR)
+    return get_screenshot_pool().capture()
 
 def safe_get_screenshot(retries=3, delay=1.0):
     for i in range(retries):
@@ -75,77 +58,58 @@ def crop(img, region):
     return img[y1:y2, x1:x2]
 
 def extract_time(region_img):
-    text = pytesseract.image_to_string(region_img, lang='chi_sim')
+    text = digit_ocr.read(region_img, r"\d{1,2}:\d{1,2}:\d{1,2}", lang='chi_sim')
     match = re.search(r"(\d{1,2}):(\d{1,2}):(\d{1,2})", text)
     if match:
         h, m, s = map(int, match.groups())
         return h * 3600 + m * 60 + s
     return None
 
-def match_template(region_img, template_path):
-    template = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)
-    gray = cv2.cvtColor(region_img, cv2.COLOR_BGR2GRAY)
-    res = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
-    _, max_val, _, _ = cv2.minMaxLoc(res)
-    return max_val > 0.8
+def match_template(img, region, template_path):
+    return (match_score(img, template_path, region) or 0.0) > 0.8
 
 def is_research_done(img):
-    region = crop(img, RESEARCH_POINTS["研究完成提示识别区域"])
-    return match_template(region, IMG_DONE_PATH)
+    return match_template(img, RESEARCH_POINTS["研究完成提示识别区域"], IMG_DONE_PATH)
+
+RESEARCHING_KEYWORDS = ["研究", "研", "究"]
+
 
 def is_currently_researching(img):
     x1, y1, x2, y2 = RESEARCH_POINTS["研究中判断区域"]
     roi = img[y1:y2, x1:x2]
     cv2.imwrite("debug_research_roi.png", roi)
 
-    # 1️⃣ 原图
-    print("🔍 尝试原图识别研究状态...")
-    results = reader.readtext(roi)
-    print("🧪 OCR原始结果（原图）:", results)
-    for _, text, conf in results:
-        text_clean = text.replace(" ", "")
-        if any(k in text_clean for k in ["研究", "研", "究"]) and conf > 0.08:
-            print(f"📘 【研究状态】识别成功 (原图): {text}")
-            return True
-
-    # 2️⃣ variant9 降亮度
-    variant9 = cv2.convertScaleAbs(roi, alpha=0.5, beta=0)
-    cv2.imwrite("research_current_variant9.png", variant9)
-    results = reader.readtext(variant9)
-    print("🧪 OCR原始结果（variant9）:", results)
-    for _, text, conf in results:
-        text_clean = text.replace(" ", "")
-        if any(k in text_clean for k in ["研究", "研", "究"]) and conf > 0.08:
-            print(f"📘 【研究状态】识别成功 (variant9): {text}")
-            return True
-
-    # 3️⃣ equalizeHist + adaptiveThreshold
-    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-    eq = cv2.equalizeHist(gray)
-    enhanced = cv2.adaptiveThreshold(eq, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
-                                     cv2.THRESH_BINARY, 11, 2)
-    cv2.imwrite("research_current_enhanced.png", enhanced)
-    results = reader.readtext(enhanced)
-    print("🧪 OCR原始结果（增强）:", results)
-    for _, text, conf in results:
-        text_clean = text.replace(" ", "")
-        if any(k in text_clean for k in ["研究", "研", "究"]) and conf > 0.08:
-            print(f"📘 【研究状态】识别成功 (增强): {text}")
-            return True
+    # 三种预处理依次交给 OCR 进程池：前一种没识别到才提交下一种，不做多余的整块识别
+    def variant9():  # 降亮度
+        img9 = cv2.convertScaleAbs(roi, alpha=0.5, beta=0)
+        cv2.imwrite("research_current_variant9.png", img9)
+        return img9
+
+    def enhanced():  # equalizeHist + adaptiveThreshold
+        gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+        eq = cv2.equalizeHist(gray)
+        img = cv2.adaptiveThreshold(eq, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                    cv2.THRESH_BINARY, 11, 2)
+        cv2.imwrite("research_current_enhanced.png", img)
+        return img
+
+    for name, prepare in (("原图", lambda: roi), ("variant9", variant9), ("增强", enhanced)):
+        print(f"🔍 尝试{name}识别研究状态...")
+        results = easyocr_executor.readtext(prepare()).result()
+        print(f"🧪 OCR原始结果（{name}）:", results)
+        for _, text, conf in results:
+            text_clean = text.replace(" ", "")
+            if any(k in text_clean for k in RESEARCHING_KEYWORDS) and conf > 0.08:
+                print(f"📘 【研究状态】识别成功 ({name}): {text}")
+                return True
 
     print("❌ 最终三阶段均未识别出研究状态")
     return False
 
 def is_accel_available(img):
-    region = crop(img, RESEARCH_POINTS["加速按钮识别区域"])  # 保留彩色，不转灰度
-    tpl_on = cv2.imread(IMG_ACCEL_TRUE_PATH)  # 彩色读图
-    tpl_off = cv2.imread(IMG_ACCEL_FALSE_PATH)  # 彩色读图
-
-    res_on = cv2.matchTemplate(region, tpl_on, cv2.TM_CCOEFF_NORMED)
-    res_off = cv2.matchTemplate(region, tpl_off, cv2.TM_CCOEFF_NORMED)
-
-    max_on = cv2.minMaxLoc(res_on)[1]
-    max_off = cv2.minMaxLoc(res_off)[1]
+    region = RESEARCH_POINTS["加速按钮识别区域"]  # 保留彩色，不转灰度
+    max_on = match_score(img, IMG_ACCEL_TRUE_PATH, region, color=True) or 0.0  # 彩色模板
+    max_off = match_score(img, IMG_ACCEL_FALSE_PATH, region, color=True) or 0.0
     diff = max_on - max_off
 
     print(f"匹配结果 → 亮:{max_on:.3f} / 灰:{max_off:.3f} → 差值:{diff:.3f}")
@@ -154,8 +118,10 @@ def is_accel_available(img):
     return diff > 0.01 and max_on > 0.75
 
 
-def detect_ke_yan_fa_with_easyocr(image):
-    region = RESEARCH_POINTS["可研发识别区域"] 
+def submit_ke_yan_fa_ocr(image):
+    """把 可研发 的通用增强 OCR 提前交给进程池，返回交给 detect_ke_yan_fa_with_easyocr 的 pending；
+    备用9 只在通用方案没识别到时才提交"""
+    region = RESEARCH_POINTS["可研发识别区域"]
     x1, y1, x2, y2 = region
     roi = image[y1:y2, x1:x2]
 
@@ -166,36 +132,37 @@ def detect_ke_yan_fa_with_easyocr(image):
                                      cv2.THRESH_BINARY, 11, 2)
     #cv2.imwrite("ke_yan_fa_enhanced.png", enhanced)
 
-    # --- 第一次识别 ---
-    print("🔍 正在用【通用增强方案】尝试识别 可研发 ...")
-    results = reader.readtext(enhanced)
+    return roi, (x1, y1), easyocr_executor.readtext(enhanced)
+
 
-    best_match = None
-    best_conf = 0
+def _best_ke_yan_fa(results, origin, label, best_match, best_conf):
+    x1, y1 = origin
     for bbox, text, conf in results:
-        print(f"[通用方案] 识别: {text} (conf={conf:.2f})")
+        print(f"[{label}] 识别: {text} (conf={conf:.2f})")
         if "可研发" in text and conf > best_conf:
             best_conf = conf
             (bx1, by1), (bx2, by2) = bbox[0], bbox[2]
             x = int((bx1 + bx2) / 2) + x1
             y = int((by1 + by2) / 2) + y1
             best_match = (x, y)
+    return best_match, best_conf
+
+
+def detect_ke_yan_fa_with_easyocr(image, pending=None):
+    """pending 为 submit_ke_yan_fa_ocr 的返回值；调用方可以先提交、点完别的再来取结果"""
+    roi, origin, enhanced_future = pending or submit_ke_yan_fa_ocr(image)
+
+    # --- 第一次识别 ---
+    print("🔍 正在用【通用增强方案】尝试识别 可研发 ...")
+    best_match, best_conf = _best_ke_yan_fa(enhanced_future.result(), origin, "通用方案", None, 0)
 
     # --- 如果通用方案识别不到 → fallback 用方案9 ---
     if best_match is None:
         print("⚠️ 通用增强未识别到 可研发，切换到【备用9】再试 ...")
         variant9 = cv2.convertScaleAbs(roi, alpha=0.5, beta=0)
         #cv2.imwrite("ke_yan_fa_variant9.png", variant9)
-        results = reader.readtext(variant9)
-
-        for bbox, text, conf in results:
-            print(f"[备用9] 识别: {text} (conf={conf:.2f})")
-            if "可研发" in text and conf > best_conf:
-                best_conf = conf
-                (bx1, by1), (bx2, by2) = bbox[0], bbox[2]
-                x = int((bx1 + bx2) / 2) + x1
-                y = int((by1 + by2) / 2) + y1
-                best_match = (x, y)
+        results = easyocr_executor.readtext(variant9).result()
+        best_match, best_conf = _best_ke_yan_fa(results, origin, "备用9", best_match, best_conf)
 
     # --- 返回结果 ---
     if best_match:
@@ -235,6 +202,7 @@ def initialize_research_state(socket):
     if _pause_callback: _pause_callback()
     global research_running, server_socket, has_requested_help
     server_socket = socket
+    easyocr_executor.start()  # 进研究页面的点击期间 OCR 子进程后台加载模型
     research_ready_event.clear()
     has_requested_help = False
     start_timer_thread()
@@ -249,9 +217,10 @@ def initialize_research_state(socket):
 
     if is_research_done(img):
         print("✅ 检测到研究完成图标，进入新研究流程")
+        pending = submit_ke_yan_fa_ocr(img)  # 关闭弹窗的同时识别
         server_socket.tap(*RESEARCH_POINTS["关闭研究完成页面"])
         time.sleep(0.6)
-        server_socket.tap(*detect_ke_yan_fa_with_easyocr(img))
+        server_socket.tap(*detect_ke_yan_fa_with_easyocr(img, pending))
         time.sleep(0.5)
         server_socket.tap(*RESEARCH_POINTS["科技研究按钮"])
         time.sleep(0.8)
@@ -284,9 +253,10 @@ def initialize_research_state(socket):
                 set_accelerate_timer(60, callback=try_click_accelerate)
         else:
             print("📌 当前未检测到研究状态，默认进入新研究流程")
+            pending = submit_ke_yan_fa_ocr(img)
             server_socket.tap(*RESEARCH_POINTS["关闭研究完成页面"])
             time.sleep(0.5)
-            server_socket.tap(*detect_ke_yan_fa_with_easyocr(img))
+            server_socket.tap(*detect_ke_yan_fa_with_easyocr(img, pending))
             time.sleep(0.5)
             server_socket.tap(*RESEARCH_POINTS["科技研究按钮"])
             time.sleep(0.5)
@@ -301,8 +271,7 @@ def initialize_research_state(socket):
         time.sleep(2.5)
         img = safe_get_screenshot()
         if img is not None:
-            region = crop(img, RESEARCH_POINTS["研究主页判断区"])
-            if not match_template(region, "icons/YJZY-JS.png"):
+            if not match_template(img, RESEARCH_POINTS["研究主页判断区"], "icons/YJZY-JS.png"):
                 print("✅ 科技图标已消失，成功返回主页")
                 research_ready_event.set()
                 break
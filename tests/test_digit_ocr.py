@@ -0,0 +1,48 @@
+# tests/test_digit_ocr.py
+# ✅ 数字识别：没有图集时直接走 tesseract；有图集时用真机裁图（tests/data/digits）检查不回退也不误读
+# 用法：python -m pytest -q tests
+import glob
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils import digit_ocr as digit_ocr_module  # noqa: E402
+from utils.digit_ocr import ATLAS_PATH, DigitOcr  # noqa: E402
+
+# 与 tech_research_core.extract_time / expedition_core.parse_scout_energy 相同的格式
+PATTERNS = {"research": (r"\d{1,2}:\d{1,2}:\d{1,2}", ":"), "energy": (r"\d+\s*/\s*\d+", "/")}
+REAL_CROPS = sorted(glob.glob(os.path.join(ROOT, "tests", "data", "digits", "*", "*.png")))
+
+
+def test_without_atlas_goes_straight_to_tesseract(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(digit_ocr_module, "image_to_string",
+                        lambda image, lang="eng", config="": calls.append(lang) or "08:36:59")
+    monkeypatch.setattr(digit_ocr_module, "extract_glyphs",
+                        lambda image: pytest.fail("没有图集时不应切字"))
+    ocr = DigitOcr(atlas_path=str(tmp_path / "missing.npz"))
+
+    image = np.zeros((59, 335, 3), dtype=np.uint8)
+    assert ocr.read(image, PATTERNS["research"][0], lang="chi_sim") == "08:36:59"
+    assert calls == ["chi_sim"]
+    assert ocr.stats == {"atlas": 0, "fallback": 1}
+
+
+@pytest.mark.skipif(not REAL_CROPS, reason="tests/data/digits 下没有真机裁图")
+@pytest.mark.skipif(not os.path.exists(os.path.join(ROOT, ATLAS_PATH)), reason="没有字形图集")
+@pytest.mark.parametrize("path", REAL_CROPS, ids=os.path.basename)
+def test_real_crop_reads_through_atlas(path, monkeypatch):
+    kind = os.path.basename(os.path.dirname(path))
+    pattern, sep = PATTERNS[kind]
+    expected = os.path.splitext(os.path.basename(path))[0].replace("-", sep)
+    monkeypatch.setattr(digit_ocr_module, "image_to_string",
+                        lambda *args, **kwargs: pytest.fail("图集没认出来，回退了 tesseract"))
+
+    ocr = DigitOcr(atlas_path=os.path.join(ROOT, ATLAS_PATH))
+    assert ocr.read(cv2.imread(path), pattern) == expected
@@ -0,0 +1,63 @@
+# tools/bench_ocr.py
+# ✅ OCR 后端基准：同一张截图上的裂隙层数 / 研究倒计时 / 侦察体力区域，
+# 对比 pytesseract（每次起进程）与进程内 tesserocr 句柄的耗时和识别结果
+# 用法：python -m tools.bench_ocr screenshot_from_socket.png [--rounds 20]
+import argparse
+import time
+
+import cv2
+
+from position_config import RESEARCH_POINTS, RIFT_POINTS, SCOUT_POINTS
+from utils.tesseract_engine import DIGITS_CONFIG, tesseract_engine
+
+
+def _crop(gray, region):
+    x1, y1, x2, y2 = region
+    return gray[y1:y2, x1:x2]
+
+
+def build_cases(gray):
+    """(名称, 图像, 语言, 配置)，预处理与各模块里的调用保持一致"""
+    return [
+        ("裂隙层数", cv2.threshold(_crop(gray, RIFT_POINTS["关卡识别区域"]), 128, 255, cv2.THRESH_BINARY)[1],
+         "chi_sim", ""),
+        ("研究倒计时", _crop(gray, RESEARCH_POINTS["研究剩余时间区域"]), "chi_sim", ""),
+        ("侦察体力", cv2.threshold(_crop(gray, SCOUT_POINTS["体力值区域"]), 180, 255, cv2.THRESH_BINARY)[1],
+         "eng", DIGITS_CONFIG),
+    ]
+
+
+def bench(func, image, lang, config, rounds):
+    func(image, lang=lang, config=config)  # 预热：进程内句柄在这里初始化
+    start = time.perf_counter()
+    for _ in range(rounds):
+        text = func(image, lang=lang, config=config)
+    return (time.perf_counter() - start) * 1000 / rounds, text.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pytesseract vs 进程内 tesserocr 基准")
+    parser.add_argument("image", help="整屏截图（1080x1920）")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    import pytesseract
+
+    gray = cv2.imread(args.image, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise SystemExit(f"❌ 读取失败: {args.image}")
+    if not tesseract_engine.in_process:
+        print("⚠️ 未安装 tesserocr，只测 pytesseract")
+
+    for name, image, lang, config in build_cases(gray):
+        old_ms, old_text = bench(pytesseract.image_to_string, image, lang, config, args.rounds)
+        line = f"{name:<8} pytesseract {old_ms:8.2f} ms  「{old_text}」"
+        if tesseract_engine.in_process:
+            new_ms, new_text = bench(tesseract_engine.image_to_string, image, lang, config, args.rounds)
+            same = "一致" if new_text == old_text else "不一致"
+            line += f"\n{'':<8} 进程内     {new_ms:8.2f} ms  「{new_text}」 加速 {old_ms / max(new_ms, 1e-6):.1f}x，结果{same}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
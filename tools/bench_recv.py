@@ -0,0 +1,95 @@
+# tools/bench_recv.py
+# ✅ 接收路径微基准：旧版 data += packet 拼接 vs 复用缓冲区 recv_into
+# 用法：python -m tools.bench_recv [--rounds 3]
+import argparse
+import os
+import socket
+import struct
+import threading
+import time
+
+from utils.adb_tools import ScreenshotSocket
+from utils.frame_listener import FrameListener
+
+# (场景名, 单条负载字节数, 条数)
+SCENARIOS = [
+    ("1080p 截图 PNG (~2.5MB)", int(2.5 * 1024 * 1024), 40),
+    ("1080p 截图 原始BGR (~6MB)", 1080 * 1920 * 3, 20),
+    ("视频流 P帧 8Mbps@60fps (~17KB)", 17 * 1024, 3000),
+    ("视频流 关键帧 (~150KB)", 150 * 1024, 600),
+]
+
+
+def legacy_recvall(sock, length):
+    """改造前 ScreenshotSocket._recvall / FrameListener._recv_exact 的写法"""
+    data = b""
+    while len(data) < length:
+        packet = sock.recv(length - len(data))
+        if not packet:
+            return None
+        data += packet
+    return data
+
+
+def _sender(sock, payload, count):
+    header = struct.pack(">I", len(payload))
+    for _ in range(count):
+        sock.sendall(header)
+        sock.sendall(payload)
+
+
+def _run(receive, payload, count):
+    a, b = socket.socketpair()
+    t = threading.Thread(target=_sender, args=(a, payload, count), daemon=True)
+    start = time.perf_counter()
+    t.start()
+    try:
+        for _ in range(count):
+            length = struct.unpack(">I", bytes(receive(b, 4)))[0]
+            if receive(b, length) is None:
+                raise RuntimeError("接收中断")
+    finally:
+        t.join()
+        a.close()
+        b.close()
+    return time.perf_counter() - start
+
+
+def screenshot_recv():
+    ss = ScreenshotSocket()
+    def receive(sock, length):
+        ss.sock = sock
+        return ss._recvall(length)
+    return receive
+
+
+def listener_recv():
+    fl = FrameListener()
+    fl.running = True
+    def receive(sock, length):
+        fl.sock = sock
+        return fl._recv_exact(length)
+    return receive
+
+
+def main():
+    parser = argparse.ArgumentParser(description="截图 / 视频流接收路径吞吐对比")
+    parser.add_argument("--rounds", type=int, default=3, help="每个场景重复次数，取最好成绩")
+    args = parser.parse_args()
+
+    receivers = [
+        ("旧版 bytes 拼接", lambda: legacy_recvall),
+        ("ScreenshotSocket._recvall", screenshot_recv),
+        ("FrameListener._recv_exact", listener_recv),
+    ]
+    for name, size, count in SCENARIOS:
+        payload = os.urandom(size)
+        total_mb = size * count / (1024 * 1024)
+        print(f"\n📦 {name}：{count} 条，共 {total_mb:.1f} MB")
+        for label, factory in receivers:
+            best = min(_run(factory(), payload, count) for _ in range(args.rounds))
+            print(f"   {label:<28} {total_mb / best:8.1f} MB/s   {best * 1000 / count:7.3f} ms/条")
+
+
+if __name__ == "__main__":
+    main()
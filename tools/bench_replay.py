@@ -0,0 +1,51 @@
+# tools/bench_replay.py
+# ✅ 录制回放基准：把录下来的视频流喂回 FrameListener，对每一帧跑裂隙分类器，统计解码 + 识别耗时
+# 用法：python -m tools.bench_replay recordings/blackbox_rift_exit_xxx_video [--speed 0] [--gray]
+import argparse
+import time
+from collections import Counter
+
+from utils.frame_listener import FrameListener
+from utils.recorder import ReplaySource, RecordingReader
+
+
+def main():
+    parser = argparse.ArgumentParser(description="录制回放 + 裂隙识别基准")
+    parser.add_argument("prefix", help="录制文件前缀（不含 .pkt / .idx）")
+    parser.add_argument("--speed", type=float, default=0, help="回放倍速，0 表示不等待尽快喂完")
+    parser.add_argument("--gray", action="store_true", help="解码端直接输出灰度（与裂隙模块一致）")
+    args = parser.parse_args()
+
+    from rift_core import rift_classifier  # 延迟导入：只看录制信息时不加载识别模块
+
+    reader = RecordingReader(args.prefix)
+    print(f"📼 {args.prefix}: {len(reader)} 条记录，时长 {reader.duration:.1f}s")
+
+    listener = FrameListener(source=ReplaySource(args.prefix, speed=args.speed),
+                             output_format="gray" if args.gray else "bgr24")
+    listener.black_box = None
+    listener.start()
+
+    seq, frames, states = 0, 0, Counter()
+    classify_time = 0.0
+    start = time.perf_counter()
+    while True:
+        seq, frame = listener.wait_for_new_frame(seq, timeout=1.0)
+        if frame is None:
+            if not listener.running:
+                break
+            continue
+        t0 = time.perf_counter()
+        states[rift_classifier.classify(frame).matched] += 1
+        classify_time += time.perf_counter() - t0
+        frames += 1
+    total = time.perf_counter() - start
+
+    print(f"🎞️ 识别 {frames} 帧（解码 {listener.frame_seq} 帧），总耗时 {total:.2f}s，"
+          f"识别平均 {classify_time * 1000 / max(frames, 1):.2f} ms/帧")
+    for state, count in states.most_common():
+        print(f"   {state or '（无匹配）':<16} {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# tools/build_glyph_atlas.py
+# ✅ 从样例截图生成数字字形图集（utils/digit_ocr 用）
+# 每个样例写成 "截图路径=区域里的文字"，区域用 position_config 里的名字或 x1,y1,x2,y2；
+# 文字按切出来的字符逐个对应（空格忽略），不想收录的字符写 "?"
+# 用法：python -m tools.build_glyph_atlas --region 研究剩余时间区域 shots/a.png=01:23:45 shots/b.png=?12:05:59
+#       python -m tools.build_glyph_atlas --region 体力值区域 --merge shots/c.png=35/50 --dump glyph_debug
+import argparse
+import os
+
+import cv2
+
+import position_config
+from utils.digit_ocr import ATLAS_PATH, GlyphAtlas, extract_glyphs
+
+
+def resolve_region(spec):
+    """区域名（在 position_config 的各个 *_POINTS 里查）或 "x1,y1,x2,y2" """
+    if spec is None:
+        return None
+    if "," in spec:
+        return tuple(int(v) for v in spec.split(","))
+    for name in dir(position_config):
+        table = getattr(position_config, name)
+        if name.endswith("_POINTS") and isinstance(table, dict) and spec in table:
+            return table[spec]
+    raise SystemExit(f"❌ position_config 里找不到区域: {spec}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从样例截图生成数字字形图集")
+    parser.add_argument("samples", nargs="+", help="截图路径=文字，例如 shots/a.png=01:23:45")
+    parser.add_argument("--region", help="裁剪区域：position_config 中的名字或 x1,y1,x2,y2；不填表示截图已是裁好的区域")
+    parser.add_argument("--out", default=ATLAS_PATH, help=f"输出图集路径（默认 {ATLAS_PATH}）")
+    parser.add_argument("--merge", action="store_true", help="追加到已有图集，而不是覆盖")
+    parser.add_argument("--dump", help="把切出来的字形另存为 PNG 到此目录，便于检查切分")
+    args = parser.parse_args()
+
+    region = resolve_region(args.region)
+    atlas = GlyphAtlas.load(args.out) if args.merge and os.path.exists(args.out) else GlyphAtlas()
+    before = len(atlas)
+
+    for sample in args.samples:
+        path, sep, text = sample.rpartition("=")
+        if not sep:
+            print(f"⚠️ 跳过 {sample}：缺少 =文字")
+            continue
+        image = cv2.imread(path)
+        if image is None:
+            print(f"⚠️ 跳过 {path}：读取失败")
+            continue
+        if region is not None:
+            x1, y1, x2, y2 = region
+            image = image[y1:y2, x1:x2]
+        text = text.replace(" ", "")
+        glyphs = extract_glyphs(image)
+        if len(glyphs) != len(text):
+            print(f"⚠️ 跳过 {path}：切出 {len(glyphs)} 个字符，文字有 {len(text)} 个（{text}）")
+            continue
+        for i, (label, glyph) in enumerate(zip(text, glyphs)):
+            if label == "?":
+                continue
+            atlas.add(label, glyph)
+            if args.dump:
+                os.makedirs(args.dump, exist_ok=True)
+                name = {":": "colon", "/": "slash"}.get(label, label)
+                cv2.imwrite(os.path.join(args.dump, f"{name}_{os.path.basename(path)}_{i}.png"), glyph)
+        print(f"✅ {path}: {text}")
+
+    if len(atlas) == before:
+        print("❌ 没有收录任何字形，图集未写出")
+        return
+    atlas.save(args.out)
+    labels = sorted(set(atlas.labels.tolist()))
+    print(f"📦 图集已写出 {args.out}: {len(atlas)} 个样本（新增 {len(atlas) - before}），字符 {''.join(labels)}")
+
+
+if __name__ == "__main__":
+    main()
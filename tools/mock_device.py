@@ -0,0 +1,456 @@
+# tools/mock_device.py
+# ✅ 本地模拟设备：不开模拟器也能跑通 6100 触控 / 6101 截图与视频流 / 6102 控制，用于联调和端到端基准
+# 用法：python -m tools.mock_device --image screenshot_from_socket.png [--port 6101] [--legacy]
+#       python -m tools.mock_device --script scenes.json [--video-packets rift.h264pkt]
+# 场景脚本（JSON）：
+#   {"scenes": {"main": "icons/main.png", "expedition": "shots/exp.png"}, "start": "main",
+#    "taps": [{"region": [x1, y1, x2, y2], "when": "main", "goto": "expedition", "delay": 0.5}]}
+import argparse
+import json
+import os
+import socketserver
+import struct
+import threading
+import time
+import zlib
+from fractions import Fraction
+
+import av
+
+import cv2
+import numpy as np
+
+from utils.adb_tools import (
+    ROI_MAGIC, ROI_HEADER, ROI_ITEM, ROI_ENCODINGS,
+    DELTA_MAGIC, DELTA_HEADER, DELTA_TILE,
+)
+
+
+def _log(msg):
+    print(f"[{time.strftime('%H:%M:%S')}] [MockDevice] {msg}")
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockScreenshotServer:
+    """6101 截图端口替身：支持 screenshot / caps / screenshot_roi / screenshot_delta；legacy=True 时模拟老服务端（每次应答后断开，不认扩展命令）"""
+
+    def __init__(self, image_source, host="127.0.0.1", port=6101, legacy=False,
+                 mode_source=None, packet_source=None, fps=30):
+        # image_source：BGR ndarray，或每次调用返回 BGR ndarray 的函数（用于切换场景）
+        self.image_source = image_source
+        self.legacy = legacy
+        self.mode_source = mode_source      # 返回当前模式的函数；为视频流模式时新连接直接推 H.264
+        self.packet_source = packet_source  # 录制好的 H.264 包列表，给了就循环回放，否则实时编码当前画面
+        self.fps = fps
+        self.requests = []  # [(时间戳, 命令)]，测试里检查客户端发了什么
+        self._server = _ThreadingServer((host, port), self._make_handler())
+        self.port = self._server.server_address[1]
+
+    def current_image(self):
+        src = self.image_source
+        return src() if callable(src) else src
+
+    def _make_handler(self):
+        owner = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                if owner.mode_source is not None and owner.mode_source() == "VIDEO_STREAM_MODE":
+                    owner.requests.append((time.time(), "<video stream>"))
+                    owner.stream_video(self.wfile)
+                    return
+                state = {}  # 连接级状态（增量截图的基准帧）
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    cmd = line.decode(errors="ignore").strip()
+                    owner.requests.append((time.time(), cmd))
+                    if not owner.dispatch(cmd, self.wfile, state):
+                        return
+
+        return Handler
+
+    def dispatch(self, cmd, out, state=None):
+        """处理一条命令，返回 False 表示关闭连接；state 为连接级状态"""
+        name, _, args = cmd.partition(" ")
+        if name == "screenshot":
+            ok, png = cv2.imencode(".png", self.current_image())
+            out.write(struct.pack(">I", len(png)) + png.tobytes())
+            return not self.legacy
+        if self.legacy:
+            _log(f"⚠️ 老协议不认识命令: {cmd}")
+            return False
+        if name == "caps":
+            out.write(b"CAPS:" + ",".join(["roi", "delta"] + list(ROI_ENCODINGS)).encode() + b"\n")
+            return True
+        if name == "screenshot_roi":
+            out.write(self._encode_regions(args))
+            return True
+        if name == "screenshot_delta":
+            out.write(self._encode_delta(args, state if state is not None else {}))
+            return True
+        _log(f"⚠️ 未知命令: {cmd}")
+        return True
+
+    def _encode_regions(self, args):
+        opts = dict(kv.split("=", 1) for kv in args.split() if "=" in kv)
+        fmt = opts.get("fmt", "raw")
+        quality = int(opts.get("q", 80))
+        img = self.current_image()
+        h, w = img.shape[:2]
+        rects = [tuple(int(v) for v in r.split(",")) for r in opts.get("rects", "").split(";") if r]
+        if not rects:
+            rects = [(0, 0, w, h)]
+        parts = [ROI_HEADER.pack(ROI_MAGIC, w, h, len(rects))]
+        for x1, y1, x2, y2 in rects:
+            crop = np.ascontiguousarray(img[y1:y2, x1:x2])
+            if fmt == "raw":
+                payload = crop.tobytes()
+            elif fmt == "jpeg":
+                payload = cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+            else:
+                payload = cv2.imencode(".png", crop)[1].tobytes()
+            channels = crop.shape[2] if crop.ndim == 3 else 1
+            parts.append(ROI_ITEM.pack(x1, y1, x2, y2, ROI_ENCODINGS[fmt], channels, len(payload)))
+            parts.append(payload)
+        return b"".join(parts)
+
+    def _encode_delta(self, args, state):
+        opts = dict(kv.split("=", 1) for kv in args.split() if "=" in kv)
+        tile = max(8, int(opts.get("tile", 64)))
+        base = int(opts.get("base", 0))
+        img = np.ascontiguousarray(self.current_image())
+        h, w = img.shape[:2]
+        prev = state.get("image")
+        # 客户端基准和本连接上一帧对不上（或瓦片尺寸变了）就发整帧
+        if not base or base != state.get("frame_id") or state.get("tile") != tile or prev is None or prev.shape != img.shape:
+            base, prev = 0, None
+        frame_id = state.get("frame_id", 0) + 1
+        parts = []
+        cols = (w + tile - 1) // tile
+        for index in range(cols * ((h + tile - 1) // tile)):
+            r, c = divmod(index, cols)
+            y1, x1 = r * tile, c * tile
+            crop = img[y1:y1 + tile, x1:x1 + tile]
+            if prev is not None and np.array_equal(crop, prev[y1:y1 + tile, x1:x1 + tile]):
+                continue
+            payload = np.ascontiguousarray(crop).tobytes()
+            parts.append(DELTA_TILE.pack(index, zlib.crc32(payload)))
+            parts.append(payload)
+        state.update(image=img.copy(), frame_id=frame_id, tile=tile)
+        header = DELTA_HEADER.pack(DELTA_MAGIC, frame_id, base, w, h, tile, len(parts) // 2)
+        return header + b"".join(parts)
+
+    def _encoded_packets(self):
+        img = self.current_image()
+        h, w = img.shape[:2]
+        encoder = av.codec.CodecContext.create("libx264", "w")
+        encoder.width, encoder.height = w - w % 2, h - h % 2
+        encoder.pix_fmt = "yuv420p"
+        encoder.time_base = Fraction(1, self.fps)
+        encoder.options = {"preset": "ultrafast", "tune": "zerolatency", "x264-params": "keyint=30:repeat-headers=1"}
+        pts = 0
+        while True:
+            img = self.current_image()[:encoder.height, :encoder.width]
+            frame = av.VideoFrame.from_ndarray(np.ascontiguousarray(img), format="bgr24")
+            frame.pts = pts
+            pts += 1
+            for packet in encoder.encode(frame):
+                yield bytes(packet)
+
+    def stream_video(self, out):
+        """视频流模式：按 fps 推送 4 字节长度 + H.264 包，直到客户端断开或切回截图模式"""
+        packets = self._encoded_packets() if self.packet_source is None else _cycle(self.packet_source)
+        interval = 1.0 / self.fps
+        next_at = time.time()
+        try:
+            for payload in packets:
+                if self.mode_source() != "VIDEO_STREAM_MODE":
+                    break
+                out.write(struct.pack(">I", len(payload)) + payload)
+                out.flush()
+                next_at += interval
+                time.sleep(max(0.0, next_at - time.time()))
+        except (BrokenPipeError, ConnectionError, OSError):
+            pass
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        _log(f"✅ 截图端口已启动: {self._server.server_address}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _cycle(packets):
+    while True:
+        yield from packets
+
+
+def load_packets(path):
+    """读取 4 字节长度 + 数据 连续拼接的 H.264 包文件"""
+    packets = []
+    with open(path, "rb") as f:
+        while True:
+            head = f.read(4)
+            if len(head) < 4:
+                break
+            packets.append(f.read(struct.unpack(">I", head)[0]))
+    return packets
+
+
+class _LineServer:
+    """按行收命令的端口，handle_line(line, out, state) 返回 False 时断开"""
+
+    name = ""
+
+    def __init__(self, host, port):
+        self.requests = []  # [(时间戳, 命令)]
+        self._server = _ThreadingServer((host, port), self._make_handler())
+        self.port = self._server.server_address[1]
+
+    def _make_handler(self):
+        owner = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                state = {"out": self.wfile}
+                try:
+                    while True:
+                        line = self.rfile.readline()
+                        if not line:
+                            return
+                        cmd = line.decode(errors="ignore").strip()
+                        owner.requests.append((time.time(), cmd))
+                        if owner.handle_line(cmd, self.wfile, state) is False:
+                            return
+                finally:
+                    owner.disconnected(state)
+
+        return Handler
+
+    def handle_line(self, cmd, out, state):
+        raise NotImplementedError
+
+    def disconnected(self, state):
+        pass
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        _log(f"✅ {self.name}端口已启动: {self._server.server_address}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class MockTouchServer(_LineServer):
+    """6100 触控端口替身：tap / swipe / caps / macro，支持 "#序号 " 标签；点击交给 on_tap 回调。
+    legacy=True 模拟老服务端：不应答 caps、不认识宏和标签"""
+
+    name = "触控"
+
+    def __init__(self, host="127.0.0.1", port=6100, on_tap=None, ack_delay=0.0, legacy=False):
+        super().__init__(host, port)
+        self.on_tap = on_tap
+        self.ack_delay = ack_delay  # 模拟服务端处理耗时
+        self.legacy = legacy
+
+    def handle_line(self, cmd, out, state):
+        tag = ""
+        if cmd.startswith("#") and not self.legacy:
+            tag, _, cmd = cmd.partition(" ")
+            tag += " "
+        name, _, args = cmd.partition(" ")
+        if name == "caps":
+            if not self.legacy:
+                out.write((tag + "CAPS:macro,tag\n").encode())
+            return True
+        if name == "macro" and not self.legacy:
+            for step in args.split(";"):
+                self._run_step(step.split())
+        elif name in ("tap", "swipe"):
+            self._run_step(cmd.split())
+        else:
+            _log(f"⚠️ 触控端口未知命令: {cmd}")
+            out.write((tag + "ERR\n").encode())
+            return True
+        if self.ack_delay:
+            time.sleep(self.ack_delay)
+        out.write((tag + "OK\n").encode())
+        return True
+
+    def _run_step(self, parts):
+        if not parts:
+            return
+        if parts[0] == "tap" and self.on_tap:
+            self.on_tap(int(parts[1]), int(parts[2]))
+        elif parts[0] == "swipe":
+            time.sleep(int(parts[5]) / 1000.0)
+        elif parts[0] == "wait":
+            time.sleep(int(parts[1]) / 1000.0)
+
+
+class MockControlServer(_LineServer):
+    """6102 控制端口替身：query_status / SWITCH_TO_VIDEO / SWITCH_TO_SCREENSHOT / subscribe_mode"""
+
+    name = "控制"
+
+    def __init__(self, host="127.0.0.1", port=6102, switch_delay=0.2):
+        super().__init__(host, port)
+        self.mode = "SCREENSHOT_MODE"
+        self.switch_delay = switch_delay  # 应答后过多久真正完成切换
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def set_mode(self, mode):
+        with self._lock:
+            self.mode = mode
+            subscribers = list(self._subscribers)
+        for out in subscribers:
+            try:
+                out.write(f"EVENT:MODE:{mode}\n".encode())
+            except Exception:
+                pass
+
+    def handle_line(self, cmd, out, state):
+        upper = cmd.upper()
+        if upper == "QUERY_STATUS":
+            out.write(f"STATUS:{self.mode}\n".encode())
+        elif upper in ("SWITCH_TO_VIDEO", "SWITCH_TO_SCREENSHOT"):
+            out.write(f"ACK_{upper}\n".encode())
+            mode = "VIDEO_STREAM_MODE" if upper == "SWITCH_TO_VIDEO" else "SCREENSHOT_MODE"
+            threading.Timer(self.switch_delay, self.set_mode, args=(mode,)).start()
+        elif upper == "SUBSCRIBE_MODE":
+            out.write(f"ACK_SUBSCRIBE_MODE\nSTATUS:{self.mode}\n".encode())
+            with self._lock:
+                self._subscribers.append(out)
+        else:
+            _log(f"⚠️ 控制端口未知命令: {cmd}")
+            out.write(b"ERR_UNKNOWN\n")
+        return True
+
+    def disconnected(self, state):
+        with self._lock:
+            if state["out"] in self._subscribers:
+                self._subscribers.remove(state["out"])
+
+
+class MockDevice:
+    """三个端口 + 场景脚本：点击落在规则区域内时切换场景，所有命令带时间戳记录"""
+
+    def __init__(self, scenes, start=None, host="127.0.0.1", ports=(6100, 6101, 6102),
+                 packet_source=None, fps=30, ack_delay=0.0):
+        self.scenes = scenes  # 场景名 → BGR ndarray
+        self.scene = start or next(iter(scenes))
+        self.tap_rules = []
+        self.scene_log = []  # [(时间戳, 场景名)]
+        touch_port, screenshot_port, control_port = ports
+        self.control = MockControlServer(host, control_port)
+        self.touch = MockTouchServer(host, touch_port, on_tap=self.handle_tap, ack_delay=ack_delay)
+        self.screenshot = MockScreenshotServer(self.current_image, host, screenshot_port,
+                                               mode_source=lambda: self.control.mode,
+                                               packet_source=packet_source, fps=fps)
+
+    def on_tap(self, region, goto, when=None, delay=0.0):
+        """点击 region 内时切到场景 goto；when 限定只在某个场景下生效，delay 模拟过场动画"""
+        self.tap_rules.append((tuple(region), goto, when, delay))
+        return self
+
+    def current_image(self):
+        return self.scenes[self.scene]
+
+    def set_scene(self, name):
+        self.scene = name
+        self.scene_log.append((time.time(), name))
+        _log(f"🎬 场景切换: {name}")
+
+    def handle_tap(self, x, y):
+        for (x1, y1, x2, y2), goto, when, delay in self.tap_rules:
+            if x1 <= x <= x2 and y1 <= y <= y2 and (when is None or when == self.scene):
+                if delay:
+                    threading.Timer(delay, self.set_scene, args=(goto,)).start()
+                else:
+                    self.set_scene(goto)
+                return
+
+    @property
+    def commands(self):
+        """全部端口收到的命令，按时间排序：[(时间戳, 端口名, 命令)]"""
+        merged = [(ts, "touch", cmd) for ts, cmd in self.touch.requests]
+        merged += [(ts, "screenshot", cmd) for ts, cmd in self.screenshot.requests]
+        merged += [(ts, "control", cmd) for ts, cmd in self.control.requests]
+        return sorted(merged)
+
+    def start(self):
+        for server in (self.touch, self.screenshot, self.control):
+            server.start()
+        return self
+
+    def stop(self):
+        for server in (self.touch, self.screenshot, self.control):
+            server.stop()
+
+    @classmethod
+    def from_script(cls, path, **kwargs):
+        with open(path, "r", encoding="utf-8") as f:
+            script = json.load(f)
+        base = os.path.dirname(os.path.abspath(path))
+        scenes = {}
+        for name, image_path in script["scenes"].items():
+            image = cv2.imread(os.path.join(base, image_path), cv2.IMREAD_COLOR)
+            if image is None:
+                raise SystemExit(f"❌ 场景图片读取失败: {image_path}")
+            scenes[name] = image
+        device = cls(scenes, script.get("start"), **kwargs)
+        for rule in script.get("taps", []):
+            device.on_tap(rule["region"], rule["goto"], rule.get("when"), rule.get("delay", 0.0))
+        return device
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟设备")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--image", help="只起截图端口，返回这张图片")
+    source.add_argument("--script", help="场景脚本（JSON），同时起 6100 / 6101 / 6102 三个端口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6101, help="--image 模式下的截图端口")
+    parser.add_argument("--legacy", action="store_true", help="模拟不支持扩展协议的老服务端")
+    parser.add_argument("--video-packets", help="视频流模式回放的 H.264 包文件（4 字节长度 + 数据）")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--log", help="退出时把收到的全部命令写到该文件")
+    args = parser.parse_args()
+
+    if args.image:
+        image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+        if image is None:
+            raise SystemExit(f"❌ 图片读取失败: {args.image}")
+        device = MockScreenshotServer(image, args.host, args.port, args.legacy).start()
+    else:
+        packets = load_packets(args.video_packets) if args.video_packets else None
+        device = MockDevice.from_script(args.script, host=args.host, packet_source=packets, fps=args.fps).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.log:
+            commands = device.commands if isinstance(device, MockDevice) else [
+                (ts, "screenshot", cmd) for ts, cmd in device.requests]
+            with open(args.log, "w", encoding="utf-8") as f:
+                for ts, port, cmd in commands:
+                    f.write(f"{ts:.3f}\t{port}\t{cmd}\n")
+            _log(f"📝 命令记录已写入 {args.log}（{len(commands)} 条）")
+
+
+if __name__ == "__main__":
+    main()
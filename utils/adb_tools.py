@@ -1,11 +1,16 @@
 import socket
+import threading
 import time
 import struct
+from collections import deque
 from PIL import Image
 import io
+import cv2
 import numpy as np
-from datetime import datetime
+import zlib
 from utils.frame_listener import FrameListener
+from utils.frame_context import Frame, TileChanges
+from utils.recorder import KIND_IMAGE, PacketRecorder, screenshot_black_box
 
 # === 日志控制 ===
 DEBUG_MODE = False
@@ -14,63 +19,210 @@ def log(msg):
     if DEBUG_MODE:
         print(msg)
 
+class TouchAck:
+    """一条已发出的触控指令；应答由后台读线程填入"""
+    __slots__ = ("seq", "cmd", "sent_at", "expect", "resp", "_event")
+
+    def __init__(self, seq, cmd, expect=0.0):
+        self.seq = seq
+        self.cmd = cmd
+        self.sent_at = time.time()
+        self.expect = expect  # 服务端执行本指令本身需要的时长（滑动 / 宏），不计入丢失判定
+        self.resp = None
+        self._event = threading.Event()
+
+    @property
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """等待应答，超时返回 None"""
+        self._event.wait(timeout)
+        return self.resp
+
+    def _resolve(self, resp):
+        self.resp = resp
+        self._event.set()
+
+
 class TouchServerSocket:
-    def __init__(self, host="127.0.0.1", port=6100):
+    """6100 触控连接：指令直接写出不等应答，后台线程按发送顺序（或序号标签）匹配应答。
+    标签模式下指令前加 "#序号 "，服务端原样带回序号，应答丢失也不会错位；
+    tagged=None 时按 caps 协商（服务端声明 "tag" 才开启），True / False 为强制"""
+
+    def __init__(self, host="127.0.0.1", port=6100, tagged=None, ack_lost_after=2.0):
         self.host = host
         self.port = port
         self.sock = None
         self.is_connected = False  # 新增标识连接状态的变量
+        self.want_tagged = tagged
+        self.tagged = bool(tagged)
+        self.ack_lost_after = ack_lost_after  # 超过该时长仍未应答的指令记为丢失，不再参与匹配
+        self._pending = deque()
+        self._seq = 0
+        self._write_lock = threading.Lock()
+        self._connect_lock = threading.Lock()  # 调度线程 / tap() / 主控连接监控都可能同时重连
+        self._reader = None
+        self.caps = None  # 服务端扩展能力（如 "macro" / "tag"），每次建立连接前探测
+        self.stats = {"sent": 0, "acked": 0, "timeouts": 0, "lost": 0}
 
     def connect(self):
-        try:
-            if self.sock is None:
-                self.sock = socket.socket()
-                self.sock.connect((self.host, self.port))
+        if self.sock is not None:
+            return
+        with self._connect_lock:
+            if self.sock is not None:
+                return  # 等锁期间别的线程已经连上
+            sock = None
+            try:
+                # 先在独立短连接上探测能力，确定是否启用标签，再建立下发指令的连接
+                self.caps = self._probe_caps(CAPS_PROBE_TIMEOUT)
+                self.tagged = "tag" in self.caps if self.want_tagged is None else self.want_tagged
+                sock = socket.create_connection((self.host, self.port))
+                self._reader = threading.Thread(target=self._read_acks, args=(sock,), daemon=True)
+                self.sock = sock
                 self.is_connected = True
+                self._reader.start()
                 log("✅ 成功连接到 TouchServer")
-        except Exception as e:
-            log(f"❌ 连接失败：{e}")
-            self.is_connected = False
+            except Exception as e:
+                log(f"❌ 连接失败：{e}")
+                if sock is not None:
+                    sock.close()
+                self.sock = None
+                self.is_connected = False
 
     def close(self):
         try:
             if self.is_connected and self.sock:
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except Exception:
+                    pass
                 self.sock.close()
-                self.is_connected = False
                 log("✅ 关闭 Socket 连接")
         except Exception as e:
             log(f"❌ 关闭连接失败：{e}")
+        finally:
+            self.sock = None
+            self.is_connected = False
+            self._fail_pending()
 
-    def send_command(self, cmd, timeout=0.1):
-        try:
-            if self.is_connected:
-                self.sock.sendall(cmd.encode())
-                self.sock.settimeout(timeout)
-                resp = self.sock.recv(128).decode().strip()
-                return resp
+    def _fail_pending(self):
+        with self._write_lock:
+            pending, self._pending = self._pending, deque()
+        for ack in pending:
+            ack._resolve(None)
+
+    def _expire_pending(self, now):
+        # 调用方持有 _write_lock；队头长时间没应答视为丢失，避免后续应答全部错位
+        while self._pending and now - self._pending[0].sent_at - self._pending[0].expect > self.ack_lost_after:
+            ack = self._pending.popleft()
+            self.stats["lost"] += 1
+            log(f"⚠️ 应答丢失（指令：{ack.cmd.strip()}）")
+            ack._resolve(None)
+
+    def _match(self, line):
+        with self._write_lock:
+            self._expire_pending(time.time())
+            if self.tagged and line.startswith("#"):
+                tag, _, line = line[1:].partition(" ")
+                ack = next((a for a in self._pending if str(a.seq) == tag), None)
+                if ack is not None:
+                    self._pending.remove(ack)
             else:
-                log("❌ Socket 未连接")
-                return None
-        except socket.timeout:
-            log(f"⚠️ 接收超时（指令：{cmd.strip()}）")
+                ack = self._pending.popleft() if self._pending else None
+            if ack is not None:
+                self.stats["acked"] += 1
+        if ack is None:
+            log(f"⚠️ 收到无主应答: {line}")
+            return
+        log(f"{ack.cmd.strip()} → {line} ✅ 延迟: {int((time.time() - ack.sent_at) * 1000)}ms")
+        ack._resolve(line)
+
+    def _read_acks(self, sock):
+        buf = b""
+        while True:
+            try:
+                chunk = sock.recv(4096)
+            except Exception:
+                chunk = b""
+            if not chunk:
+                break
+            buf += chunk
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                self._match(line.decode(errors="ignore").strip())
+        if self.sock is sock:
+            log("⚠️ TouchServer 连接已断开")
+            self.sock = None
+            self.is_connected = False
+        self._fail_pending()
+
+    def send_nowait(self, cmd, expect=0.0):
+        """写出指令立即返回 TouchAck，未连接或发送失败返回 None；expect 为服务端执行该指令的预计时长"""
+        if not self.is_connected:
+            log("❌ Socket 未连接")
             return None
+        try:
+            with self._write_lock:
+                self._seq += 1
+                ack = TouchAck(self._seq, cmd, expect)
+                # 先登记再写出，读线程不会先于登记收到应答
+                self._pending.append(ack)
+                self.sock.sendall((f"#{ack.seq} {cmd}" if self.tagged else cmd).encode())
+                self.stats["sent"] += 1
+            return ack
         except Exception as e:
             log(f"❌ 发送失败：{e}")
+            self.close()
             return None
 
-    def tap(self, x, y, delay=0.05):
+    def send_command(self, cmd, timeout=0.1):
+        """发送并等待应答；超时返回 None，迟到的应答仍归属本指令，不会被下一条指令读走"""
+        ack = self.send_nowait(cmd)
+        if ack is None:
+            return None
+        resp = ack.wait(timeout)
+        if resp is None and not ack.done:
+            self.stats["timeouts"] += 1
+            log(f"⚠️ 接收超时（指令：{cmd.strip()}）")
+        return resp
+
+    def _probe_caps(self, timeout):
+        """在独立短连接上发 "caps"，不经过应答队列：老服务端不应答只是等到超时，不会让指令应答错位。
+        不应答、回别的内容或连不上都视为无扩展"""
+        caps = set()
+        try:
+            with socket.create_connection((self.host, self.port), timeout=timeout) as probe:
+                probe.sendall(b"caps\n")
+                resp = probe.makefile("rb").readline().decode(errors="ignore").strip()
+            if resp.startswith("CAPS:"):
+                caps = {c.strip() for c in resp[5:].split(",") if c.strip()}
+        except OSError:
+            pass
+        log(f"📡 TouchServer 能力: {sorted(caps) or '无扩展'}")
+        return caps
+
+    def probe_caps(self, timeout=None):
+        """服务端扩展能力；正常情况下 connect() 时已探测，这里只在未连接时补一次"""
+        if self.caps is None:
+            if not self.is_connected:
+                self.connect()
+            if self.caps is None:
+                self.caps = self._probe_caps(CAPS_PROBE_TIMEOUT if timeout is None else timeout)
+        return self.caps
+
+    def supports(self, *features):
+        return all(f in self.probe_caps() for f in features)
+
+    def tap(self, x, y, delay=0.05, wait=False):
+        """默认不等应答；wait=True 时等待应答并返回"""
         try:
             if not self.is_connected:
                 self.connect()
             cmd = f"tap {x} {y}\n"
-            start = time.time()
-            send_ts = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-            resp = self.send_command(cmd)
-            end = time.time()
-            cost_ms = int((end - start) * 1000)
-            if resp:
-                log(f"{send_ts} | tap({x},{y}) → {resp} ✅ 延迟: {cost_ms}ms")
+            resp = self.send_command(cmd) if wait else self.send_nowait(cmd)
             time.sleep(delay)
+            return resp
         except Exception as e:
             log(f"❌ 点击失败：{e}")
 
@@ -79,16 +231,66 @@ class TouchServerSocket:
             self.connect()
         duration = int(duration)
         cmd = f"swipe {x1} {y1} {x2} {y2} {duration}\n"
-        resp = self.send_command(cmd)
-        if resp:
-            log(f"发送: {cmd.strip()} → 返回: {resp}")
+        self.send_nowait(cmd, duration / 1000.0)
         time.sleep(duration / 1000.0)
 
+# === 6101 截图扩展协议（ROI / 原始像素）===
+SCREENSHOT_CMD = b"screenshot\n"  # 老协议：整屏编码截图
+# 能力探测：发 "caps\n"，支持的服务端回一行 "CAPS:roi,raw,jpeg,..."；老服务端不回或回别的即视为不支持
+# 区域请求："screenshot_roi fmt=raw|jpeg|png q=80 rects=x1,y1,x2,y2;x1,y1,x2,y2\n"（rects 为空表示整屏）
+# 区域应答：ROI_HEADER（魔数, 屏宽, 屏高, 区域数），随后每个区域 ROI_ITEM（x1, y1, x2, y2, 编码, 通道数, 长度）+ 数据
+ROI_MAGIC = b"ROI1"
+ROI_HEADER = struct.Struct(">4sHHB")
+ROI_ITEM = struct.Struct(">HHHHBBI")
+ROI_ENCODINGS = {"raw": 0, "jpeg": 1, "png": 2}
+CAPS_PROBE_TIMEOUT = 0.5
+
+# 增量截图（caps 含 "delta"）：客户端保留上一帧，服务端只发变化的瓦片
+# 请求："screenshot_delta tile=64 base=<上一帧编号，0 表示没有>\n"
+# 应答：DELTA_HEADER（魔数, 本帧编号, 基准帧编号, 屏宽, 屏高, 瓦片边长, 瓦片数），
+#      随后每个瓦片 DELTA_TILE（瓦片序号, crc32）+ 原始 BGR 数据；基准帧编号为 0 表示整帧所有瓦片都在其中
+# 瓦片按行优先编号，最右一列 / 最下一行按屏幕边缘截断
+DELTA_MAGIC = b"DLT1"
+DELTA_HEADER = struct.Struct(">4sIIHHHI")
+DELTA_TILE = struct.Struct(">II")
+DELTA_TILE_SIZE = 64
+
+# 长连接退化：同一连接上的复用请求连续失败 PERSIST_DEGRADE_AFTER 次才改用短连接，
+# 退化后每隔 PERSIST_REPROBE_INTERVAL 秒再试一次长连接，偶发断线不会让之后一直走短连接
+PERSIST_DEGRADE_AFTER = 2
+PERSIST_REPROBE_INTERVAL = 60.0
+
+# 截图录制：开启后每张完整截图的原始编码数据原样落盘
+_screenshot_recorder = None
+
+def start_screenshot_recording(prefix):
+    global _screenshot_recorder
+    stop_screenshot_recording()
+    _screenshot_recorder = PacketRecorder(prefix)
+    return _screenshot_recorder
+
+def stop_screenshot_recording():
+    global _screenshot_recorder
+    recorder, _screenshot_recorder = _screenshot_recorder, None
+    if recorder is not None:
+        recorder.close()
+
+# ✅ 截图接收缓冲区按线程复用：同一线程里反复截图不再重新分配几 MB 的内存
+_recv_local = threading.local()
+
+def _recv_buffer(length):
+    buf = getattr(_recv_local, "buf", None)
+    if buf is None or len(buf) < length:
+        buf = bytearray(max(length, len(buf) * 2 if buf else 4 * 1024 * 1024))
+        _recv_local.buf = buf
+    return buf
+
 class ScreenshotSocket:
     def __init__(self, host="127.0.0.1", port=6101):
         self.host = host
         self.port = port
         self.sock = None
+        self._header_buf = bytearray(4)
 
     def connect(self):
         try:
@@ -99,79 +301,453 @@ class ScreenshotSocket:
             log(f"❌ ScreenshotSocket 连接失败: {e}")
             self.sock = None
 
-    def _recvall(self, length):
-        data = b""
-        while len(data) < length:
+    def _recvall(self, length, buf=None):
+        """读满 length 字节，返回复用缓冲区上的 memoryview（同一线程下次截图前有效）"""
+        view = memoryview(buf if buf is not None else _recv_buffer(length))[:length]
+        got = 0
+        while got < length:
             try:
-                packet = self.sock.recv(length - len(data))
-                if not packet:
+                n = self.sock.recv_into(view[got:], length - got)
+                if not n:
                     return None
-                data += packet
+                got += n
             except Exception as e:
                 log(f"❌ 接收异常: {e}")
+                try:
+                    self.sock.close()
+                except Exception:
+                    pass
                 self.sock = None
-                self.sock.close()
                 return None
+        return view
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)   
+            except Exception:
+                pass
+            try:
+                self.sock.close()
+            except Exception:
+                pass
+            self.sock = None
+
+    def send_request(self, cmd=SCREENSHOT_CMD):
+        self.sock.sendall(cmd)
+
+    def read_image(self):
+        """读取一帧截图应答（4 字节长度 + 图像数据），失败返回 None"""
+        raw_len = self._recvall(4, self._header_buf)
+        if not raw_len:
+            log("❌ 未收到图像长度信息")
+            return None
+
+        total_length = int.from_bytes(raw_len, byteorder="big")
+        log(f"✅ 收到图像长度信息: {total_length} 字节")
+
+        if total_length < 1024 or total_length > 10 * 1024 * 1024:
+            log(f"⚠️ 图像数据长度异常: {total_length}")
+            return None
+
+        data = self._recvall(total_length)
+        if data is None or len(data) != total_length:
+            log(f"❌ 图像接收不完整，期望 {total_length} 字节，实际 {len(data) if data else 0}")
+            return None
+
+        if len(data) > 5 * 1024 * 1024:
+            log(f"❌ 数据长度异常，图像数据过大，长度：{len(data)}")
+            return None
+
+        log(f"✅ 完整图像接收成功: {len(data)} 字节")
+        recorder = _screenshot_recorder
+        if recorder is not None:
+            recorder.write(data, KIND_IMAGE)
+        screenshot_black_box.push(data)
         return data
 
+    def read_regions(self):
+        """读取一次区域截图应答，拼回整屏尺寸的画布（未请求的区域为黑色），失败返回 None"""
+        header = self._recvall(ROI_HEADER.size, bytearray(ROI_HEADER.size))
+        if not header:
+            return None
+        magic, screen_w, screen_h, count = ROI_HEADER.unpack(header)
+        if magic != ROI_MAGIC:
+            log(f"❌ 区域截图应答格式错误: {bytes(magic)}")
+            return None
+        # np.zeros 走 calloc，未写入的内存页不会真正占用
+        canvas = np.zeros((screen_h, screen_w, 3), dtype=np.uint8)
+        item_buf = bytearray(ROI_ITEM.size)
+        for _ in range(count):
+            item = self._recvall(ROI_ITEM.size, item_buf)
+            if not item:
+                return None
+            x1, y1, x2, y2, enc, channels, length = ROI_ITEM.unpack(item)
+            payload = self._recvall(length)
+            if payload is None:
+                return None
+            arr = np.frombuffer(payload, dtype=np.uint8)
+            if enc == ROI_ENCODINGS["raw"]:
+                img = arr.reshape(y2 - y1, x2 - x1, channels) if channels > 1 else arr.reshape(y2 - y1, x2 - x1)
+            else:
+                img = cv2.imdecode(arr, cv2.IMREAD_UNCHANGED)
+                if img is None:
+                    log(f"❌ 区域图像解码失败: {(x1, y1, x2, y2)}")
+                    return None
+            if img.ndim == 2:
+                img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+            canvas[y1:y2, x1:x2] = img
+        log(f"✅ 区域截图接收成功: {count} 个区域")
+        return canvas
+
+    def read_delta(self, canvas, base_id):
+        """读取一次增量截图应答，把变化的瓦片就地写回 canvas；
+        返回 (canvas, TileChanges)，canvas 尺寸不符时新建；校验失败返回 None"""
+        header = self._recvall(DELTA_HEADER.size, bytearray(DELTA_HEADER.size))
+        if not header:
+            return None
+        magic, frame_id, sent_base, screen_w, screen_h, tile, count = DELTA_HEADER.unpack(header)
+        if magic != DELTA_MAGIC or tile == 0:
+            log(f"❌ 增量截图应答格式错误: {bytes(magic)}")
+            return None
+        if sent_base and sent_base != base_id:
+            log(f"❌ 增量截图基准帧不一致: 本地 {base_id}，服务端 {sent_base}")
+            return None
+        if canvas is None or canvas.shape != (screen_h, screen_w, 3):
+            if sent_base:
+                return None
+            canvas = np.zeros((screen_h, screen_w, 3), dtype=np.uint8)
+        changes = TileChanges(frame_id, sent_base, tile, screen_w, screen_h, ())
+        tile_buf = bytearray(DELTA_TILE.size)
+        for _ in range(count):
+            item = self._recvall(DELTA_TILE.size, tile_buf)
+            if not item:
+                return None
+            index, crc = DELTA_TILE.unpack(item)
+            x1, y1, x2, y2 = changes.tile_rect(index)
+            x2, y2 = min(x2, screen_w), min(y2, screen_h)
+            payload = self._recvall((y2 - y1) * (x2 - x1) * 3)
+            if payload is None:
+                return None
+            if zlib.crc32(payload) != crc:
+                log(f"❌ 瓦片 {index} 校验失败")
+                return None
+            canvas[y1:y2, x1:x2] = np.frombuffer(payload, dtype=np.uint8).reshape(y2 - y1, x2 - x1, 3)
+            changes.changed.add(index)
+        log(f"✅ 增量截图接收成功: 帧 {frame_id}，{count}/{changes.cols * changes.rows} 个瓦片变化")
+        return canvas, changes
+
     def request_screenshot(self):
+        """一次性截图：连接 → 请求 → 读取 → 断开"""
         if self.sock is None:
             self.connect()
         if self.sock is None:
             return None
 
         try:
-            self.sock.sendall(b"screenshot\n")
-            raw_len = self._recvall(4)
-            if not raw_len:
-                log("❌ 未收到图像长度信息")
-                return None
+            self.send_request()
+            return self.read_image()
+        except Exception as e:
+            log(f"❌ 截图接收失败: {e}")
+            return None
+        finally:
+            self.close()
+
+class ScreenshotClient:
+    """长连接截图客户端：复用同一条 TCP 连接，断线自动重连；
+    prefetch=True 时拿到本次图像后立即发出下一次请求，服务端截图和本地解码并行"""
+
+    def __init__(self, host="127.0.0.1", port=6101, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.persistent = True  # 服务端每次应答后都断开时自动退化为短连接
+        self._reuse_failures = 0  # 连接复用连续失败次数
+        self._reprobe_at = 0.0  # 退化为短连接后，到这个时间再试长连接
+        self._conn = ScreenshotSocket(host, port)
+        self._inflight = None  # 已发出但未读取的请求：(请求命令, 发出时间)
+        self._served_on_conn = 0  # 当前连接上已成功应答的次数
+        self.caps = None  # 服务端扩展能力，首次使用时探测
+        self._delta_canvas = None  # 增量截图在本地维护的整帧，收到变化瓦片时就地更新
+        self._delta_id = 0  # 服务端基准帧编号随连接失效
+        self._lock = threading.RLock()
+
+    def _reset(self):
+        self._conn.close()
+        self._inflight = None
+        self._served_on_conn = 0
+        self._delta_id = 0
 
-            total_length = int.from_bytes(raw_len, byteorder="big")
-            log(f"✅ 收到图像长度信息: {total_length} 字节")
+    def _ensure_connected(self):
+        if self._conn.sock is None:
+            self._conn.connect()
+            if self._conn.sock is not None:
+                self._conn.sock.settimeout(self.timeout)
+        return self._conn.sock is not None
 
-            if total_length < 1024 or total_length > 10 * 1024 * 1024:
-                log(f"⚠️ 图像数据长度异常: {total_length}")
+    def _reader(self, cmd):
+        return self._conn.read_regions if cmd.startswith(b"screenshot_roi") else self._conn.read_image
+
+    def _roundtrip(self, cmd=SCREENSHOT_CMD):
+        if not self.persistent and time.time() >= self._reprobe_at:
+            # 退化后定期重试长连接：再失败一次就退回短连接
+            self.persistent = True
+            self._reuse_failures = PERSIST_DEGRADE_AFTER - 1
+        for attempt in range(2):
+            if not self._ensure_connected():
                 return None
+            reused = self._served_on_conn > 0
+            try:
+                if self._inflight is None:
+                    self._conn.send_request(cmd)
+                self._inflight = None
+                data = self._reader(cmd)()
+            except Exception as e:
+                log(f"❌ 截图长连接异常: {e}")
+                data = None
+            if data is not None:
+                self._served_on_conn += 1
+                if reused:
+                    self._reuse_failures = 0
+                return data
+            if attempt == 0 and reused and self.persistent:
+                self._reuse_failures += 1
+                if self._reuse_failures >= PERSIST_DEGRADE_AFTER:
+                    # 同一连接上的复用请求接连失败：服务端多半不支持长连接，先改用短连接，过一阵再试
+                    log(f"⚠️ 截图服务端不保持连接，退化为短连接模式（{PERSIST_REPROBE_INTERVAL:.0f} 秒后重试长连接）")
+                    self.persistent = False
+                    self._reprobe_at = time.time() + PERSIST_REPROBE_INTERVAL
+            self._reset()
+        return None
+
+    def _drain_inflight(self, max_age=0.0, cmd=None):
+        # 预取的应答已过时（期间可能点击过）或要发别的请求：读掉丢弃
+        if self._inflight is None:
+            return
+        inflight_cmd, sent_at = self._inflight
+        if inflight_cmd == cmd and time.time() - sent_at < max_age:
+            return
+        self._inflight = None
+        if self._reader(inflight_cmd)() is None:
+            self._reset()
+
+    def _prefetch(self, cmd):
+        # 拿到本次结果后立即发出下一次相同请求，服务端截图与本地解码 / 识别并行
+        try:
+            self._conn.send_request(cmd)
+            self._inflight = (cmd, time.time())
+        except Exception:
+            self._reset()
 
-            data = self._recvall(total_length)
-            if data is None or len(data) != total_length:
-                log(f"❌ 图像接收不完整，期望 {total_length} 字节，实际 {len(data) if data else 0}")
+    def probe_caps(self):
+        """用一条临时连接探测服务端扩展能力，结果缓存在 self.caps"""
+        if self.caps is not None:
+            return self.caps
+        caps = set()
+        probe = ScreenshotSocket(self.host, self.port)
+        probe.connect()
+        if probe.sock is not None:
+            try:
+                probe.sock.settimeout(CAPS_PROBE_TIMEOUT)
+                probe.send_request(b"caps\n")
+                line = probe.sock.recv(256).decode(errors="ignore").strip()
+                if line.startswith("CAPS:"):
+                    caps = {c.strip() for c in line[5:].split(",") if c.strip()}
+            except Exception as e:
+                log(f"⚠️ 截图服务端能力探测无应答，按老协议处理: {e}")
+            finally:
+                probe.close()
+        self.caps = caps
+        log(f"📡 截图服务端能力: {sorted(caps) or '无扩展'}")
+        return caps
+
+    def supports(self, *features):
+        return all(f in self.probe_caps() for f in features)
+
+    def capture_regions(self, regions, fmt="raw", quality=80, prefetch=False, max_age=0.3):
+        """只请求若干矩形区域，返回整屏尺寸画布（区域外为黑色，坐标与整屏截图一致）；
+        服务端不支持 ROI 或该编码时退回整屏截图。prefetch 同 capture，只有下次请求相同区域时才用上"""
+        with self._lock:
+            if not self.supports("roi", fmt):
+                return self.capture(prefetch, max_age)
+            rects = ";".join(f"{x1},{y1},{x2},{y2}" for x1, y1, x2, y2 in regions)
+            cmd = f"screenshot_roi fmt={fmt} q={int(quality)} rects={rects}\n".encode()
+            self._drain_inflight(max_age, cmd)
+            canvas = self._roundtrip(cmd)
+            if canvas is None:
                 return None
+            if not self.persistent:
+                self._reset()
+            elif prefetch:
+                self._prefetch(cmd)
+            return canvas
 
-            if len(data) > 5 * 1024 * 1024:
-                log(f"❌ 数据长度异常，图像数据过大，长度：{len(data)}")
+    def capture_delta(self, tile=DELTA_TILE_SIZE):
+        """增量截图，返回带 tiles 信息的 Frame；Frame.image 是本客户端持续更新的整帧，
+        下一次 capture_delta 时会被就地改写。服务端不支持时退回整屏截图（tiles 为 None）"""
+        with self._lock:
+            if not self.supports("delta"):
+                image = self.capture()
+                return Frame(image) if image is not None else None
+            self._drain_inflight()
+            if not self._ensure_connected():
+                return None
+            cmd = f"screenshot_delta tile={int(tile)} base={self._delta_id}\n".encode()
+            try:
+                self._conn.send_request(cmd)
+                result = self._conn.read_delta(self._delta_canvas, self._delta_id)
+            except Exception as e:
+                log(f"❌ 增量截图异常: {e}")
+                result = None
+            if result is None:
+                # 本地整帧和服务端基准可能已不一致，下次从整帧重新开始
+                self._reset()
                 return None
+            self._delta_canvas, changes = result
+            self._delta_id = changes.frame_id
+            self._served_on_conn += 1
+            return Frame(self._delta_canvas, tiles=changes)
 
-            log(f"✅ 完整图像接收成功: {len(data)} 字节")
+    def request_raw(self, prefetch=False, max_age=0.3):
+        """取一帧原始编码数据（memoryview，同一线程下次截图前有效）"""
+        with self._lock:
+            self._drain_inflight(max_age, SCREENSHOT_CMD)
+            data = self._roundtrip()
+            if data is None:
+                return None
+            if not self.persistent:
+                self._reset()
+            elif prefetch:
+                self._prefetch(SCREENSHOT_CMD)
             return data
 
-        except Exception as e:
-            log(f"❌ 截图接收失败: {e}")
-            return None
+    def capture(self, prefetch=False, max_age=0.3):
+        """取一帧并解码为 BGR ndarray"""
+        with self._lock:
+            data = self.request_raw(prefetch, max_age)
+            if data is None:
+                return None
+            return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def close(self):
+        with self._lock:
+            self._reset()
+            self._delta_canvas = None
+
+class ScreenshotPool:
+    """各模块共享的截图长连接池；同一线程优先拿回自己上次用过的连接（预取结果不会被别的线程拿走）"""
+
+    def __init__(self, host="127.0.0.1", port=6101, max_idle=3):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self._idle = []  # [(owner_thread_id, client)]
+        self._caps = None  # 服务端能力探测结果在池内共享，新连接不用重复探测
+        self._delta_clients = {}  # 线程 id → 增量截图专用客户端（整帧缓冲不能被别的线程改写）
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        me = threading.get_ident()
+        with self._lock:
+            for i, (owner, client) in enumerate(self._idle):
+                if owner == me:
+                    return self._idle.pop(i)[1]
+            if self._idle:
+                return self._idle.pop(0)[1]
+            caps = self._caps
+        client = ScreenshotClient(self.host, self.port)
+        client.caps = caps
+        return client
+
+    def release(self, client):
+        with self._lock:
+            if client.caps is not None:
+                self._caps = client.caps
+            if len(self._idle) < self.max_idle:
+                self._idle.append((threading.get_ident(), client))
+                return
+        client.close()
+
+    def capture(self, prefetch=False, max_age=0.3):
+        client = self.acquire()
+        try:
+            return client.capture(prefetch, max_age)
         finally:
-            if self.sock:
-                try:
-                    self.sock.shutdown(socket.SHUT_RDWR)   
-                except Exception:
-                    pass
-                try:
-                    self.sock.close()
-                except Exception:
-                    pass
-                self.sock = None
+            self.release(client)
+
+    def capture_regions(self, regions, fmt="raw", quality=80, prefetch=False, max_age=0.3):
+        client = self.acquire()
+        try:
+            return client.capture_regions(regions, fmt, quality, prefetch, max_age)
+        finally:
+            self.release(client)
+
+    def supports(self, *features):
+        client = self.acquire()
+        try:
+            return client.supports(*features)
+        finally:
+            self.release(client)
+
+    def capture_delta(self, tile=DELTA_TILE_SIZE):
+        """增量截图：每个线程独占一个客户端，返回的 Frame 在本线程下次 capture_delta 前有效"""
+        me = threading.get_ident()
+        with self._lock:
+            client = self._delta_clients.get(me)
+            if client is None:
+                alive = {t.ident for t in threading.enumerate()}
+                for ident in [i for i in self._delta_clients if i not in alive]:
+                    self._delta_clients.pop(ident).close()
+                client = self._delta_clients[me] = ScreenshotClient(self.host, self.port)
+                client.caps = self._caps
+        return client.capture_delta(tile)
+
+    def request_raw(self, prefetch=False, max_age=0.3):
+        """取原始编码数据；返回前拷贝成 bytes，避免连接归还后缓冲区被覆盖"""
+        client = self.acquire()
+        try:
+            data = client.request_raw(prefetch, max_age)
+            return bytes(data) if data is not None else None
+        finally:
+            self.release(client)
+
+    def close_all(self):
+        """切换到视频流等场景：断开全部空闲长连接，下次截图重新建立"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            delta, self._delta_clients = list(self._delta_clients.values()), {}
+            self._caps = None
+        for _, client in idle:
+            client.close()
+        for client in delta:
+            client.close()
+
+_screenshot_pool = None
+_screenshot_pool_lock = threading.Lock()
+
+def get_screenshot_pool():
+    global _screenshot_pool
+    with _screenshot_pool_lock:
+        if _screenshot_pool is None:
+            _screenshot_pool = ScreenshotPool(host="127.0.0.1", port=6101)
+        return _screenshot_pool
+
+CONTROL_TIMEOUT = 2.0
 
 class ControlSocket:
-    def __init__(self, host="127.0.0.1", port=6102):
+    """6102 常驻指令连接：一问一答，多线程共用一把锁；服务端断开时重连重试一次"""
+
+    def __init__(self, host="127.0.0.1", port=6102, timeout=CONTROL_TIMEOUT):
         self.host = host
         self.port = port
+        self.timeout = timeout
         self.sock = None
+        self._lock = threading.Lock()
 
     def connect(self):
         try:
             if self.sock is None:
-                self.sock = socket.socket()
-                self.sock.connect((self.host, self.port))
+                self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
                 log("✅ 成功连接到 ControlSocket")
         except Exception as e:
             log(f"❌ ControlSocket 连接失败: {e}")
@@ -188,18 +764,24 @@ class ControlSocket:
             self.sock = None
 
     def send_command(self, cmd):
-        if self.sock is None:
-            self.connect()
-        if self.sock is None:
-            return None
-        self.sock.sendall(cmd.encode())
-        log(f"📡 ControlSocket 已发送: {cmd.strip()}")
-        try:
-            response = self.sock.recv(128).decode(errors="ignore").strip()
-            log(f"📡 ControlSocket 收到响应: {response}")
-            return response
-        except Exception as e:
-            log(f"[ControlSocket] ❌ 等待响应失败: {e}")
+        with self._lock:
+            for attempt in range(2):
+                if self.sock is None:
+                    self.connect()
+                if self.sock is None:
+                    return None
+                try:
+                    self.sock.sendall(cmd.encode())
+                    log(f"📡 ControlSocket 已发送: {cmd.strip()}")
+                    data = self.sock.recv(128)
+                    if data:
+                        response = data.decode(errors="ignore").strip()
+                        log(f"📡 ControlSocket 收到响应: {response}")
+                        return response
+                    log("⚠️ ControlSocket 连接已被服务端关闭，重连")
+                except OSError as e:
+                    log(f"[ControlSocket] ❌ 等待响应失败: {e}")
+                self.close()
             return None
 
     def switch_to_video(self):
@@ -213,6 +795,144 @@ class ControlSocket:
     def query_status(self):
         return self.send_command("query_status\n")
 
+_control_socket = None
+_control_socket_lock = threading.Lock()
+
+def get_control_socket():
+    global _control_socket
+    with _control_socket_lock:
+        if _control_socket is None:
+            _control_socket = ControlSocket(host="127.0.0.1", port=6102)
+        return _control_socket
+
+# === 6102 模式推送 ===
+# 订阅："subscribe_mode\n"，支持的服务端回 "ACK_SUBSCRIBE_MODE"（可紧跟一行当前 "STATUS:<模式>"），
+# 之后每次切换推送一行 "STATUS:<模式>" 或 "EVENT:MODE:<模式>"；老服务端不回或回别的即视为不支持
+CONTROL_MODES = {"screenshot": "SCREENSHOT_MODE", "video": "VIDEO_STREAM_MODE"}
+MODE_POLL_INTERVAL = 0.1
+RESUBSCRIBE_INTERVAL = 3.0
+
+class ControlSession:
+    """6102 常驻会话：订阅模式切换推送，wait_for_mode 在切换确认的瞬间返回；
+    服务端不支持推送时退回 query_status 快速轮询"""
+
+    def __init__(self, host="127.0.0.1", port=6102, query=None):
+        self.host = host
+        self.port = port
+        self.mode = None          # 最近一次确认的模式，如 "SCREENSHOT_MODE"
+        self.subscribed = False
+        self.supported = None     # None 未探测；False 为老服务端，不再尝试订阅
+        self._query = query       # 轮询用的 query(cmd) -> 应答；默认用一条 ControlSocket
+        self._poller = None
+        self._listeners = []
+        self._cond = threading.Condition()
+        self._running = False
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+
+    def add_listener(self, callback):
+        """callback(mode) 在模式变化时调用（在会话线程里执行）"""
+        self._listeners.append(callback)
+
+    def _set_mode(self, mode):
+        with self._cond:
+            changed = mode != self.mode
+            self.mode = mode
+            self._cond.notify_all()
+        if changed:
+            log(f"📡 模式切换: {mode}")
+            for callback in list(self._listeners):
+                try:
+                    callback(mode)
+                except Exception as e:
+                    print(f"⚠️ 模式回调异常: {e}")
+
+    def _handle_line(self, line):
+        if line.startswith("STATUS:") or line.startswith("EVENT:MODE:"):
+            self._set_mode(line.rsplit(":", 1)[1])
+            return True
+        return False
+
+    def _run(self):
+        while self._running and self.supported is not False:
+            sock = None
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=CAPS_PROBE_TIMEOUT)
+                sock.sendall(b"subscribe_mode\n")
+                lines = sock.makefile("r", encoding="utf-8", errors="ignore")
+                first = lines.readline().strip()
+                if first != "ACK_SUBSCRIBE_MODE" and not self._handle_line(first):
+                    log(f"⚠️ 控制端口不支持模式推送（{first or '无应答'}），改用轮询")
+                    self.supported = False
+                    break
+                self.supported = True
+                self.subscribed = True
+                sock.settimeout(None)
+                for line in lines:
+                    if not self._running:
+                        break
+                    self._handle_line(line.strip())
+            except socket.timeout:
+                if self.supported is None:
+                    log("⚠️ 控制端口订阅无应答，改用轮询")
+                    self.supported = False
+            except Exception as e:
+                log(f"⚠️ 模式订阅连接异常: {e}")
+            finally:
+                self.subscribed = False
+                if sock is not None:
+                    try:
+                        sock.close()
+                    except Exception:
+                        pass
+            if self._running and self.supported is not False:
+                time.sleep(RESUBSCRIBE_INTERVAL)
+        self._running = False
+
+    def refresh(self):
+        """主动 query_status 一次，返回当前模式（失败返回 None）"""
+        if self._query is not None:
+            resp = self._query("query_status\n")
+        else:
+            if self._poller is None:
+                self._poller = ControlSocket(self.host, self.port)
+            try:
+                resp = self._poller.query_status()
+            except Exception:
+                self._poller.close()
+                resp = None
+        if resp and self._handle_line(resp):
+            return self.mode
+        return None
+
+    def wait_for_mode(self, mode, timeout=5.0):
+        """等待模式切换确认；mode 可写 "screenshot" / "video" 或完整模式名。确认即返回 True，超时返回 False"""
+        target = CONTROL_MODES.get(mode, mode)
+        deadline = time.time() + timeout
+        if not self.subscribed and self.refresh() == target:
+            return True
+        with self._cond:
+            while self.subscribed and self.mode != target:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, RESUBSCRIBE_INTERVAL))
+            if self.mode == target and self.subscribed:
+                return True
+        # 没有推送：快速轮询
+        while time.time() < deadline:
+            if self.refresh() == target:
+                return True
+            time.sleep(MODE_POLL_INTERVAL)
+        return False
+
 _rift_listener = None
 _rift_listener_enabled = True  # 初始默认关闭
 
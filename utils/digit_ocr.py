@@ -0,0 +1,153 @@
+# utils/digit_ocr.py
+# ✅ 固定字体数字识别：二值化 → 按列投影切字 → 归一化成固定尺寸 → 与字形图集做一次矩阵乘（NCC）
+# 倒计时 HH:MM:SS、侦察体力 n/m 这类短串亚毫秒级识别；置信度不够或格式对不上时回退 tesseract
+# 图集由 tools/build_glyph_atlas.py 从真机截图裁出的样例生成，仓库不附带；没有图集时直接走 tesseract
+import os
+import re
+import threading
+
+import cv2
+import numpy as np
+
+from utils.tesseract_engine import image_to_string
+
+ATLAS_PATH = "icons/glyphs/digits.npz"
+GLYPH_H = 20
+GLYPH_W = 16
+MIN_SCORE = 0.85     # 单字 NCC 低于此值视为不认识
+MIN_BLOB_PIXELS = 4  # 比这还少的前景列视为噪点
+
+
+def binarize(image):
+    """灰度 + Otsu；前景（文字）统一为 255。文字按像素占少数来判断极性"""
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    if np.count_nonzero(binary) > binary.size // 2:
+        binary = cv2.bitwise_not(binary)
+    return binary
+
+
+def segment(binary):
+    """按列投影切出字符，返回 [(x1, x2)]；上下边界统一取整行文字的范围，冒号等小符号保留相对位置"""
+    cols = np.count_nonzero(binary, axis=0)
+    on = np.concatenate(([False], cols > 0, [False]))
+    edges = np.flatnonzero(on[1:] != on[:-1]).reshape(-1, 2)
+    return [(int(x1), int(x2)) for x1, x2 in edges if cols[x1:x2].sum() >= MIN_BLOB_PIXELS]
+
+
+def text_rows(binary):
+    rows = np.flatnonzero(np.count_nonzero(binary, axis=1))
+    if rows.size == 0:
+        return None
+    return int(rows[0]), int(rows[-1]) + 1
+
+
+def normalize_glyph(binary, rows, cols):
+    """按行高等比缩放到 GLYPH_H，居中放进 GLYPH_W 宽的画布；"1" 与 "7" 的宽度差异不会被拉伸抹掉"""
+    y1, y2 = rows
+    x1, x2 = cols
+    crop = binary[y1:y2, x1:x2]
+    scale = GLYPH_H / crop.shape[0]
+    w = max(1, min(GLYPH_W, int(round(crop.shape[1] * scale))))
+    resized = cv2.resize(crop, (w, GLYPH_H), interpolation=cv2.INTER_AREA)
+    canvas = np.zeros((GLYPH_H, GLYPH_W), dtype=np.uint8)
+    left = (GLYPH_W - w) // 2
+    canvas[:, left:left + w] = resized
+    return canvas
+
+
+def _vectors(glyphs):
+    """(N, H, W) uint8 → (N, H*W) 零均值单位长度 float32，点积即 NCC"""
+    v = glyphs.reshape(len(glyphs), GLYPH_H * GLYPH_W).astype(np.float32)
+    v -= v.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(v, axis=1, keepdims=True)
+    return v / np.maximum(norm, 1e-6)
+
+
+def extract_glyphs(image):
+    """图片 → (N, GLYPH_H, GLYPH_W) 归一化字形；识别和建图集共用同一套预处理"""
+    binary = binarize(image)
+    rows = text_rows(binary)
+    spans = segment(binary) if rows is not None else []
+    if not spans:
+        return np.zeros((0, GLYPH_H, GLYPH_W), dtype=np.uint8)
+    return np.stack([normalize_glyph(binary, rows, cols) for cols in spans])
+
+
+class GlyphAtlas:
+    def __init__(self, labels=(), glyphs=None):
+        self.labels = np.asarray(list(labels))
+        self.glyphs = glyphs if glyphs is not None else np.zeros((0, GLYPH_H, GLYPH_W), dtype=np.uint8)
+        self.vectors = _vectors(self.glyphs)
+
+    def __len__(self):
+        return len(self.labels)
+
+    @classmethod
+    def load(cls, path=ATLAS_PATH):
+        with np.load(path) as data:
+            return cls(data["labels"].tolist(), data["glyphs"])
+
+    def save(self, path=ATLAS_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez_compressed(path, labels=self.labels, glyphs=self.glyphs)
+
+    def add(self, label, glyph):
+        self.labels = np.append(self.labels, label)
+        self.glyphs = np.concatenate([self.glyphs, glyph[None]])
+        self.vectors = _vectors(self.glyphs)
+
+    def match(self, glyphs):
+        """一次矩阵乘算出所有字符对所有样本的 NCC，返回 (labels, scores)"""
+        if len(glyphs) == 0 or len(self) == 0:
+            return [], np.zeros(0, dtype=np.float32)
+        scores = _vectors(glyphs) @ self.vectors.T
+        best = scores.argmax(axis=1)
+        return self.labels[best].tolist(), scores[np.arange(len(best)), best]
+
+
+class DigitOcr:
+    def __init__(self, atlas_path=ATLAS_PATH, min_score=MIN_SCORE):
+        self.atlas_path = atlas_path
+        self.min_score = min_score
+        self._atlas = None
+        self._lock = threading.Lock()
+        self.stats = {"atlas": 0, "fallback": 0}
+
+    @property
+    def atlas(self):
+        if self._atlas is None:
+            with self._lock:
+                if self._atlas is None:
+                    try:
+                        self._atlas = GlyphAtlas.load(self.atlas_path)
+                        print(f"[DigitOcr] ✅ 字形图集已加载: {len(self._atlas)} 个样本")
+                    except (OSError, KeyError, ValueError):
+                        print(f"[DigitOcr] ⚠️ 未找到字形图集 {self.atlas_path}，数字识别全部走 tesseract")
+                        self._atlas = GlyphAtlas()
+        return self._atlas
+
+    def recognize(self, image):
+        """只用图集识别，返回 (文本, 每字分数)；不认识的字记为 "?" """
+        labels, scores = self.atlas.match(extract_glyphs(image))
+        text = "".join(label if score >= self.min_score else "?" for label, score in zip(labels, scores))
+        return text, scores
+
+    def read(self, image, pattern, lang="eng", config="", fallback_image=None):
+        """识别并返回文本：图集结果中能找到 pattern，且匹配段及其左右相邻字符都可信时直接返回，
+        否则用 tesseract 识别 fallback_image（默认 image）"""
+        if len(self.atlas):
+            text, _ = self.recognize(image)
+            match = re.search(pattern, text)
+            if match and "?" not in text[max(match.start() - 1, 0):match.end() + 1]:
+                self.stats["atlas"] += 1
+                return text
+        self.stats["fallback"] += 1
+        target = image if fallback_image is None else fallback_image
+        return image_to_string(target, lang=lang, config=config)
+
+    def reload(self):
+        self._atlas = None
+
+
+digit_ocr = DigitOcr()
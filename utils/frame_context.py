@@ -0,0 +1,190 @@
+# utils/frame_context.py
+# ✅ 单帧预处理上下文：同一帧的灰度图、ROI、金字塔、区域统计只算一次，所有识别共享
+import threading
+import cv2
+import numpy as np
+
+
+class BufferPool:
+    """按 (shape, dtype) 复用的预分配缓冲区，避免热循环里反复申请 1080x1920 的数组"""
+
+    def __init__(self, max_per_key=2):
+        self.max_per_key = max_per_key
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            bucket = self._free.get(key)
+            if bucket:
+                return bucket.pop()
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, arr):
+        key = (arr.shape, arr.dtype.str)
+        with self._lock:
+            bucket = self._free.setdefault(key, [])
+            if len(bucket) < self.max_per_key:
+                bucket.append(arr)
+
+
+_shared_pool = BufferPool()
+
+
+class TileChanges:
+    """增量截图的瓦片变化信息：frame_id 本帧编号，base_id 本帧基于的上一帧（0 表示整帧刷新）"""
+
+    def __init__(self, frame_id, base_id, tile, width, height, changed):
+        self.frame_id = frame_id
+        self.base_id = base_id
+        self.tile = tile
+        self.cols = (width + tile - 1) // tile
+        self.rows = (height + tile - 1) // tile
+        self.changed = set(changed)
+
+    def tile_rect(self, index):
+        r, c = divmod(index, self.cols)
+        return c * self.tile, r * self.tile, (c + 1) * self.tile, (r + 1) * self.tile
+
+    def region_changed(self, region):
+        """区域覆盖的瓦片相对 base 帧是否有变化"""
+        if not self.base_id:
+            return True
+        x1, y1, x2, y2 = region
+        c1, c2 = x1 // self.tile, (max(x2, x1 + 1) - 1) // self.tile
+        r1, r2 = y1 // self.tile, (max(y2, y1 + 1) - 1) // self.tile
+        return any(r * self.cols + c in self.changed
+                   for r in range(r1, min(r2, self.rows - 1) + 1)
+                   for c in range(c1, min(c2, self.cols - 1) + 1))
+
+
+class Frame:
+    """包装一帧 ndarray（BGR 或灰度），各种转换结果按需计算并缓存"""
+
+    def __init__(self, image, pool=None, tiles=None):
+        self.image = image
+        self.pool = pool
+        self.tiles = tiles  # TileChanges；来自增量截图时才有
+        self._gray = None
+        self._pyramid = {}
+        self._stats = {}
+        self._roi_gray = {}
+        self._owned = []
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    @property
+    def is_gray(self):
+        return self.image.ndim == 2
+
+    def _buffer(self, shape):
+        if self.pool is None:
+            return np.empty(shape, dtype=np.uint8)
+        buf = self.pool.acquire(shape)
+        self._owned.append(buf)
+        return buf
+
+    @property
+    def bgr(self):
+        if self.is_gray:
+            raise ValueError("灰度帧没有彩色数据，请向数据源申请 BGR 输出")
+        return self.image
+
+    @property
+    def gray(self):
+        """整帧灰度图，首次访问时转换一次并写入池化缓冲区"""
+        if self._gray is None:
+            if self.is_gray:
+                self._gray = self.image
+            else:
+                h, w = self.image.shape[:2]
+                self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY, dst=self._buffer((h, w)))
+        return self._gray
+
+    def region_changed(self, region):
+        """区域相对上一帧是否变化；没有瓦片信息时一律视为变化"""
+        return self.tiles is None or self.tiles.region_changed(region)
+
+    def roi(self, region):
+        """原图 ROI 视图（不拷贝）"""
+        x1, y1, x2, y2 = region
+        return self.image[y1:y2, x1:x2]
+
+    def gray_roi(self, region):
+        """灰度 ROI；整帧灰度已算过则直接切视图"""
+        x1, y1, x2, y2 = region
+        if self._gray is None and self.pool is None and not self.is_gray:
+            # 临时包装的单次识别：只转换这一小块，没必要整帧转灰度
+            key = (x1, y1, x2, y2)
+            if key not in self._roi_gray:
+                self._roi_gray[key] = cv2.cvtColor(self.image[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+            return self._roi_gray[key]
+        return self.gray[y1:y2, x1:x2]
+
+    def pyramid(self, level):
+        """灰度金字塔：level=1 为 1/2，level=2 为 1/4"""
+        if level <= 0:
+            return self.gray
+        if level not in self._pyramid:
+            src = self.pyramid(level - 1)
+            h, w = (src.shape[0] + 1) // 2, (src.shape[1] + 1) // 2
+            self._pyramid[level] = cv2.pyrDown(src, dst=self._buffer((h, w)), dstsize=(w, h))
+        return self._pyramid[level]
+
+    @property
+    def half(self):
+        return self.pyramid(1)
+
+    @property
+    def quarter(self):
+        return self.pyramid(2)
+
+    def roi_stats(self, region):
+        """灰度 ROI 的 (均值, 标准差)，同一区域只算一次"""
+        key = tuple(region)
+        if key not in self._stats:
+            mean, std = cv2.meanStdDev(self.gray_roi(region))
+            self._stats[key] = (float(mean[0][0]), float(std[0][0]))
+        return self._stats[key]
+
+    def release(self):
+        """把本帧占用的缓冲区还给池子；之后不能再使用本帧的灰度 / 金字塔视图"""
+        if self.pool is not None:
+            for buf in self._owned:
+                self.pool.release(buf)
+        self._owned = []
+        self._gray = None
+        self._pyramid = {}
+        self._stats = {}
+        self._roi_gray = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class FrameContext:
+    """识别循环专用：每次 next() 自动回收上一帧的缓冲区，循环内不再为每次检查分配新数组"""
+
+    def __init__(self, pool=None):
+        self.pool = pool or _shared_pool
+        self._current = None
+
+    def next(self, image):
+        if self._current is not None:
+            self._current.release()
+        self._current = None if image is None else Frame(image, self.pool)
+        return self._current
+
+    def close(self):
+        self.next(None)
+
+
+def as_frame(screen):
+    """识别函数入口统一：传 ndarray 或 Frame 都可以"""
+    return screen if isinstance(screen, Frame) else Frame(screen)
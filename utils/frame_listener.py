@@ -1,60 +1,114 @@
 # utils/frame_listener.py
 import socket
 import struct
+import sys
 import threading
 import av
 import numpy as np
 import time
 from datetime import datetime
+from fractions import Fraction
+from utils.recorder import PacketRecorder, video_black_box
+
+FRAME_BUFFER_COUNT = 3  # ✅ 三缓冲：发布中 / 读者持有 / 解码写入各占一块
+
+# 解码输出像素格式 → 通道数（gray 即 Y 平面亮度）
+OUTPUT_CHANNELS = {"bgr24": 3, "gray": 1}
+
 
 class FrameListener:
-    def __init__(self, host="127.0.0.1", port=6101):  # ✅ 注意这里是 6101
+    def __init__(self, host="127.0.0.1", port=6101, output_format="bgr24", scale=1.0, crop=None, source=None):  # ✅ 注意这里是 6101
         self.host = host
         self.port = port
+        self.source = source  # 给了 read_packet() 数据源（如录制回放）时不连 6101
+        self.recorder = None  # PacketRecorder：收到的原始包原样落盘
+        self.black_box = video_black_box  # 最近若干秒的原始包，流程失败时导出
+        self.output_format = "bgr24"
+        self.scale = 1.0
+        self.crop = None
+        self._graph = None
+        self._graph_key = None
+        self.set_output(output_format, scale, crop)
         self.sock = None
         self.decoder = av.codec.CodecContext.create("h264", "r")
-        self.latest_frame = None
+        self.decoder.thread_type = "SLICE"  # ✅ 不开帧级多线程：包数据只在 decode() 调用期间被使用（见 _loop）
+        self._latest_raw = None  # ✅ 最新解码帧（av.VideoFrame），有人读取时才转成 ndarray
+        self.frame_seq = 0  # ✅ 每解码出一帧 +1，单调递增
         self.running = False
         self._lock = threading.Lock()
+        self._frame_cond = threading.Condition(self._lock)
+        self._convert_lock = threading.Lock()
+        self._converted = None
+        self._converted_key = None  # (seq, 输出设置)，同一帧同一设置只转换一次
+        self._buffers = []
+        self._header_buf = bytearray(4)
+        self._recv_buf = bytearray(256 * 1024)  # ✅ 复用的接收缓冲区，收到更大的包时才扩容
         self.ready_event = threading.Event()  # ✅ 首帧 ready 标志
 
-    def _recv_exact(self, length):
-        data = b""
-        while len(data) < length and self.running:
+    def _recv_exact(self, length, buf=None):
+        """读满 length 字节到复用缓冲区，返回 memoryview（下次接收前有效，不产生额外拷贝）"""
+        if buf is None:
+            if len(self._recv_buf) < length:
+                self._recv_buf = bytearray(max(length, len(self._recv_buf) * 2))
+            buf = self._recv_buf
+        view = memoryview(buf)[:length]
+        got = 0
+        while got < length and self.running:
             try:
-                packet = self.sock.recv(length - len(data))
-                if not packet:
+                n = self.sock.recv_into(view[got:], length - got)
+                if not n:
                     return None
-                data += packet
+                got += n
             except Exception as e:
                 print(f"[FrameListener] ❌ _recv_exact 异常: {e}")
                 return None
-        return data if len(data) == length else None
+        return view if got == length else None
+
+    def _read_packet(self):
+        """下一个 H.264 包（4 字节长度 + 数据），连接断开 / 回放结束返回 None"""
+        if self.source is not None:
+            payload = self.source.read_packet()
+            if payload is None and self.running:
+                print(f"[FrameListener] ⏹️ 回放数据已读完，退出循环")
+            return payload
+
+        len_bytes = self._recv_exact(4, self._header_buf)
+        if not len_bytes:
+            if self.running:
+                print(f"[FrameListener] ❌ 未收到帧长度，退出循环")
+            return None
+
+        frame_len = struct.unpack_from(">I", len_bytes)[0]
+        payload = self._recv_exact(frame_len)
+        if not payload:
+            if self.running:
+                print(f"[FrameListener] ❌ 未收到完整帧，退出循环")
+            return None
+        return payload
 
     def _loop(self):
         print(f"[FrameListener] 🚀 开始接收帧循环")
         while self.running:
             try:
-                len_bytes = self._recv_exact(4)
-                if not len_bytes:
-                    if self.running:
-                        print(f"[FrameListener] ❌ 未收到帧长度，退出循环")
+                payload = self._read_packet()
+                if payload is None:
                     break
+                if self.recorder is not None:
+                    self.recorder.write(payload)
+                if self.black_box is not None:
+                    self.black_box.push(payload)
 
-                frame_len = struct.unpack(">I", len_bytes)[0]
-                payload = self._recv_exact(frame_len)
-                if not payload:
-                    if self.running:
-                        print(f"[FrameListener] ❌ 未收到完整帧，退出循环")
-                    break
-
-                packet = av.packet.Packet(payload)
+                # Packet 直接引用 _recv_buf 上的 memoryview，PyAV 不拷贝，下一次 recv_into 就会改写它。
+                # 复用缓冲区安全的前提：decode() 同步用完包数据（slice 线程），返回后不再持有 packet。
+                # 若改成帧级多线程解码，这里要传 bytes(payload)
                 try:
-                    frames = self.decoder.decode(packet)
+                    frames = self.decoder.decode(av.packet.Packet(payload))
+                    # 每个包都要解码，保证 H.264 参考帧链完整；转换推迟到消费者读取时
                     for frame in frames:
-                        img = frame.to_ndarray(format="bgr24")
-                        with self._lock:
-                            self.latest_frame = img
+                        with self._frame_cond:
+                            self._latest_raw = frame
+                            self.frame_seq += 1
+                            self._frame_cond.notify_all()
                         if not self.ready_event.is_set():
                             print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] 🎬 首帧已解码，标记 ready")
                             self.ready_event.set()
@@ -66,14 +120,105 @@ class FrameListener:
                 print(f"[FrameListener] ⚠️ _loop 外层异常，退出: {e}")
                 break
         self.running = False
+        with self._frame_cond:
+            self._frame_cond.notify_all()  # 唤醒还在等新帧的消费者
         print(f"[FrameListener] ⛔️ 帧循环已退出")
 
+    def _free_buffer(self, shape):
+        """找一块没人引用的缓冲区：只被 _buffers 列表持有时才能安全复用"""
+        self._buffers = [b for b in self._buffers if b.shape == shape]
+        for buf in self._buffers:
+            # 列表、循环变量、getrefcount 参数各占 1；已发布或被读者（含其视图）持有时计数更大
+            if sys.getrefcount(buf) <= 3:
+                buf.setflags(write=True)
+                return buf
+        buf = np.empty(shape, dtype=np.uint8)
+        if len(self._buffers) < FRAME_BUFFER_COUNT:
+            self._buffers.append(buf)
+        return buf
+
+    def set_output(self, output_format=None, scale=None, crop=None):
+        """设置解码输出：像素格式（bgr24 / gray）、缩放比例、裁剪区域 (x1, y1, x2, y2)
+        颜色转换、缩放、裁剪都在 PyAV（libswscale / libavfilter）里完成，Python 只拿到最终数组
+        注意：缩放 / 裁剪后坐标系随之改变，调用方需自行换算"""
+        if output_format is not None:
+            if output_format not in OUTPUT_CHANNELS:
+                raise ValueError(f"不支持的输出格式: {output_format}")
+            self.output_format = output_format
+        if scale is not None:
+            self.scale = scale
+        if crop is not None:
+            self.crop = tuple(crop) if crop else None  # 传空元组表示取消裁剪
+        print(f"[FrameListener] 🎛️ 输出设置: {self.output_format} 缩放={self.scale} 裁剪={self.crop}")
+
+    def _output_size(self, width, height):
+        if self.crop:
+            x1, y1, x2, y2 = self.crop
+            width, height = x2 - x1, y2 - y1
+        if self.scale == 1.0:
+            return width, height
+        # swscale 要求偶数尺寸更稳妥
+        return max(2, int(width * self.scale) // 2 * 2), max(2, int(height * self.scale) // 2 * 2)
+
+    def _filter_through_graph(self, frame, out_w, out_h):
+        """带裁剪时走 crop → scale → format 滤镜链，输入尺寸或设置变化才重建"""
+        x1, y1, x2, y2 = self.crop
+        key = (frame.width, frame.height, frame.format.name, self.crop, out_w, out_h, self.output_format)
+        if self._graph_key != key:
+            graph = av.filter.Graph()
+            src = graph.add_buffer(width=frame.width, height=frame.height,
+                                   format=frame.format.name, time_base=Fraction(1, 1000))
+            chain = [
+                src,
+                graph.add("crop", f"{x2 - x1}:{y2 - y1}:{x1}:{y1}"),
+                graph.add("scale", f"{out_w}:{out_h}"),
+                graph.add("format", self.output_format),
+                graph.add("buffersink"),
+            ]
+            for a, b in zip(chain, chain[1:]):
+                a.link_to(b)
+            graph.configure()
+            self._graph, self._graph_key = graph, key
+        # 新版 PyAV 是 push / pull，老版本是 vpush / vpull
+        push = getattr(self._graph, "push", None) or self._graph.vpush
+        pull = getattr(self._graph, "pull", None) or self._graph.vpull
+        push(frame)
+        return pull()
+
+    def _convert(self, frame):
+        out_w, out_h = self._output_size(frame.width, frame.height)
+        if self.crop:
+            return self._filter_through_graph(frame, out_w, out_h)
+        if (out_w, out_h) == (frame.width, frame.height):
+            return frame.reformat(format=self.output_format)
+        return frame.reformat(width=out_w, height=out_h, format=self.output_format)
+
+    def _publishable(self, frame):
+        """解码帧 → 按输出设置转换的只读 ndarray；写入复用缓冲区，已发布的缓冲区绝不会被改写"""
+        out = self._convert(frame)
+        channels = OUTPUT_CHANNELS[self.output_format]
+        plane = out.planes[0]
+        h, w = out.height, out.width
+        src = np.frombuffer(plane, dtype=np.uint8).reshape(h, plane.line_size)[:, :w * channels]
+        shape = (h, w, channels) if channels > 1 else (h, w)
+        buf = self._free_buffer(shape)
+        np.copyto(buf, src.reshape(shape))
+        buf.setflags(write=False)
+        return buf
+
     def start(self):
         if self.running:
             print("[FrameListener] ⚠️ 已在运行，先停止再重新启动")
             self.stop()
             time.sleep(0.05)  # 稍微短一点就好
 
+        if self.source is not None:
+            self.running = True
+            self.ready_event.clear()
+            threading.Thread(target=self._loop, daemon=True).start()
+            print("[FrameListener] ✅ 已启动回放帧监听线程")
+            return
+
         try:
             self.sock = socket.socket()
             self.sock.connect((self.host, self.port))
@@ -85,16 +230,44 @@ class FrameListener:
             print(f"[FrameListener] ❌ 无法连接推流端口: {e}")
             self.running = False
 
+    def _materialize(self, seq, raw):
+        """把 seq 对应的解码帧转成 ndarray，结果按 (seq, 输出设置) 缓存"""
+        if raw is None:
+            return None
+        key = (seq, self.output_format, self.scale, self.crop)
+        with self._convert_lock:
+            if self._converted_key != key:
+                self._converted = self._publishable(raw)
+                self._converted_key = key
+            return self._converted
+
+    @property
+    def latest_frame(self):
+        return self.get_latest_frame()
+
     def get_latest_frame(self):
-        """外部调用：获取最近一帧图像（OpenCV 格式）"""
+        """外部调用：获取最近一帧图像（OpenCV 格式，只读，不拷贝；需要修改请自行 copy()）"""
         with self._lock:
-            return self.latest_frame.copy() if self.latest_frame is not None else None
+            seq, raw = self.frame_seq, self._latest_raw
+        return self._materialize(seq, raw)
+
+    def wait_for_new_frame(self, after_seq, timeout=None):
+        """外部调用：阻塞到出现序号大于 after_seq 的新帧，返回 (seq, frame)；超时或已停止返回 (after_seq, None)"""
+        with self._frame_cond:
+            ok = self._frame_cond.wait_for(
+                lambda: self.frame_seq > after_seq or not self.running, timeout)
+            if not ok or self.frame_seq <= after_seq or self._latest_raw is None:
+                return after_seq, None
+            seq, raw = self.frame_seq, self._latest_raw
+        return seq, self._materialize(seq, raw)
 
     def stop(self):
         if not self.running:
             print("[FrameListener] ⚠️ stop 调用时已是非运行状态")
             return
         self.running = False
+        with self._frame_cond:
+            self._frame_cond.notify_all()
         try:
             if self.sock:
                 self.sock.close()
@@ -103,6 +276,19 @@ class FrameListener:
             pass
         self.sock = None
 
+    def start_recording(self, prefix):
+        """把之后收到的原始包录到 prefix.pkt / prefix.idx"""
+        self.stop_recording()
+        self.recorder = PacketRecorder(prefix)
+        print(f"[FrameListener] ⏺️ 开始录制: {prefix}")
+        return self.recorder
+
+    def stop_recording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+            print(f"[FrameListener] ⏹️ 录制结束: {recorder.prefix}（{recorder.count} 个包）")
+
     def is_ready(self):
         """是否首帧已解码"""
         return self.ready_event.is_set()
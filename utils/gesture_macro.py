@@ -0,0 +1,69 @@
+# utils/gesture_macro.py
+# ✅ 手势宏：固定的点击 / 等待序列编译成一条指令，服务端按节奏执行完后只回一次应答
+# 指令格式："macro tap x y;wait ms;swipe x1 y1 x2 y2 ms\n"（caps 含 "macro" 时可用）
+# checkpoint() 标记可中止的位置：带 abort 执行时宏在这里拆段，每段做完判断一次是否暂停
+import time
+
+MACRO_ACK_GRACE = 1.0  # 等完成应答时在宏总时长之外多等的时间（秒）
+
+
+class GestureMacro:
+    def __init__(self, name=""):
+        self.name = name
+        self.steps = []  # [("tap", x, y) | ("wait", ms) | ("swipe", x1, y1, x2, y2, ms) | ("check",)]
+
+    def tap(self, x, y, wait=0.0):
+        """点击后等待 wait 秒"""
+        self.steps.append(("tap", int(x), int(y)))
+        return self.wait(wait)
+
+    def swipe(self, x1, y1, x2, y2, duration=500, wait=0.0):
+        self.steps.append(("swipe", int(x1), int(y1), int(x2), int(y2), int(duration)))
+        return self.wait(wait)
+
+    def wait(self, seconds):
+        ms = int(seconds * 1000)
+        if ms > 0:
+            self.steps.append(("wait", ms))
+        return self
+
+    def checkpoint(self):
+        self.steps.append(("check",))
+        return self
+
+    def segments(self):
+        """按检查点拆成若干段，每段是一条不含检查点的宏"""
+        parts = [GestureMacro(self.name)]
+        for step in self.steps:
+            if step[0] == "check":
+                parts.append(GestureMacro(self.name))
+            else:
+                parts[-1].steps.append(step)
+        return [part for part in parts if part.steps]
+
+    @property
+    def duration(self):
+        """整条宏在设备上执行的时长（秒）"""
+        ms = sum(step[-1] for step in self.steps if step[0] in ("wait", "swipe"))
+        return ms / 1000.0
+
+    def compile(self):
+        steps = [step for step in self.steps if step[0] != "check"]
+        return "macro " + ";".join(" ".join(str(v) for v in step) for step in steps) + "\n"
+
+    def emulate(self, touch, abort=None):
+        """服务端不支持宏时在客户端逐步执行；touch 为 TouchServerSocket 或输入句柄。
+        在检查点上 abort() 为真时停止，返回是否执行完"""
+        for step in self.steps:
+            if step[0] == "tap":
+                touch.tap(step[1], step[2], delay=0)
+            elif step[0] == "swipe":
+                touch.swipe(*step[1:])
+            elif step[0] == "wait":
+                time.sleep(step[1] / 1000.0)
+            elif abort is not None and abort():
+                return False
+        return True
+
+    def __repr__(self):
+        return f"GestureMacro({self.name!r}, {len(self.steps)} 步, {self.duration:.1f}s)"
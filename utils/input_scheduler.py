@@ -0,0 +1,204 @@
+# utils/input_scheduler.py
+# ✅ 统一输入调度：6100 触控连接只由调度线程写出，各模块按来源提交点击 / 滑动任务
+import threading
+import time
+from collections import deque
+from utils.gesture_macro import MACRO_ACK_GRACE
+
+# 数字越小越优先；采集最低，裂隙 / 远征 / 研究的点击不会排在采集后面
+SOURCE_PRIORITY = {"rift": 0, "expedition": 0, "research": 0, "assist": 1, "collect": 2}
+DEFAULT_PRIORITY = 1
+# 同一来源两次写出的最小间隔（秒）
+SOURCE_MIN_INTERVAL = {"collect": 0.05}
+# 这些来源提交后不等写出；积压超过上限时丢弃最旧的任务
+NON_BLOCKING_SOURCES = {"collect"}
+MAX_BACKLOG = 16
+WRITE_WAIT_TIMEOUT = 2.0
+
+
+class InputJob:
+    __slots__ = ("source", "cmd", "duration", "created_at", "sent", "ack", "_event")
+
+    def __init__(self, source, cmd, duration=0.0):
+        self.source = source
+        self.cmd = cmd
+        self.duration = duration  # 滑动期间不写出其它任务，避免打断手势
+        self.created_at = time.time()
+        self.sent = False
+        self.ack = None  # 写出后的 TouchAck
+        self._event = threading.Event()
+
+    def wait(self, timeout=None):
+        """等待任务被写出（或丢弃），返回是否已写出"""
+        self._event.wait(timeout)
+        return self.sent
+
+    def _finish(self, ack):
+        self.ack = ack
+        self.sent = ack is not None
+        self._event.set()
+
+
+class InputClient:
+    """某个来源的输入句柄，接口与 TouchServerSocket 的 tap / swipe 一致，可直接替换原来的 server_socket"""
+
+    def __init__(self, scheduler, source):
+        self.scheduler = scheduler
+        self.source = source
+        self.blocking = source not in NON_BLOCKING_SOURCES
+
+    @property
+    def is_connected(self):
+        return self.scheduler.touch.is_connected
+
+    def connect(self):
+        self.scheduler.touch.connect()
+
+    def with_source(self, source):
+        """同一调度器上另一个来源的句柄"""
+        return self.scheduler.client(source)
+
+    def cancel(self):
+        """丢弃本来源还没写出的任务（模块停止时调用），返回丢弃数"""
+        return self.scheduler.cancel(self.source)
+
+    def tap(self, x, y, delay=0.05):
+        job = self.scheduler.submit(self.source, f"tap {x} {y}\n")
+        if self.blocking:
+            job.wait(WRITE_WAIT_TIMEOUT)
+        time.sleep(delay)
+
+    def swipe(self, x1, y1, x2, y2, duration=500):
+        duration = int(duration)
+        job = self.scheduler.submit(self.source, f"swipe {x1} {y1} {x2} {y2} {duration}\n", duration / 1000.0)
+        if self.blocking:
+            job.wait(WRITE_WAIT_TIMEOUT)
+        time.sleep(duration / 1000.0)
+
+    def run_macro(self, macro, abort=None):
+        """服务端支持宏时写出并等完成应答，否则在客户端逐步模拟；返回是否按宏执行完毕。
+        abort 为暂停判断：宏在检查点处拆段发送，段与段之间 abort() 为真即停止"""
+        if not self.scheduler.touch.supports("macro"):
+            return macro.emulate(self, abort)
+        for i, segment in enumerate(macro.segments() if abort is not None else [macro]):
+            if i and abort():
+                return False
+            if not self._send_macro(segment):
+                return False
+        return True
+
+    def _send_macro(self, macro):
+        job = self.scheduler.submit(self.source, macro.compile(), macro.duration)
+        if not job.wait(WRITE_WAIT_TIMEOUT):
+            return False
+        resp = job.ack.wait(macro.duration + MACRO_ACK_GRACE)
+        if resp is None:
+            print(f"⚠️ 宏未收到完成应答: {macro}")
+        return resp is not None
+
+
+class InputScheduler:
+    def __init__(self, touch, max_backlog=MAX_BACKLOG):
+        self.touch = touch
+        self.max_backlog = max_backlog
+        self._queues = {}     # source → deque[InputJob]
+        self._last_sent = {}  # source → 上次写出时间
+        self._busy_until = 0.0
+        self._clients = {}
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.stats = {"submitted": 0, "sent": 0, "dropped": 0, "failed": 0, "cancelled": 0}
+
+    def client(self, source):
+        with self._cond:
+            if source not in self._clients:
+                self._clients[source] = InputClient(self, source)
+            return self._clients[source]
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return self
+            self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self.cancel_all()
+
+    def cancel(self, *sources):
+        """丢弃指定来源排队中的任务（已写出的不受影响），返回丢弃数"""
+        with self._cond:
+            pending = [job for source in sources for job in self._queues.pop(source, ())]
+            self.stats["cancelled"] += len(pending)
+        for job in pending:
+            job._finish(None)
+        return len(pending)
+
+    def cancel_all(self):
+        with self._cond:
+            sources = list(self._queues)
+        return self.cancel(*sources)
+
+    def submit(self, source, cmd, duration=0.0):
+        job = InputJob(source, cmd, duration)
+        dropped = None
+        with self._cond:
+            q = self._queues.setdefault(source, deque())
+            if source in NON_BLOCKING_SOURCES and len(q) >= self.max_backlog:
+                dropped = q.popleft()
+                self.stats["dropped"] += 1
+            q.append(job)
+            self.stats["submitted"] += 1
+            self._cond.notify()
+        if dropped is not None:
+            dropped._finish(None)
+        if not self._running:
+            self.start()
+        return job
+
+    def _pick(self, now):
+        # 调用方持有 _cond：返回 (可写出的任务, 最早需要再检查的等待时长)
+        best, best_key, wait = None, None, None
+        for source, q in self._queues.items():
+            if not q:
+                continue
+            ready_at = self._last_sent.get(source, 0.0) + SOURCE_MIN_INTERVAL.get(source, 0.0)
+            if ready_at > now:
+                wait = ready_at - now if wait is None else min(wait, ready_at - now)
+                continue
+            key = (SOURCE_PRIORITY.get(source, DEFAULT_PRIORITY), q[0].created_at)
+            if best_key is None or key < best_key:
+                best, best_key = q[0], key
+        return best, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running:
+                        return
+                    now = time.time()
+                    if self._busy_until > now:
+                        self._cond.wait(self._busy_until - now)
+                        continue
+                    job, wait = self._pick(now)
+                    if job is not None:
+                        break
+                    self._cond.wait(wait)
+                self._queues[job.source].popleft()
+                self._last_sent[job.source] = now
+            if not self.touch.is_connected:
+                self.touch.connect()
+            ack = self.touch.send_nowait(job.cmd, job.duration)
+            with self._cond:
+                self.stats["sent" if ack is not None else "failed"] += 1
+                if ack is not None and job.duration:
+                    self._busy_until = time.time() + job.duration
+            job._finish(ack)
+
@@ -0,0 +1,147 @@
+# utils/ocr_pool.py
+# ✅ OCR 进程池：识别放到子进程里跑，流程线程拿到 Future 后可以继续点击 / 轮询，需要结果时再取
+# ROI 通过共享内存传给子进程（不走 pickle 拷贝），引擎在每个子进程里只初始化一次
+# 两个池：tesseract_executor（层数 / 倒计时 / 体力）与 easyocr_executor（研究状态 / 可研发），
+# 互不牵连——只跑裂隙时不会有进程去加载 torch
+# 子进程一律 spawn 启动（Windows 本来就是，Linux 上也不 fork 已经跑着多个线程的主进程），
+# 子进程侧代码在 utils/ocr_worker.py
+# 空闲释放：EasyOCR 池空闲超过 idle_seconds 就整个关掉（torch / 模型随子进程一起退出），下次提交时重新拉起
+import concurrent.futures
+import multiprocessing
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils import ocr_worker
+from utils.ocr_service import fmt_mb, rss_mb
+
+TESSERACT_WORKERS = 2
+EASYOCR_WORKERS = 1  # EasyOCR 模型每个进程一份（数百 MB），且 torch 自身已多线程，一个进程足够
+EASYOCR_IDLE_SECONDS = 15 * 60  # 研究检查几小时才触发一次，空闲 15 分钟就关池；0 / None 表示常驻
+IDLE_CHECK_INTERVAL = 30.0
+
+
+class OcrExecutor:
+    def __init__(self, engine, workers, idle_seconds=None):
+        self.engine = engine
+        self.workers = workers
+        self.idle_seconds = idle_seconds
+        self._pool = None
+        self._in_flight = 0      # 已提交未完成的识别数，期间不关池
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self.evict_count = 0
+
+    def _start_locked(self):
+        # 调用方持有 self._lock
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=ocr_worker.init_worker, initargs=(self.engine,))
+            self._last_used = time.time()
+            print(f"[OcrPool] 🚀 {self.engine} 进程池已启动（{self.workers} 个进程）")
+            if self.idle_seconds:
+                # 每个池一条空闲检查线程，池被关掉或换掉后退出
+                threading.Thread(target=self._watch_idle, args=(self._pool,), daemon=True).start()
+        return self._pool
+
+    def start(self):
+        """提前拉起进程池（子进程启动时就开始初始化引擎），已启动时什么也不做"""
+        with self._lock:
+            return self._start_locked()
+
+    def submit(self, image, **kwargs):
+        """提交一次识别，返回 Future；tesseract 结果为文本，easyocr 结果与 readtext 相同"""
+        image = np.ascontiguousarray(image)
+        shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+        np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+        try:
+            # 在锁内提交：空闲检查线程不会在取到池和提交之间把池关掉
+            with self._lock:
+                future = self._start_locked().submit(
+                    ocr_worker.run, self.engine, shm.name, image.shape, image.dtype.str, kwargs)
+                self._in_flight += 1
+        except (BrokenProcessPool, RuntimeError) as e:
+            _release(shm)
+            print(f"[OcrPool] ⚠️ {self.engine} 进程池不可用，本次在当前线程识别: {e}")
+            with self._lock:
+                self._pool = None  # 下次提交时重建
+            return self._run_inline(image, kwargs)
+        future.add_done_callback(lambda _: self._done(shm))
+        return future
+
+    def _done(self, shm):
+        _release(shm)
+        with self._lock:
+            self._in_flight -= 1
+            self._last_used = time.time()
+
+    def _run_inline(self, image, kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(ocr_worker.recognize(self.engine, image, kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def readtext(self, image, **kwargs):
+        return self.submit(image, **kwargs)
+
+    def image_to_string(self, image, lang="eng", config=""):
+        return self.submit(image, lang=lang, config=config)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    # --- 空闲释放 ---
+    def _watch_idle(self, pool):
+        while True:
+            idle_seconds = self.idle_seconds
+            if not idle_seconds:
+                return
+            time.sleep(min(IDLE_CHECK_INTERVAL, max(idle_seconds / 4, 1.0)))
+            with self._lock:
+                if self._pool is not pool:
+                    return
+                idle = time.time() - self._last_used
+            if idle >= idle_seconds and self.evict(f"空闲 {idle:.0f}s", pool):
+                return
+
+    def evict(self, reason="手动释放", expected=None):
+        """关掉空闲的进程池，子进程连同引擎一起退出；有识别未完成、或池已不是 expected 时不关，返回是否关了"""
+        with self._lock:
+            pool = self._pool
+            if pool is None or self._in_flight or (expected is not None and pool is not expected):
+                return False
+            self._pool = None
+        workers = list(getattr(pool, "_processes", None) or {})
+        before_main = rss_mb()
+        before_workers = sum(rss_mb(pid) or 0.0 for pid in workers)
+        pool.shutdown(wait=True)  # 等子进程真正退出，之后的内存数字才准
+        self.evict_count += 1
+        print(f"[OcrPool] 🧹 {self.engine} 进程池已关闭（{reason}），"
+              f"内存：主进程 {fmt_mb(before_main)} + OCR 子进程 {fmt_mb(before_workers)} → 主进程 {fmt_mb(rss_mb())}")
+        return True
+
+
+def _release(shm):
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+tesseract_executor = OcrExecutor("tesseract", TESSERACT_WORKERS)
+easyocr_executor = OcrExecutor("easyocr", EASYOCR_WORKERS, idle_seconds=EASYOCR_IDLE_SECONDS)
+
+
+def shutdown_ocr_executors():
+    tesseract_executor.shutdown()
+    easyocr_executor.shutdown()
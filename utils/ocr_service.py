@@ -0,0 +1,117 @@
+# utils/ocr_service.py
+# ✅ EasyOCR 按需加载：导入本模块不碰 torch；warm_up() 在后台线程加载模型，
+# 模型没就绪时的 readtext 调用会阻塞等待，并记录实际等了多久
+# 本模块在 OCR 子进程里运行（utils/ocr_worker）；空闲释放由主进程关停整个 EasyOCR 进程池完成（utils/ocr_pool），
+# 只丢掉 Reader 对象时 torch / EasyOCR 仍留在子进程里，省不下多少内存
+import os
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def rss_mb(pid=None):
+    """进程常驻内存（MB），pid 默认为当前进程；没装 psutil 时在 Linux 上读 /proc，都拿不到返回 None"""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def fmt_mb(value):
+    return "未知" if value is None else f"{value:.0f}MB"
+
+
+class OcrService:
+    def __init__(self, langs=("ch_sim",)):
+        self.langs = list(langs)
+        self._reader = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._loading = None  # 正在加载的后台线程
+        self.load_seconds = None  # 最近一次加载耗时
+        self.wait_count = 0       # 因模型未就绪而阻塞的调用次数
+        self.wait_seconds = 0.0   # 累计阻塞时长
+        self.load_count = 0
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def _load(self):
+        start = time.time()
+        try:
+            import torch
+            import easyocr
+
+            try:
+                gpu_available = torch.cuda.is_available()
+            except Exception:
+                gpu_available = False
+            # 如果 CPU 版，强制设置 False，防止版本号里出现 +cpu 误判
+            if "+cpu" in torch.__version__:
+                gpu_available = False
+
+            print(f"🚀 EasyOCR 初始化，GPU 可用: {gpu_available}")
+            reader = easyocr.Reader(self.langs, gpu=gpu_available)
+            with self._lock:
+                self._reader = reader
+                self.load_count += 1
+            self.load_seconds = time.time() - start
+            print(f"✅ EasyOCR 模型加载完成，用时 {self.load_seconds:.1f}s，OCR 子进程内存 {fmt_mb(rss_mb())}")
+        except Exception as e:
+            print(f"❌ EasyOCR 加载失败: {e}")
+        finally:
+            with self._lock:
+                self._loading = None
+            self._ready.set()
+
+    def warm_up(self):
+        """后台开始加载模型，立即返回；已加载或正在加载时什么也不做"""
+        with self._lock:
+            if self._reader is not None or self._loading is not None:
+                return
+            self._ready.clear()
+            self._loading = threading.Thread(target=self._load, daemon=True)
+            self._loading.start()
+
+    def reader(self):
+        """取 EasyOCR Reader；模型未就绪时阻塞到加载完成，加载失败返回 None"""
+        if self._reader is None:
+            self.warm_up()
+        if not self._ready.is_set():
+            start = time.time()
+            self._ready.wait()
+            waited = time.time() - start
+            self.wait_count += 1
+            self.wait_seconds += waited
+            print(f"⏳ OCR 模型未就绪，本次等待 {waited:.2f}s")
+        return self._reader
+
+    def readtext(self, image, **kwargs):
+        reader = self.reader()
+        if reader is None:
+            return []
+        return reader.readtext(image, **kwargs)
+
+    def stats(self):
+        return {
+            "loaded": self._reader is not None,
+            "load_count": self.load_count,
+            "load_seconds": self.load_seconds,
+            "wait_count": self.wait_count,
+            "wait_seconds": round(self.wait_seconds, 2),
+            "rss_mb": rss_mb(),
+        }
+
+
+ocr_service = OcrService()
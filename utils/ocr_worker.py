@@ -0,0 +1,32 @@
+# utils/ocr_worker.py
+# ✅ OCR 子进程入口：进程池只引用本模块，子进程里只有 OCR 引擎，不碰设备连接 / 界面
+import numpy as np
+from multiprocessing import shared_memory
+
+from utils.ocr_service import ocr_service
+from utils.tesseract_engine import image_to_string, tesseract_engine
+
+
+def init_worker(engine):
+    if engine == "easyocr":
+        ocr_service.warm_up()  # 后台加载，首个任务到达时若未就绪会等待
+    else:
+        tesseract_engine.preload()
+
+
+def recognize(engine, image, kwargs):
+    if engine == "easyocr":
+        return ocr_service.readtext(image, **kwargs)
+    return image_to_string(image, **kwargs)
+
+
+def run(engine, name, shape, dtype, kwargs):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        try:
+            return recognize(engine, image, kwargs)
+        finally:
+            del image  # 关闭共享内存前必须释放对其缓冲区的引用
+    finally:
+        shm.close()
@@ -0,0 +1,182 @@
+# utils/recorder.py
+# ✅ 原始数据录制 / 回放：H.264 包和截图按收到的原样落盘（不重新编码），配一份紧凑索引；
+# 黑匣子在内存里保留最近 N 秒，流程失败时整段导出，之后可以喂回 FrameListener 复现 / 做基准
+#
+# 文件格式：<prefix>.pkt 为 4 字节长度 + 数据 连续追加（与 6101 线上格式一致）
+#          <prefix>.idx 每条记录一个 INDEX_ENTRY（接收时间戳, 数据在 .pkt 中的偏移, 长度, 类型）
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+KIND_H264 = 0
+KIND_IMAGE = 1
+INDEX_ENTRY = struct.Struct(">dQIB")
+RECORDING_DIR = "recordings"
+
+
+def _is_keyframe(payload):
+    """Annex-B 包里是否有 SPS / IDR，黑匣子从这里开始才能独立解码"""
+    data = bytes(payload[:4096])
+    i = data.find(b"\x00\x00\x01")
+    while i != -1 and i + 3 < len(data):
+        if data[i + 3] & 0x1F in (5, 7):
+            return True
+        i = data.find(b"\x00\x00\x01", i + 3)
+    return False
+
+
+class PacketRecorder:
+    """追加写录制文件；write 可以直接传 memoryview，不做额外拷贝"""
+
+    def __init__(self, prefix):
+        os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+        self.prefix = prefix
+        self._data = open(prefix + ".pkt", "ab")
+        self._index = open(prefix + ".idx", "ab")
+        self._offset = self._data.tell()
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, payload, kind=KIND_H264, ts=None):
+        length = len(payload)
+        with self._lock:
+            if self._data is None:
+                return
+            self._data.write(struct.pack(">I", length))
+            self._data.write(payload)
+            self._index.write(INDEX_ENTRY.pack(time.time() if ts is None else ts, self._offset + 4, length, kind))
+            self._offset += 4 + length
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._data is None:
+                return
+            self._data.close()
+            self._index.close()
+            self._data = self._index = None
+
+
+class RecordingReader:
+    """按索引顺序读出 (时间戳, 类型, 数据)"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        with open(prefix + ".idx", "rb") as f:
+            raw = f.read()
+        self.entries = [INDEX_ENTRY.unpack_from(raw, i) for i in range(0, len(raw) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        with open(self.prefix + ".pkt", "rb") as f:
+            for ts, offset, length, kind in self.entries:
+                f.seek(offset)
+                yield ts, kind, f.read(length)
+
+    @property
+    def duration(self):
+        return self.entries[-1][0] - self.entries[0][0] if self.entries else 0.0
+
+
+class ReplaySource:
+    """录制回放：read_packet() 按录制时的间隔（除以 speed）返回下一个 H.264 包，结束返回 None；
+    speed=0 表示不等待，尽快喂完"""
+
+    def __init__(self, prefix, speed=1.0, loop=False):
+        self.reader = RecordingReader(prefix)
+        self.speed = speed
+        self.loop = loop
+        self._iter = None
+        self._t0 = None
+
+    def _packets(self):
+        while True:
+            for ts, kind, payload in self.reader:
+                if kind == KIND_H264:
+                    yield ts, payload
+            if not self.loop:
+                return
+
+    def read_packet(self):
+        if self._iter is None:
+            self._iter = self._packets()
+        try:
+            ts, payload = next(self._iter)
+        except StopIteration:
+            return None
+        if self.speed > 0:
+            now = time.time()
+            if self._t0 is None or ts - self._t0[0] < 0:
+                self._t0 = (ts, now)  # 首包（或循环回到开头）对齐到当前时间
+            due = self._t0[1] + (ts - self._t0[0]) / self.speed
+            if due > now:
+                time.sleep(due - now)
+        return payload
+
+    def close(self):
+        self._iter = None
+
+
+class BlackBox:
+    """内存环形缓冲：保留最近 seconds 秒（且不超过 max_bytes）的原始数据，失败时 dump 落盘"""
+
+    def __init__(self, seconds=20.0, max_bytes=64 * 1024 * 1024, kind=KIND_H264):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.kind = kind
+        self.enabled = True
+        self._items = deque()  # (时间戳, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def push(self, payload, ts=None):
+        if not self.enabled:
+            return
+        ts = time.time() if ts is None else ts
+        data = bytes(payload)  # 接收缓冲区会被复用，这里必须拷贝
+        with self._lock:
+            self._items.append((ts, data))
+            self._bytes += len(data)
+            while self._items and (ts - self._items[0][0] > self.seconds or self._bytes > self.max_bytes):
+                self._bytes -= len(self._items.popleft()[1])
+
+    def snapshot(self):
+        with self._lock:
+            items = list(self._items)
+        if self.kind == KIND_H264:
+            # 从第一个关键帧开始，导出的片段才能单独解码
+            start = next((i for i, (_, data) in enumerate(items) if _is_keyframe(data)), 0)
+            items = items[start:]
+        return items
+
+    def dump(self, tag, directory=RECORDING_DIR):
+        """导出到 directory/blackbox_<tag>_<时间>，返回文件前缀；没有数据返回 None"""
+        items = self.snapshot()
+        if not items:
+            return None
+        prefix = os.path.join(directory, f"blackbox_{tag}_{time.strftime('%Y%m%d_%H%M%S')}")
+        recorder = PacketRecorder(prefix)
+        for ts, data in items:
+            recorder.write(data, self.kind, ts)
+        recorder.close()
+        print(f"[BlackBox] 📦 已导出最近 {items[-1][0] - items[0][0]:.1f}s / {len(items)} 条记录: {prefix}")
+        return prefix
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+
+# 进程级黑匣子：视频流约 8Mbps，20 秒约 20MB；截图 PNG 单张 2~3MB，只留最近 32MB
+video_black_box = BlackBox(seconds=20.0, kind=KIND_H264)
+screenshot_black_box = BlackBox(seconds=60.0, max_bytes=32 * 1024 * 1024, kind=KIND_IMAGE)
+
+
+def dump_black_boxes(tag):
+    """流程失败时调用：导出视频流和截图两个黑匣子"""
+    return [p for p in (video_black_box.dump(tag + "_video"), screenshot_black_box.dump(tag + "_screenshot")) if p]
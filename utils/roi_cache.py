@@ -0,0 +1,64 @@
+# utils/roi_cache.py
+# ✅ ROI 变化检测：同一 (模板, 区域) 的像素和上次相比基本没变时，直接返回上次的匹配分数
+from collections import OrderedDict
+import threading
+import numpy as np
+
+SAMPLE_STEP = 2        # 指纹隔行隔列取样，只看 1/4 像素
+MAD_TOLERANCE = 1.0    # 取样像素平均绝对差不超过该值视为未变化（吸收视频流压缩噪声）
+MAX_PIXEL_DELTA = 32   # 任一取样像素变化超过该值即视为变化（大区域里出现小图标时平均差不明显）
+MAX_ENTRIES = 256
+
+
+class RoiScoreCache:
+    def __init__(self, step=SAMPLE_STEP, tolerance=MAD_TOLERANCE, max_delta=MAX_PIXEL_DELTA,
+                 max_entries=MAX_ENTRIES):
+        self.step = step
+        self.tolerance = tolerance
+        self.max_delta = max_delta
+        self.max_entries = max_entries
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key → (取样指纹, 分数)
+        self._lock = threading.Lock()
+
+    def _fingerprint(self, area):
+        return np.array(area[::self.step, ::self.step], dtype=np.int16)
+
+    def lookup(self, key, area):
+        """区域未变化时返回 (True, 上次分数)；否则返回 (False, 本次指纹)，算完分数后交给 store()"""
+        sample = self._fingerprint(area)
+        if not self.enabled:
+            return False, sample
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0].shape == sample.shape:
+                diff = np.abs(entry[0] - sample)
+                if diff.mean() <= self.tolerance and diff.max() <= self.max_delta:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+            self.misses += 1
+        return False, sample
+
+    def store(self, key, sample, score):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (sample, score)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return f"命中 {self.hits}/{total}" + (f" ({self.hits * 100 / total:.0f}%)" if total else "")
+
+
+roi_cache = RoiScoreCache()
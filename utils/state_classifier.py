@@ -0,0 +1,84 @@
+# utils/state_classifier.py
+# ✅ 多模板单次分类器：一组 (模板, 区域, 阈值) 规则对同一帧按优先级一次算完
+from collections import namedtuple
+import cv2
+from utils.template_store import get_template
+from utils.frame_context import as_frame
+from utils.roi_cache import roi_cache
+
+# priority 越小越先判断；color=True 时用彩色模板匹配原图
+MatchRule = namedtuple("MatchRule", ["name", "template", "region", "threshold", "priority", "color"])
+MatchRule.__new__.__defaults__ = (0.85, 0, False)
+
+
+def match_score(screen, template, region, color=False):
+    """单模板匹配分数；模板缺失或区域比模板小时返回 None"""
+    frame = as_frame(screen)
+    tpl = get_template(template, color=color)
+    if tpl is None:
+        return None
+    area = frame.roi(region) if color else frame.gray_roi(region)
+    if area.shape[0] < tpl.shape[0] or area.shape[1] < tpl.shape[1]:
+        print(f"⚠️ 区域尺寸 {area.shape} 小于模板 {tpl.shape}，跳过匹配：{template}")
+        return None
+    key = (template, tuple(region), color)
+    hit, value = roi_cache.lookup(key, area)
+    if hit:
+        return value
+    res = cv2.matchTemplate(area, tpl, cv2.TM_CCOEFF_NORMED)
+    score = cv2.minMaxLoc(res)[1]
+    roi_cache.store(key, value, score)
+    return score
+
+
+class ClassifyResult:
+    def __init__(self):
+        self.scores = {}     # name → 分数（未判断 / 无法匹配的规则不在其中）
+        self.matches = []    # 达到阈值的规则名，按优先级排列
+        self.matched = None  # 优先级最高的命中规则名
+        self.reused = []     # 区域未变化、直接沿用上一帧分数的规则名
+
+    def __bool__(self):
+        return self.matched is not None
+
+    def __repr__(self):
+        return f"ClassifyResult(matched={self.matched}, scores={self.scores})"
+
+
+class StateClassifier:
+    def __init__(self, rules):
+        # 同优先级保持声明顺序
+        self.rules = sorted(rules, key=lambda r: r.priority)
+        self._by_name = {r.name: r for r in self.rules}
+        self._memo = {}  # name → (frame_id, score)，配合增量截图跳过未变化区域
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def classify(self, screen, names=None, early_exit=True):
+        """对同一帧按优先级判断规则；names 限定候选集合，early_exit 命中即停"""
+        frame = as_frame(screen)
+        tiles = frame.tiles
+        result = ClassifyResult()
+        for rule in self.rules:
+            if names is not None and rule.name not in names:
+                continue
+            memo = self._memo.get(rule.name)
+            if (tiles is not None and memo is not None and tiles.base_id
+                    and memo[0] == tiles.base_id and not tiles.region_changed(rule.region)):
+                score = memo[1]
+                result.reused.append(rule.name)
+            else:
+                score = match_score(frame, rule.template, rule.region, rule.color)
+            if tiles is not None:
+                self._memo[rule.name] = (tiles.frame_id, score)
+            if score is None:
+                continue
+            result.scores[rule.name] = score
+            if score >= rule.threshold:
+                result.matches.append(rule.name)
+                if result.matched is None:
+                    result.matched = rule.name
+                    if early_exit:
+                        break
+        return result
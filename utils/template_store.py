@@ -0,0 +1,75 @@
+# utils/template_store.py
+# ✅ 进程级模板仓库：icons/*.png 只解码一次，灰度 / 彩色两份常驻内存，全部只读
+import os
+import glob
+import threading
+import cv2
+import numpy as np
+
+ICON_DIR = "icons"
+
+
+def _normalize(path):
+    # "icons/ZY-FY.png" / "./icons\\ZY-FY.png" 统一成同一个 key
+    return os.path.normpath(path).replace("\\", "/")
+
+
+def _freeze(arr):
+    if arr is not None:
+        arr.setflags(write=False)
+    return arr
+
+
+class TemplateStore:
+    def __init__(self, icon_dir=ICON_DIR):
+        self.icon_dir = icon_dir
+        self._gray = {}
+        self._bgr = {}
+        self._lock = threading.Lock()
+
+    def _load(self, key):
+        # 文件只读一次；灰度仍走 IMREAD_GRAYSCALE 解码，保证和原来 imread(path, 0) 的匹配分数一致
+        bgr = gray = None
+        try:
+            with open(key, "rb") as f:
+                buf = np.frombuffer(f.read(), dtype=np.uint8)
+            bgr = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+            gray = cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE)
+        except OSError:
+            pass
+        if bgr is None or gray is None:
+            print(f"[TemplateStore] ❌ 模板加载失败: {key}")
+        self._bgr[key] = _freeze(bgr)
+        self._gray[key] = _freeze(gray)
+
+    def _get(self, path, table):
+        key = _normalize(path)
+        if key not in table:
+            with self._lock:
+                if key not in table:
+                    self._load(key)
+        return table[key]
+
+    def gray(self, path):
+        """灰度模板（只读 ndarray），加载失败返回 None"""
+        return self._get(path, self._gray)
+
+    def bgr(self, path):
+        """彩色模板（只读 ndarray），加载失败返回 None"""
+        return self._get(path, self._bgr)
+
+    def preload(self):
+        """启动时一次性解码 icons 目录下全部模板"""
+        paths = sorted(glob.glob(os.path.join(self.icon_dir, "*.png")))
+        for path in paths:
+            self.gray(path)
+        print(f"[TemplateStore] ✅ 已预加载 {len(paths)} 个模板")
+        return len(paths)
+
+
+template_store = TemplateStore()
+
+
+def get_template(path, color=False):
+    """外部调用：取模板，color=True 返回 BGR，否则返回灰度"""
+    return template_store.bgr(path) if color else template_store.gray(path)
@@ -0,0 +1,116 @@
+# utils/tesseract_engine.py
+# ✅ 进程内 Tesseract：用 tesserocr 常驻引擎句柄，按 (语言, 配置) 各初始化一次，ndarray 直接送进去，
+# 不再像 pytesseract 那样每次写临时图片再 fork 一个 tesseract 进程
+# 调用方式与 pytesseract.image_to_string 相同；没装 tesserocr 时自动退回 pytesseract
+import shlex
+import threading
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# 侦察体力 n/m：单行、只认数字和斜杠
+DIGITS_CONFIG = "--psm 7 -c tessedit_char_whitelist=0123456789/"
+# 启动时预建的句柄：裂隙层数 / 研究倒计时用 chi_sim，侦察体力用 eng 数字模式
+PRELOAD = [("chi_sim", ""), ("eng", DIGITS_CONFIG)]
+
+
+def parse_config(config):
+    """pytesseract 风格的 config 字符串 → (psm, {变量: 值})"""
+    psm, variables = None, {}
+    args = shlex.split(config or "")
+    i = 0
+    while i < len(args):
+        if args[i] == "--psm" and i + 1 < len(args):
+            psm = int(args[i + 1])
+            i += 2
+        elif args[i] == "-c" and i + 1 < len(args) and "=" in args[i + 1]:
+            key, value = args[i + 1].split("=", 1)
+            variables[key] = value
+            i += 2
+        else:
+            i += 1
+    return psm, variables
+
+
+class _Handle:
+    """一个初始化好的引擎；tesserocr 的 API 对象不能并发使用，每个句柄一把锁"""
+
+    def __init__(self, lang, config):
+        psm, variables = parse_config(config)
+        kwargs = {"lang": lang}
+        if psm is not None:
+            kwargs["psm"] = psm
+        self.api = tesserocr.PyTessBaseAPI(**kwargs)
+        for key, value in variables.items():
+            self.api.SetVariable(key, value)
+        self.lock = threading.Lock()
+
+    def image_to_string(self, image):
+        height, width = image.shape[:2]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        if not image.flags["C_CONTIGUOUS"]:
+            image = image.copy()  # ROI 视图的行跨度不等于宽度，SetImageBytes 需要连续内存
+        with self.lock:
+            self.api.SetImageBytes(image.tobytes(), width, height, channels, width * channels)
+            return self.api.GetUTF8Text()
+
+    def close(self):
+        with self.lock:
+            self.api.End()
+
+
+class TesseractEngine:
+    def __init__(self):
+        self._handles = {}
+        self._lock = threading.Lock()
+        self.in_process = tesserocr is not None
+        if not self.in_process:
+            print("[Tesseract] ⚠️ 未安装 tesserocr，OCR 走 pytesseract（每次调用启动一个进程）")
+
+    def handle(self, lang="eng", config=""):
+        key = (lang, config)
+        handle = self._handles.get(key)
+        if handle is None:
+            with self._lock:
+                handle = self._handles.get(key)
+                if handle is None:
+                    handle = _Handle(lang, config)
+                    self._handles[key] = handle
+                    print(f"[Tesseract] ✅ 引擎已初始化: {lang} {config}".rstrip())
+        return handle
+
+    def preload(self, specs=PRELOAD):
+        """提前初始化常用句柄（chi_sim 加载约需数百毫秒），没有 tesserocr 时什么也不做"""
+        if not self.in_process:
+            return
+        for lang, config in specs:
+            try:
+                self.handle(lang, config)
+            except RuntimeError as e:
+                print(f"[Tesseract] ❌ 引擎初始化失败（{lang}）: {e}")
+
+    def image_to_string(self, image, lang="eng", config=""):
+        """与 pytesseract.image_to_string 相同的调用方式，image 为 ndarray"""
+        if self.in_process:
+            try:
+                return self.handle(lang, config).image_to_string(image)
+            except RuntimeError as e:
+                print(f"[Tesseract] ⚠️ 进程内识别失败，改用 pytesseract: {e}")
+        import pytesseract
+        return pytesseract.image_to_string(image, lang=lang, config=config)
+
+    def close(self):
+        with self._lock:
+            handles, self._handles = list(self._handles.values()), {}
+        for handle in handles:
+            handle.close()
+
+
+tesseract_engine = TesseractEngine()
+
+
+def image_to_string(image, lang="eng", config=""):
+    """外部调用：替代 pytesseract.image_to_string"""
+    return tesseract_engine.image_to_string(image, lang=lang, config=config)